@@ -1,40 +1,96 @@
 import os
 import re
+import asyncio
 import logging
 import sys
 import time
 import traceback
+import threading
 from glob import glob
 from datetime import datetime
+from dataclasses import dataclass
+from typing import Any, Optional
 from langchain_ollama import OllamaLLM, OllamaEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chains.question_answering import load_qa_chain
-from langchain.chains import LLMChain, RetrievalQA
-from langchain.memory import ConversationBufferMemory
 from langchain_community.vectorstores import FAISS, Chroma
 from langchain_community.document_loaders import PyPDFLoader
 
 from config import *
 from utils import *
 from templates import *
+from embedding_cache import CachedEmbeddings
+from answer_cache import SemanticAnswerCache
+from session_memory import SessionMemoryStore
+from prompt_budget import PromptBudget
+from vector_sync import sync_vector_store, corpus_fragment_ids
+from index_builder import EmbeddingIndexBuilder
+from keyword_index import BM25Index, is_keyword_query, reciprocal_rank_fusion
+from fragment_cache import FragmentStore, get_fragment_id
+from retrieval_cache import RetrievalCache, FragmentLookup
+from question_classifier import classify_question
+from response_cleaner import clean_response_artifacts, ArtifactStreamCleaner
 
 logger = logging.getLogger("ai_system")
 
+
+@dataclass
+class RequestContext:
+    """Modelo y LLM resueltos para una sola consulta.
+    
+    Se obtienen de ``llm_cache`` al inicio de la consulta, de modo que las
+    peticiones con modelos distintos no modifican el estado compartido.
+    """
+    model_name: str
+    llm: Any
+    budget: PromptBudget
+    session_id: Optional[str] = None
+
+
 class AISystem:
     def __init__(self):
         self.fragmentos = []
         self.documentos = []
         self.using_vector_db = False
         self.using_chroma = False
-        self.cadena = None
+        self.using_numpy = False
         self.llm = None
         self.llm_cache = {}  # Cache para múltiples modelos
+        self._llm_cache_lock = threading.Lock()
         self.current_model = None
-        self.memory = None
+        # Memoria de conversación por sesión (chatToken), acotada y con TTL
+        self.memory = SessionMemoryStore(
+            max_tokens=SESSION_MEMORY_MAX_TOKENS,
+            summary_max_tokens=SESSION_MEMORY_SUMMARY_TOKENS,
+            max_sessions=SESSION_MEMORY_MAX_SESSIONS,
+            ttl_seconds=SESSION_MEMORY_TTL
+        )
         self.vector_store = None
+        self.embeddings = None
+        self.keyword_index = None  # BM25 sobre los fragmentos (búsqueda híbrida)
+        self.fragment_lookup = None  # ID de fragmento → fragmento (aciertos del cache de recuperación)
+        self.retrieval_cache = RetrievalCache(
+            REDIS_HOST, REDIS_PORT,
+            max_entries=RETRIEVAL_CACHE_SIZE,
+            ttl_seconds=RETRIEVAL_CACHE_TTL,
+            key_prefix=RETRIEVAL_CACHE_PREFIX
+        ) if RETRIEVAL_CACHE_ENABLED else None
+        self.corpus_version = "empty"
+        self._stage_semaphores = None
+        self.answer_cache = SemanticAnswerCache(
+            threshold=ANSWER_CACHE_THRESHOLD,
+            max_entries=ANSWER_CACHE_SIZE,
+            ttl_seconds=ANSWER_CACHE_TTL
+        ) if ANSWER_CACHE_ENABLED else None
         self.chroma_error_details = None
+        self.last_sync_stats = None
+        self.index_build_progress = None
+        self._chroma_collection = None
+        self._reload_lock = threading.Lock()
         self.faiss_error_details = None
+        self.numpy_error_details = None
         self.is_initialized = False
+        # Fases del arranque en segundo plano, expuestas en /health/ready
+        self.startup_phases = {phase: {"status": "pending"} for phase in STARTUP_PHASES}
         self.data_dir = os.path.dirname(CHROMA_PATH) if CHROMA_PATH else "data"
         
         # No inicializar automáticamente, se hará desde el servidor
@@ -49,24 +105,33 @@ class AISystem:
             logger.warning(f"Modelo {model_name} no disponible, usando {DEFAULT_MODEL}")
             model_name = DEFAULT_MODEL
             
-        # Usar cache para evitar recrear instancias
-        if model_name in self.llm_cache:
+        # Usar cache para evitar recrear instancias (lectura sin lock)
+        llm_instance = self.llm_cache.get(model_name)
+        if llm_instance is not None:
             logger.debug(f"Usando LLM cacheado para modelo: {model_name}")
-            return self.llm_cache[model_name]
+            return llm_instance
             
         try:
-            model_config = AVAILABLE_MODELS[model_name]
-            logger.info(f"Creando nueva instancia LLM para modelo: {model_name}")
-            
-            llm_instance = OllamaLLM(
-                model=model_config["name"],
-                temperature=model_config["temperature"],
-                base_url=OLLAMA_URL  # Usar URL configurada desde environment
-            )
-            
-            # Cachear la instancia
-            self.llm_cache[model_name] = llm_instance
-            logger.info(f"✅ LLM {model_name} creado y cacheado")
+            with self._llm_cache_lock:
+                # Otra petición pudo crearlo mientras esperábamos el lock
+                llm_instance = self.llm_cache.get(model_name)
+                if llm_instance is not None:
+                    return llm_instance
+                
+                model_config = AVAILABLE_MODELS[model_name]
+                logger.info(f"Creando nueva instancia LLM para modelo: {model_name}")
+                
+                llm_instance = OllamaLLM(
+                    model=model_config["name"],
+                    temperature=model_config["temperature"],
+                    # Misma ventana que usa el presupuesto de tokens del prompt
+                    num_ctx=model_config.get("context_window", DEFAULT_CONTEXT_WINDOW),
+                    base_url=OLLAMA_URL  # Usar URL configurada desde environment
+                )
+                
+                # Cachear la instancia
+                self.llm_cache[model_name] = llm_instance
+                logger.info(f"✅ LLM {model_name} creado y cacheado")
             
             return llm_instance
             
@@ -77,6 +142,68 @@ class AISystem:
                 return self.get_or_create_llm(DEFAULT_MODEL)
             raise
     
+    def create_embeddings(self):
+        """Crea el modelo de embeddings envuelto en el cache de consultas"""
+        base_embeddings = OllamaEmbeddings(
+            model=EMBEDDING_MODEL,
+            base_url=OLLAMA_URL  # Usar URL configurada desde environment
+        )
+        persist_path = None
+        if EMBEDDING_CACHE_PERSIST:
+            os.makedirs(os.path.dirname(EMBEDDING_CACHE_PATH), exist_ok=True)
+            persist_path = EMBEDDING_CACHE_PATH
+        return CachedEmbeddings(
+            base_embeddings,
+            model_name=EMBEDDING_MODEL,
+            max_entries=EMBEDDING_CACHE_SIZE,
+            persist_path=persist_path,
+            persist_max_entries=EMBEDDING_CACHE_DISK_MAX
+        )
+    
+    def create_index_builder(self, embeddings):
+        """Constructor de índices con lotes concurrentes y checkpoint reanudable"""
+        def report(progress):
+            self.index_build_progress = progress
+        
+        return EmbeddingIndexBuilder(
+            embeddings,
+            model_name=EMBEDDING_MODEL,
+            batch_size=INDEX_EMBEDDING_BATCH_SIZE,
+            max_in_flight=INDEX_EMBEDDING_MAX_IN_FLIGHT,
+            checkpoint_path=INDEX_CHECKPOINT_PATH,
+            checkpoint_max_entries=INDEX_CHECKPOINT_MAX,
+            progress_callback=report
+        )
+    
+    def get_embedding_cache_stats(self):
+        """Retorna hits/misses del cache de embeddings de consultas"""
+        if isinstance(self.embeddings, CachedEmbeddings):
+            return self.embeddings.get_stats()
+        return {}
+    
+    def refresh_corpus_version(self):
+        """Recalcula la versión del corpus e invalida el cache de respuestas si cambió"""
+        metadata = load_cache_metadata(CACHE_DIR)
+        new_version = compute_corpus_version(metadata.get("pdf_files", []) if metadata else [])
+        if new_version != self.corpus_version:
+            logger.info(f"📚 Versión del corpus: {self.corpus_version} → {new_version}")
+            self.corpus_version = new_version
+            if self.answer_cache is not None:
+                self.answer_cache.invalidate(keep_corpus_version=new_version)
+        return self.corpus_version
+    
+    def get_retrieval_cache_stats(self):
+        """Retorna hits/misses del cache de resultados de recuperación"""
+        if self.retrieval_cache is not None:
+            return self.retrieval_cache.get_stats()
+        return {}
+    
+    def get_answer_cache_stats(self):
+        """Retorna hits/misses del cache semántico de respuestas"""
+        if self.answer_cache is not None:
+            return self.answer_cache.get_stats()
+        return {}
+    
     def switch_model(self, model_name):
         """Cambia el modelo activo del sistema preservando todo el contexto"""
         try:
@@ -85,54 +212,15 @@ class AISystem:
             # Obtener o crear la instancia del LLM
             new_llm = self.get_or_create_llm(model_name)
             
-            # Preservar estado anterior para rollback si hay error
-            old_llm = self.llm
-            old_model = self.current_model
-            old_cadena = self.cadena
-            
-            # Actualizar el LLM principal
+            # Solo cambia el modelo por defecto: cada consulta arma su prompt con el
+            # LLM de su propio contexto, sin cadenas que reconstruir
             self.llm = new_llm
             self.current_model = model_name
             
-            # IMPORTANTE: Recrear la cadena de RetrievalQA manteniendo el MISMO vector store
-            if self.vector_store is not None:
-                logger.info(f"🔗 Actualizando RetrievalQA con modelo {model_name} manteniendo vector store...")
-                
-                try:
-                    # Usar el MISMO retriever para mantener acceso a documentos
-                    retriever = self.vector_store.as_retriever(search_kwargs={"k": 3})
-                    
-                    # Recrear cadena con el MISMO prompt template para consistencia
-                    self.cadena = RetrievalQA.from_chain_type(
-                        llm=self.llm,
-                        chain_type="stuff",
-                        retriever=retriever,
-                        return_source_documents=True,
-                        chain_type_kwargs={"prompt": PROMPT_QA_SIMPLE}  # MISMO prompt
-                    )
-                    
-                    logger.info(f"✅ RetrievalQA actualizado exitosamente con modelo {model_name}")
-                    
-                except Exception as chain_error:
-                    logger.error(f"❌ Error recreando cadena: {chain_error}")
-                    # Rollback en caso de error
-                    self.llm = old_llm
-                    self.current_model = old_model
-                    self.cadena = old_cadena
-                    raise chain_error
-            else:
-                logger.warning("⚠️ No hay vector store disponible - modelo cambiado sin RAG")
-            
-            # Verificar que la memoria se mantiene (para conservar historial de chat)
-            if self.memory is None:
-                logger.info("🧠 Inicializando memoria para mantener historial...")
-                self.memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-            
             # Log detallado del estado final
             logger.info(f"✅ Cambio de modelo completado exitosamente:")
             logger.info(f"   📋 Modelo activo: {self.current_model}")
             logger.info(f"   📚 Vector store: {'Disponible' if self.vector_store else 'No disponible'}")
-            logger.info(f"   🔗 Cadena RAG: {'Configurada' if self.cadena else 'No configurada'}")
             logger.info(f"   🧠 Memoria: {'Activa' if self.memory else 'Inactiva'}")
             logger.info(f"   📊 Fragmentos disponibles: {len(self.fragmentos)}")
             
@@ -151,6 +239,28 @@ class AISystem:
         """Retorna el modelo actualmente activo"""
         return self.current_model or DEFAULT_MODEL
     
+    def resolve_model_name(self, requested_model=None):
+        """Modelo que atenderá una consulta: el solicitado si existe, o el activo"""
+        if requested_model and requested_model in AVAILABLE_MODELS:
+            return requested_model
+        if requested_model:
+            logger.warning(f"⚠️ Modelo {requested_model} no disponible, usando {self.get_current_model()}")
+        return self.get_current_model()
+    
+    def create_request_context(self, requested_model=None, session_id=None):
+        """Crea el contexto de una consulta sin modificar el modelo activo del sistema"""
+        model_name = self.resolve_model_name(requested_model)
+        return RequestContext(
+            model_name=model_name,
+            llm=self.get_or_create_llm(model_name),
+            budget=PromptBudget(model_name),
+            session_id=session_id
+        )
+    
+    def get_session_memory_stats(self):
+        """Estadísticas de la memoria de conversación por sesión"""
+        return self.memory.get_stats() if self.memory else {}
+    
     def transfer_context_to_new_model(self, new_llm, model_name):
         """Transfiere todo el contexto del sistema al nuevo modelo"""
         try:
@@ -160,7 +270,7 @@ class AISystem:
                 "documents_count": len(self.documentos),
                 "fragments_count": len(self.fragmentos),
                 "vector_store_available": self.vector_store is not None,
-                "vector_store_type": "ChromaDB" if self.using_chroma else ("FAISS" if self.using_vector_db else "None"),
+                "vector_store_type": self.get_vector_store_type(),
                 "memory_available": self.memory is not None,
                 "previous_model": self.current_model
             }
@@ -180,8 +290,8 @@ class AISystem:
             
             # 3. Verificar memoria y historial
             if self.memory:
-                chat_history = self.memory.chat_memory.messages
-                logger.info(f"🧠 Memoria preservada - {len(chat_history)} mensajes en historial")
+                memory_stats = self.memory.get_stats()
+                logger.info(f"🧠 Memoria preservada - {memory_stats['sessions']} sesiones activas")
             
             logger.info(f"📋 Resumen de transferencia de contexto: {context_transfer_summary}")
             return context_transfer_summary
@@ -190,19 +300,48 @@ class AISystem:
             logger.error(f"❌ Error transfiriendo contexto: {e}")
             return None
     
+    def get_vector_store_type(self):
+        """Nombre del backend vectorial activo"""
+        if self.using_chroma:
+            return "ChromaDB"
+        if not self.using_vector_db:
+            return "None"
+        return "NumPy" if self.using_numpy else "FAISS"
+    
     def get_context_status(self):
         """Retorna el estado actual del contexto del sistema"""
         return {
             "current_model": self.get_current_model(),
             "documents_loaded": len(self.documentos),
             "fragments_available": len(self.fragmentos),
-            "vector_store_type": "ChromaDB" if self.using_chroma else ("FAISS" if self.using_vector_db else "None"),
+            "vector_store_type": self.get_vector_store_type(),
             "vector_store_active": self.vector_store is not None,
-            "retrieval_chain_active": self.cadena is not None,
             "memory_active": self.memory is not None,
             "system_initialized": self.is_initialized,
             "available_models": list(AVAILABLE_MODELS.keys()),
-            "cached_models": list(self.llm_cache.keys())
+            "cached_models": list(self.llm_cache.keys()),
+            "last_vector_sync": self.last_sync_stats,
+            "index_build_progress": self.index_build_progress,
+            "keyword_index_fragments": len(self.keyword_index) if self.keyword_index is not None else 0
+        }
+    
+    def _set_startup_phase(self, phase, status, **details):
+        """Actualiza el estado de una fase del arranque (pending/running/ready/skipped/error)"""
+        entry = self.startup_phases[phase]
+        now = time.time()
+        if status == "running":
+            entry.clear()
+            entry["started_at"] = now
+        elif "started_at" in entry:
+            entry["seconds"] = round(now - entry["started_at"], 2)
+        entry["status"] = status
+        entry.update(details)
+    
+    def get_startup_status(self):
+        """Estado de cada fase del arranque, sin marcas de tiempo internas"""
+        return {
+            phase: {key: value for key, value in entry.items() if key != "started_at"}
+            for phase, entry in self.startup_phases.items()
         }
     
     def check_chromadb_dependencies(self):
@@ -232,7 +371,7 @@ class AISystem:
             return False
 
     def setup_chroma_vectorstore(self, documents, embeddings, persist_directory):
-        """Configura ChromaDB con reutilización inteligente de persistencia"""
+        """Configura ChromaDB reutilizando la persistencia y sincronizando por IDs de fragmento"""
         try:
             import chromadb
             from langchain_chroma import Chroma
@@ -242,96 +381,55 @@ class AISystem:
             # Crear directorio si no existe
             os.makedirs(persist_directory, exist_ok=True)
             
-            # Verificar si existe una base de datos persistida
+            collection_name = "langchain"
+            
+            # Abrir (o crear) la colección persistida
             try:
                 client = chromadb.PersistentClient(path=persist_directory)
-                collection_name = "langchain"
-                
-                # API actualizada para ChromaDB v0.6.0+
-                try:
-                    # Intentar obtener la colección directamente
-                    collection = client.get_collection(collection_name)
-                    doc_count = collection.count()
-                    
-                    if doc_count > 0 and doc_count >= len(documents):
-                        logger.info(f"🔄 Reutilizando ChromaDB existente con {doc_count} documentos")
-                        
-                        # Cargar vector store existente SIN recrear
-                        vector_store = Chroma(
-                            client=client,
-                            collection_name=collection_name,
-                            embedding_function=embeddings,
-                            persist_directory=persist_directory
-                        )
-                        
-                        logger.info("✅ ChromaDB cargado desde persistencia - ¡Inicio rápido!")
-                        return vector_store
-                        
-                    elif doc_count > 0 and doc_count < len(documents):
-                        logger.info(f"📄 Base existente ({doc_count} docs) vs nuevos ({len(documents)} docs)")
-                        logger.info("🔄 Actualizando base de datos...")
-                        
-                        # Cargar existente y agregar documentos faltantes
-                        vector_store = Chroma(
-                            client=client,
-                            collection_name=collection_name,
-                            embedding_function=embeddings,
-                            persist_directory=persist_directory
-                        )
-                        
-                        # Agregar documentos nuevos
-                        new_docs = documents[doc_count:]
-                        if new_docs:
-                            vector_store.add_documents(new_docs)
-                            logger.info(f"➕ Agregados {len(new_docs)} documentos nuevos")
-                        
-                        return vector_store
-                    else:
-                        logger.info("📋 Colección vacía, recreando...")
-                        
-                except ValueError as ve:
-                    # La colección no existe
-                    if "does not exist" in str(ve) or "Collection" in str(ve):
-                        logger.info("📋 No existe colección previa, creando nueva...")
-                    else:
-                        raise ve
-                        
+                vector_store = Chroma(
+                    client=client,
+                    collection_name=collection_name,
+                    embedding_function=embeddings,
+                    persist_directory=persist_directory
+                )
             except Exception as e:
                 # Si hay error de corrupted database, limpiarla
                 if "_type" in str(e) or "corrupted" in str(e).lower():
                     logger.warning(f"🗑️ Base de datos corrupta detectada: {e}")
                     logger.info("🧹 Limpiando base de datos corrupta...")
                     
-                    try:
-                        import shutil
-                        if os.path.exists(persist_directory):
-                            # Hacer backup por seguridad
-                            backup_path = f"{persist_directory}_backup_{int(datetime.now().timestamp())}"
-                            shutil.move(persist_directory, backup_path)
-                            logger.info(f"📁 Backup creado en: {backup_path}")
-                            
-                            # Recrear directorio limpio
-                            os.makedirs(persist_directory, exist_ok=True)
-                            logger.info("✅ Directorio ChromaDB limpiado")
-                        
-                    except Exception as cleanup_error:
-                        logger.error(f"❌ Error limpiando DB: {cleanup_error}")
+                    import shutil
+                    # Hacer backup por seguridad
+                    backup_path = f"{persist_directory}_backup_{int(datetime.now().timestamp())}"
+                    shutil.move(persist_directory, backup_path)
+                    logger.info(f"📁 Backup creado en: {backup_path}")
+                    
+                    # Recrear directorio limpio
+                    os.makedirs(persist_directory, exist_ok=True)
+                    logger.info("✅ Directorio ChromaDB limpiado")
+                    
+                    client = chromadb.PersistentClient(path=persist_directory)
+                    vector_store = Chroma(
+                        client=client,
+                        collection_name=collection_name,
+                        embedding_function=embeddings,
+                        persist_directory=persist_directory
+                    )
                 else:
-                    logger.warning(f"⚠️ Error verificando base existente: {e}")
-                
-                logger.info("🔄 Creando nueva base de datos...")
-            
-            # Crear nueva base de datos
-            logger.info("🔧 Creando nuevo vector store con ChromaDB...")
-            
-            vector_store = Chroma.from_documents(
-                documents=documents,
-                embedding=embeddings,
-                persist_directory=persist_directory,
-                collection_name=collection_name
+                    raise
+            
+            # Sincronizar por IDs de fragmento: solo se embeben los fragmentos nuevos
+            # y se eliminan los que ya no están en el corpus
+            self._chroma_collection = client.get_collection(collection_name)
+            self.last_sync_stats = sync_vector_store(
+                vector_store,
+                documents,
+                builder=self.create_index_builder(embeddings),
+                collection=self._chroma_collection,
+                batch_size=VECTOR_SYNC_BATCH_SIZE
             )
             
-            logger.info(f"💾 ChromaDB creado con {len(documents)} documentos")
+            logger.info(f"💾 ChromaDB listo con {self.last_sync_stats['fragments']} fragmentos")
             return vector_store
             
         except Exception as e:
@@ -347,11 +445,13 @@ class AISystem:
                 logger.warning("⚠️ No hay fragmentos disponibles")
                 return False
             
-            # Configurar embeddings
-            embeddings = OllamaEmbeddings(
-                model="nomic-embed-text",
-                base_url=OLLAMA_URL  # Usar URL configurada desde environment
-            )
+            # Configurar embeddings (reutiliza la instancia compartida si existe)
+            if self.embeddings is None:
+                self.embeddings = self.create_embeddings()
+            embeddings = self.embeddings
+            
+            if VECTOR_BACKEND == "numpy":
+                return self.setup_numpy_vectorstore(embeddings) or self.setup_faiss_fallback(embeddings)
             
             # Configurar ChromaDB con persistencia optimizada
             chroma_path = os.path.join(self.data_dir, "chroma_db")
@@ -374,6 +474,7 @@ class AISystem:
                         
                         self.vector_store = vector_store
                         self.using_chroma = True
+                        self.using_numpy = False
                         self.using_vector_db = True
                         
                         logger.info("🎉 ChromaDB inicializado con persistencia")
@@ -396,6 +497,7 @@ class AISystem:
             
             self.vector_store = vector_store
             self.using_chroma = True
+            self.using_numpy = False
             self.using_vector_db = True
             
             logger.info("🎉 ChromaDB creado exitosamente")
@@ -403,19 +505,42 @@ class AISystem:
             
         except Exception as e:
             logger.error(f"❌ Error en setup_vector_database: {e}")
-            # Continuar con fallback a FAISS si es necesario
-            return self.setup_faiss_fallback(embeddings)
+            # Fallback: índice NumPy persistido (incremental) y, si no es posible, FAISS
+            return self.setup_numpy_vectorstore(self.embeddings) or self.setup_faiss_fallback(self.embeddings)
 
-    def setup_faiss_fallback(self, embeddings):
-        """Configura FAISS como fallback si ChromaDB falla"""
+    def setup_faiss_fallback(self, embeddings, fragments=None):
+        """Configura FAISS como fallback si ChromaDB falla.
+        
+        Con ``fragments`` se construye para ese corpus (recarga) en vez de ``self.fragmentos``.
+        """
+        fragments = self.fragmentos if fragments is None else fragments
         try:
             logger.info("🔄 Configurando FAISS como fallback...")
             os.makedirs(FAISS_PATH, exist_ok=True)
             
-            self.vector_store = FAISS.from_documents(documents=self.fragmentos, embedding=embeddings)
+            # Mismos IDs por contenido que en ChromaDB; el contenido repetido se indexa una vez
+            unique = {}
+            for fragment, fragment_id in zip(fragments, corpus_fragment_ids(fragments)):
+                unique.setdefault(fragment_id, fragment)
+            
+            # Embeddings en lotes concurrentes; el checkpoint evita re-embeber en cada arranque
+            fragment_ids = list(unique.keys())
+            vectors = {}
+            self.create_index_builder(embeddings).build(
+                fragment_ids,
+                [unique[fragment_id].page_content for fragment_id in fragment_ids],
+                lambda batch_ids, batch_vectors: vectors.update(zip(batch_ids, batch_vectors))
+            )
+            self.vector_store = FAISS.from_embeddings(
+                text_embeddings=[(unique[i].page_content, vectors[i]) for i in fragment_ids],
+                embedding=embeddings,
+                metadatas=[unique[i].metadata for i in fragment_ids],
+                ids=fragment_ids
+            )
             self.vector_store.save_local(FAISS_PATH)
             
             self.using_chroma = False
+            self.using_numpy = False
             self.using_vector_db = True
             logger.info("✅ FAISS configurado como fallback")
             return True
@@ -431,6 +556,41 @@ class AISystem:
             self.using_vector_db = False
             return False
     
+    def setup_numpy_vectorstore(self, embeddings, fragments=None):
+        """Configura el índice NumPy mapeado en memoria (solo embebe los fragmentos nuevos).
+        
+        Con ``fragments`` se construye para ese corpus (recarga); el vector
+        store y el flag solo se actualizan si la construcción termina bien.
+        """
+        fragments = self.fragmentos if fragments is None else fragments
+        try:
+            from numpy_vector_store import NumpyMemmapVectorStore, build_numpy_index
+            
+            logger.info(f"🔍 Configurando índice NumPy en: {NUMPY_INDEX_PATH}")
+            self.last_sync_stats = build_numpy_index(
+                NUMPY_INDEX_PATH,
+                fragments,
+                builder=self.create_index_builder(embeddings),
+                model_name=EMBEDDING_MODEL
+            )
+            self.vector_store = NumpyMemmapVectorStore(
+                NUMPY_INDEX_PATH, fragments, embeddings, block_rows=NUMPY_INDEX_BLOCK_ROWS
+            )
+            self.using_chroma = False
+            self.using_numpy = True
+            self.using_vector_db = True
+            logger.info(f"✅ Índice NumPy listo con {len(self.vector_store)} vectores ({self.vector_store.generation})")
+            return True
+            
+        except Exception as numpy_error:
+            self.numpy_error_details = {
+                "error": str(numpy_error),
+                "type": type(numpy_error).__name__,
+                "traceback": traceback.format_exc()
+            }
+            logger.error(f"❌ Error configurando índice NumPy: {numpy_error}")
+            return False
+    
     def get_error_diagnostics(self):
         """Retorna información detallada sobre errores ocurridos."""
         diagnostics = {
@@ -442,6 +602,7 @@ class AISystem:
             "llm_available": self.llm is not None,
             "vector_store_available": self.vector_store is not None,
             "chroma_error": self.chroma_error_details,
+            "numpy_error": self.numpy_error_details,
             "faiss_error": self.faiss_error_details
         }
         
@@ -515,11 +676,20 @@ class AISystem:
         return False
 
     def initialize_system(self):
-        """Inicializa el sistema de IA completo de forma síncrona."""
+        """Inicializa el sistema de IA completo de forma síncrona.
+        
+        Pensado para correr en un hilo aparte: cada fase se publica en
+        ``startup_phases`` y una recarga del corpus pedida mientras tanto
+        espera a que termine.
+        """
         if self.is_initialized:
             logger.info("Sistema ya inicializado")
             return True
-            
+        
+        with self._reload_lock:
+            return self._initialize_system()
+    
+    def _initialize_system(self):
         try:
             logger.info("🚀 Iniciando sistema de IA...")
             logger.info("=" * 60)
@@ -533,8 +703,13 @@ class AISystem:
             logger.info(f"ChromaDB dependencies available: {chromadb_available}")
             
             # Procesar PDFs
+            self._set_startup_phase("fragments", "running")
             logger.info("📚 Procesando archivos PDF...")
+            # Corpus anterior según el cache: puede seguir en uso por los workers
+            previous_metadata = load_cache_metadata(CACHE_DIR) or {}
+            previous_hashes = {m["hash"] for m in previous_metadata.get("pdf_files", []) if m.get("hash")}
             self.documentos, self.fragmentos = process_pdf_files_optimized(PDFS_DIR, CACHE_DIR)
+            self.prune_fragment_cache(previous_hashes)
             
             if not self.fragmentos:
                 logger.warning("No se encontraron fragmentos en cache, cargando PDFs directamente...")
@@ -559,21 +734,26 @@ class AISystem:
             else:
                 logger.info(f"✅ Fragmentos cargados desde cache: {len(self.fragmentos)}")
             
+            self.keyword_index = self.build_keyword_index(self.fragmentos)
+            self.fragment_lookup = FragmentLookup(self.fragmentos) if self.fragmentos else None
+            self.refresh_corpus_version()
+            self._set_startup_phase("fragments", "ready", fragments=len(self.fragmentos))
+            
             # Inicializar embeddings y LLM
+            self._set_startup_phase("llm", "running")
             logger.info("🧠 Inicializando modelo de lenguaje...")
             try:
-                embeddings = OllamaEmbeddings(
-                    model="nomic-embed-text",
-                    base_url=OLLAMA_URL  # Usar URL configurada desde environment
-                )
+                self.embeddings = self.create_embeddings()
                 self.llm = self.get_or_create_llm(DEFAULT_MODEL)
                 self.current_model = DEFAULT_MODEL
                 logger.info(f"✅ Embeddings y LLM inicializados correctamente con modelo: {DEFAULT_MODEL}")
             except Exception as e:
                 logger.error(f"❌ Error inicializando Ollama: {e}")
                 raise
+            self._set_startup_phase("llm", "ready", model=DEFAULT_MODEL)
             
             # Configurar base de datos vectorial con optimización
+            self._set_startup_phase("vector_store", "running")
             if chromadb_available and self.fragmentos:
                 success = self.setup_vector_database()
                 if not success:
@@ -584,25 +764,11 @@ class AISystem:
                 elif not self.fragmentos:
                     logger.warning("⚠️ No hay fragmentos para procesar")
             
-            # Configurar cadena de recuperación
             if self.vector_store is not None:
-                logger.info("⚙️ Configurando RetrievalQA...")
-                retriever = self.vector_store.as_retriever(search_kwargs={"k": 3})
-                
-                self.cadena = RetrievalQA.from_chain_type(
-                    llm=self.llm,
-                    chain_type="stuff",
-                    retriever=retriever,
-                    return_source_documents=True,
-                    chain_type_kwargs={"prompt": PROMPT_QA_SIMPLE}
-                )
-                
-                logger.info(f"✅ RetrievalQA configurado con {'ChromaDB' if self.using_chroma else 'FAISS'}")
+                self._set_startup_phase("vector_store", "ready", type=self.get_vector_store_type())
             else:
                 logger.warning("⚠️ No se pudo configurar vector store - funcionando sin RAG")
-            
-            # Crear memoria para conversación
-            self.memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+                self._set_startup_phase("vector_store", "skipped")
             
             self.is_initialized = True
             
@@ -611,8 +777,7 @@ class AISystem:
                 "model": self.current_model,
                 "documents": len(self.documentos),
                 "fragments": len(self.fragmentos),
-                "vector_store": "ChromaDB" if self.using_chroma else ("FAISS" if self.using_vector_db else "None"),
-                "retrieval_chain": self.cadena is not None,
+                "vector_store": self.get_vector_store_type(),
                 "memory": self.memory is not None
             }
             
@@ -620,8 +785,7 @@ class AISystem:
             logger.info(f"   📋 Modelo inicial: {self.current_model}")
             logger.info(f"   📚 Documentos cargados: {len(self.documentos)}")
             logger.info(f"   🔧 Fragmentos procesados: {len(self.fragmentos)}")
-            logger.info(f"   💾 Vector Store: {'ChromaDB' if self.using_chroma else ('FAISS' if self.using_vector_db else 'None')}")
-            logger.info(f"   🔗 RAG Chain: {'Activa' if self.cadena else 'Inactiva'}")
+            logger.info(f"   💾 Vector Store: {self.get_vector_store_type()}")
             logger.info(f"   🧠 Memoria: {'Activa' if self.memory else 'Inactiva'}")
             logger.info(f"   🚀 CONTEXTO COMPLETO DISPONIBLE PARA TODOS LOS MODELOS")
             
@@ -630,17 +794,130 @@ class AISystem:
         except Exception as e:
             logger.error(f"❌ Error crítico en inicialización: {e}")
             logger.error(f"Traceback completo:\n{traceback.format_exc()}")
+            for phase, entry in self.startup_phases.items():
+                if entry["status"] == "running":
+                    self._set_startup_phase(phase, "error", error=str(e)[:200])
             self.setup_fallback()
             return False
 
+    def reload_corpus(self):
+        """Re-ingesta incremental del corpus sin detener el servicio.
+        
+        Solo se parsean y embeben los PDFs nuevos o modificados. Con NumPy y
+        FAISS se construye un índice nuevo (reutilizando el checkpoint de
+        embeddings) y se intercambia al final: las consultas en curso siguen
+        usando el corpus anterior hasta el intercambio y, si la construcción
+        falla, se lanza RuntimeError y el corpus anterior (fragmentos, BM25 y
+        versión) sigue vigente completo.
+        
+        En ChromaDB la colección se sincroniza en sitio, sin intercambio
+        atómico: mientras dura la sincronización contiene fragmentos de ambas
+        versiones (primero se agregan los nuevos y al final se borran los
+        eliminados). Si la sincronización falla a mitad, la versión del
+        corpus pasa a una versión parcial para que los caches de recuperación
+        y de respuestas no sigan sirviendo resultados de la colección anterior;
+        la próxima recarga completa la diferencia.
+        
+        Devuelve un resumen, o None si ya hay una recarga en curso.
+        """
+        # Durante el arranque se espera a initialize_system para no perder el PDF subido
+        if not self._reload_lock.acquire(blocking=not self.is_initialized):
+            logger.info("⏳ Ya hay una recarga del corpus en curso")
+            return None
+        
+        try:
+            start_time = time.time()
+            previous_version = self.corpus_version
+            previous_hashes = self._fragment_hashes(self.fragmentos)
+            logger.info("🔄 Recargando corpus de forma incremental...")
+            
+            documentos, fragmentos = process_pdf_files_optimized(PDFS_DIR, CACHE_DIR)
+            keyword_index = self.build_keyword_index(fragmentos)
+            fragment_lookup = FragmentLookup(fragmentos) if fragmentos else None
+            if self.embeddings is None:
+                self.embeddings = self.create_embeddings()
+            
+            if self.using_chroma and self.vector_store is not None and self._chroma_collection is not None:
+                # Solo se embeben los fragmentos nuevos; los eliminados se borran
+                try:
+                    self.last_sync_stats = sync_vector_store(
+                        self.vector_store,
+                        fragmentos,
+                        builder=self.create_index_builder(self.embeddings),
+                        collection=self._chroma_collection,
+                        batch_size=VECTOR_SYNC_BATCH_SIZE
+                    )
+                except Exception:
+                    self._mark_partial_corpus()
+                    raise
+                self.documentos, self.fragmentos = documentos, fragmentos
+            elif self.using_numpy and self.vector_store is not None:
+                # NumPy: nueva generación reutilizando las filas existentes; si falla sigue la actual
+                if not self.setup_numpy_vectorstore(self.embeddings, fragmentos):
+                    raise RuntimeError("No se pudo construir el índice NumPy; se mantiene el corpus anterior")
+                self.documentos, self.fragmentos = documentos, fragmentos
+            elif self.vector_store is not None:
+                # FAISS: construir aparte y reemplazar de una vez
+                current_store = self.vector_store
+                if not self.setup_faiss_fallback(self.embeddings, fragmentos):
+                    self.vector_store = current_store
+                    self.using_vector_db = True
+                    raise RuntimeError("No se pudo construir el índice FAISS; se mantiene el corpus anterior")
+                self.documentos, self.fragmentos = documentos, fragmentos
+            else:
+                self.documentos, self.fragmentos = documentos, fragmentos
+                if self.fragmentos:
+                    self.setup_vector_database()
+            
+            # El resto del estado del corpus cambia solo junto con el índice vectorial
+            self.keyword_index = keyword_index
+            self.fragment_lookup = fragment_lookup
+            self.refresh_corpus_version()
+            self.prune_fragment_cache(previous_hashes)
+            
+            summary = {
+                "previous_version": previous_version,
+                "corpus_version": self.corpus_version,
+                "fragments": len(self.fragmentos),
+                "new_documents": len(documentos),
+                "vector_sync": self.last_sync_stats,
+                "seconds": round(time.time() - start_time, 2)
+            }
+            logger.info(f"✅ Corpus recargado: {summary}")
+            return summary
+        finally:
+            self._reload_lock.release()
+
+    def _mark_partial_corpus(self):
+        """La colección quedó a medio sincronizar: versión nueva para invalidar los caches"""
+        self.corpus_version = f"{self.corpus_version}+parcial-{int(time.time())}"
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(keep_corpus_version=self.corpus_version)
+        logger.warning(f"⚠️ Sincronización de ChromaDB incompleta; versión del corpus: {self.corpus_version}")
+
+    @staticmethod
+    def _fragment_hashes(fragments):
+        """Hashes de PDF de las entradas del cache que usa una lista de fragmentos"""
+        return {file_hash for file_hash, _ in getattr(fragments, "entries", ())}
+
+    def prune_fragment_cache(self, previous_hashes):
+        """Borra del cache las entradas que no usa el corpus vigente ni el anterior.
+        
+        Se llama solo después del intercambio: las consultas en curso y los
+        workers que aún no recargaron siguen leyendo entradas del corpus
+        anterior, que se conservan hasta la recarga siguiente.
+        """
+        try:
+            FragmentStore(CACHE_DIR).prune(self._fragment_hashes(self.fragmentos) | set(previous_hashes))
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo limpiar el cache de fragmentos: {e}")
+
     def setup_fallback(self):
         """Configura el sistema en modo fallback."""
         try:
             logger.info("Configurando sistema en modo fallback...")
             self.llm = self.get_or_create_llm(DEFAULT_MODEL)
             self.current_model = DEFAULT_MODEL
-            self.cadena = load_qa_chain(self.llm, chain_type="stuff")
-            self.memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
             self.using_vector_db = False
             logger.info("Sistema fallback configurado")
         except Exception as e:
@@ -648,24 +925,7 @@ class AISystem:
     
     def detect_question_type(self, question_text):
         """Detecta el tipo de pregunta basado en patrones."""
-        patrones_tipo_pregunta = {
-            "saludo": [r"^(hola|buenos días|buenas tardes|buenas noches|saludos|hey|qué tal|cómo estás)"],
-            "despedida": [r"^(adiós|chao|hasta luego|nos vemos|gracias por tu ayuda|gracias|hasta pronto)"],
-            "definicion": [r"(qué|que) (es|son|significa|significan)", r"define|definir|definición", r"\b(explica|explique|explicar)\b"],
-            "ejemplo": [r"(dame|da|muestra|pon) (un|unos|algunos)? ejemplos?", r"ejemplos? de"],
-            "comparacion": [r"(compara|comparación|diferencias?) (entre|de)", r"(qué|que|cuál|cual) es (mejor|peor)"],
-            "resumen": [r"(resume|resumen|síntesis|sintetiza)", r"(en pocas palabras|brevemente)"],
-            "aclaracion": [r"(puedes|podrías) (explicar|aclarar) (mejor|de nuevo)", r"no (entiendo|comprendo)"],
-            "seguimiento": [r"(y|pero) (qué|que|cómo|como)", r"(puedes|podrías) (ampliar|expandir)"],
-            "syllabus": [r"(syllabus|programa|temario|contenido)", r"(coordinador|profesor|docente)"]
-        }
-        
-        for tipo, patrones in patrones_tipo_pregunta.items():
-            for patron in patrones:
-                if re.search(patron, question_text.lower()):
-                    return tipo
-        
-        return None
+        return classify_question(question_text)[0]
     
     def get_template_by_type(self, tipo_pregunta):
         """Retorna la plantilla apropiada según el tipo de pregunta."""
@@ -683,29 +943,248 @@ class AISystem:
         
         return template_map.get(tipo_pregunta)
     
-    def retrieve_relevant_documents(self, query):
-        """Recupera documentos relevantes para la consulta."""
+    def retrieve_relevant_documents(self, query, timings=None):
+        """Recupera documentos relevantes embebiendo la consulta una sola vez.
+        
+        Los resultados vectoriales se fusionan con los del índice BM25. Las
+        preguntas de términos exactos (frases entre comillas, "a*", "c++") se
+        responden solo con BM25 (sin embedding)
+        y BM25 también cubre la caída del servidor de embeddings y el modo sin
+        vector store. Una consulta ya vista para la misma versión del corpus
+        se resuelve desde el cache de recuperación sin tocar la base vectorial.
+        Si se entrega el dict ``timings`` se registran en él los tiempos por
+        etapa (en segundos).
+        """
+        cache_key = self._retrieval_cache_key(query)
+        if cache_key is not None:
+            docs = self._resolve_cached_retrieval(self.retrieval_cache.get(cache_key), timings)
+            if docs is not None:
+                return docs
+        
+        docs, cacheable = self._retrieve_uncached(query, timings)
+        if cache_key is not None and cacheable and docs:
+            self.retrieval_cache.put(cache_key, docs)
+        return docs
+    
+    async def aretrieve_relevant_documents(self, query, timings=None):
+        """Versión asíncrona de retrieve_relevant_documents con concurrencia acotada por etapa."""
+        cache_key = self._retrieval_cache_key(query)
+        if cache_key is not None:
+            docs = self._resolve_cached_retrieval(await self.retrieval_cache.aget(cache_key), timings)
+            if docs is not None:
+                return docs
+        
+        docs, cacheable = await self._aretrieve_uncached(query, timings)
+        if cache_key is not None and cacheable and docs:
+            await self.retrieval_cache.aput(cache_key, docs)
+        return docs
+    
+    def _retrieval_cache_key(self, query):
+        """Clave del cache de recuperación, o None si no aplica"""
+        if self.retrieval_cache is None or self.fragment_lookup is None or not query:
+            return None
+        signature = (
+            f"{self.get_vector_store_type()}|{RETRIEVAL_K}|{RETRIEVAL_LAMBDA_MULT}|"
+            f"{HYBRID_SEARCH_ENABLED}|{KEYWORD_SEARCH_K}"
+        )
+        return self.retrieval_cache.make_key(query, self.corpus_version, signature)
+    
+    def _resolve_cached_retrieval(self, fragment_ids, timings=None):
+        """Fragmentos de un acierto del cache, o None si hay que buscar"""
+        docs = None
+        if fragment_ids is not None and self.fragment_lookup is not None:
+            docs = self.fragment_lookup.resolve(fragment_ids)
+        if timings is not None:
+            timings["retrieval_cache"] = "hit" if docs is not None else "miss"
+        if docs is not None:
+            logger.info(f"⚡ Recuperación desde cache: {len(docs)} fragmentos sin consultar la base vectorial")
+        return docs
+    
+    def _retrieve_uncached(self, query, timings=None):
+        """Búsqueda completa; devuelve (documentos, si el resultado se puede cachear)"""
+        keyword_docs = self._keyword_search(query, timings)
+        if HYBRID_SEARCH_ENABLED and keyword_docs and is_keyword_query(query):
+            logger.info(f"🔎 Pregunta de términos exactos: {len(keyword_docs)} fragmentos desde BM25 sin embedding")
+            return keyword_docs[:RETRIEVAL_K], True
+        
         try:
-            if self.vector_store is not None:
-                retriever = self.vector_store.as_retriever(
-                    search_type="mmr",
-                    search_kwargs={"k": 8, "lambda_mult": 0.5}
+            if self.vector_store is not None and self.embeddings is not None:
+                # Un solo embedding de la consulta y una sola búsqueda MMR
+                embedding_start = time.time()
+                query_vector = self.embeddings.embed_query(query)
+                embedding_time = time.time() - embedding_start
+                
+                search_start = time.time()
+                docs = self.vector_store.max_marginal_relevance_search_by_vector(
+                    query_vector, k=RETRIEVAL_K, lambda_mult=RETRIEVAL_LAMBDA_MULT
                 )
+                search_time = time.time() - search_start
+                
+                if timings is not None:
+                    timings["embedding"] = round(embedding_time, 4)
+                    timings["search"] = round(search_time, 4)
+                return self._fuse_results(docs, keyword_docs), True
+            elif self.vector_store is not None:
                 # Usar invoke en lugar de get_relevant_documents (deprecado)
-                return retriever.invoke(query)
-            elif self.fragmentos:
-                import random
-                return random.sample(self.fragmentos, min(5, len(self.fragmentos)))
+                search_start = time.time()
+                docs = self._get_mmr_retriever().invoke(query)
+                if timings is not None:
+                    timings["search"] = round(time.time() - search_start, 4)
+                return self._fuse_results(docs, keyword_docs), True
+            else:
+                # Modo degradado sin vector store: búsqueda léxica local (solo CPU)
+                return keyword_docs[:RETRIEVAL_K], False
+        except Exception as e:
+            logger.error(f"Error recuperando documentos: {e}")
+            if keyword_docs:
+                logger.warning("⚠️ Búsqueda vectorial no disponible, usando solo resultados BM25")
+                return keyword_docs[:RETRIEVAL_K], False
+        
+        return [], False
+    
+    async def _aretrieve_uncached(self, query, timings=None):
+        """Versión asíncrona de _retrieve_uncached"""
+        # BM25 puede deserializar entradas del cache de fragmentos desde disco: fuera del event loop
+        async with self._stage_semaphore("search"):
+            keyword_docs = await asyncio.to_thread(self._keyword_search, query, timings)
+        if HYBRID_SEARCH_ENABLED and keyword_docs and is_keyword_query(query):
+            logger.info(f"🔎 Pregunta de términos exactos: {len(keyword_docs)} fragmentos desde BM25 sin embedding")
+            return keyword_docs[:RETRIEVAL_K], True
+        
+        try:
+            if self.vector_store is not None and self.embeddings is not None:
+                embedding_start = time.time()
+                async with self._stage_semaphore("embedding"):
+                    query_vector = await self.embeddings.aembed_query(query)
+                embedding_time = time.time() - embedding_start
+                
+                search_start = time.time()
+                async with self._stage_semaphore("search"):
+                    docs = await self.vector_store.amax_marginal_relevance_search_by_vector(
+                        query_vector, k=RETRIEVAL_K, lambda_mult=RETRIEVAL_LAMBDA_MULT
+                    )
+                search_time = time.time() - search_start
+                
+                if timings is not None:
+                    timings["embedding"] = round(embedding_time, 4)
+                    timings["search"] = round(search_time, 4)
+                return self._fuse_results(docs, keyword_docs), True
+            elif self.vector_store is not None:
+                search_start = time.time()
+                async with self._stage_semaphore("search"):
+                    docs = await self._get_mmr_retriever().ainvoke(query)
+                if timings is not None:
+                    timings["search"] = round(time.time() - search_start, 4)
+                return self._fuse_results(docs, keyword_docs), True
+            else:
+                # Modo degradado sin vector store: búsqueda léxica local (solo CPU)
+                return keyword_docs[:RETRIEVAL_K], False
         except Exception as e:
             logger.error(f"Error recuperando documentos: {e}")
+            if keyword_docs:
+                logger.warning("⚠️ Búsqueda vectorial no disponible, usando solo resultados BM25")
+                return keyword_docs[:RETRIEVAL_K], False
+        
+        return [], False
+    
+    def build_keyword_index(self, fragments):
+        """Construye el índice BM25 del corpus a partir de las estadísticas del cache de fragmentos.
+        
+        Se construye siempre: además de la búsqueda híbrida es el buscador
+        local del modo degradado sin vector store.
+        """
+        if not fragments:
+            return None
+        try:
+            start = time.time()
+            if hasattr(fragments, "term_stats"):
+                index = BM25Index(fragments, fragments.term_stats(), k1=BM25_K1, b=BM25_B)
+            else:
+                index = BM25Index.from_fragments(fragments, k1=BM25_K1, b=BM25_B)
+            logger.info(
+                f"🔎 Índice BM25 listo: {len(index)} fragmentos, {index.vocabulary_size} términos "
+                f"en {time.time() - start:.2f}s"
+            )
+            return index
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo construir el índice BM25: {e}")
+            return None
+    
+    def _keyword_search(self, query, timings=None):
+        """Fragmentos mejor puntuados por BM25 (lista vacía si no hay índice)"""
+        keyword_index = self.keyword_index
+        if keyword_index is None:
+            return []
+        start = time.time()
+        try:
+            docs = keyword_index.search_documents(query, k=KEYWORD_SEARCH_K)
+        except Exception as e:
+            logger.warning(f"Error en búsqueda BM25: {e}")
+            return []
+        if timings is not None:
+            timings["keyword"] = round(time.time() - start, 4)
+        return docs
+    
+    def _fuse_results(self, vector_docs, keyword_docs):
+        """Reciprocal rank fusion de los resultados vectoriales y BM25 por ID de fragmento"""
+        if not HYBRID_SEARCH_ENABLED or not keyword_docs:
+            return vector_docs
+        by_id = {}
+        rankings = []
+        for docs in (vector_docs, keyword_docs):
+            ranking = []
+            for doc in docs:
+                doc_id = get_fragment_id(doc)
+                by_id.setdefault(doc_id, doc)
+                ranking.append(doc_id)
+            rankings.append(ranking)
+        return [by_id[doc_id] for doc_id in reciprocal_rank_fusion(rankings, k=RRF_K)[:RETRIEVAL_K]]
+    
+    def _get_mmr_retriever(self):
+        return self.vector_store.as_retriever(
+            search_type="mmr",
+            search_kwargs={"k": RETRIEVAL_K, "lambda_mult": RETRIEVAL_LAMBDA_MULT}
+        )
+    
+    def _stage_semaphore(self, stage):
+        """Semáforo asyncio que limita la concurrencia de una etapa del pipeline.
+        
+        Se crean de forma perezosa para que queden ligados al event loop del
+        servidor y no al hilo que construyó el AISystem.
+        """
+        if self._stage_semaphores is None:
+            self._stage_semaphores = {
+                "embedding": asyncio.Semaphore(ASYNC_EMBEDDING_CONCURRENCY),
+                "search": asyncio.Semaphore(ASYNC_SEARCH_CONCURRENCY),
+                "generation": asyncio.Semaphore(ASYNC_GENERATION_CONCURRENCY),
+            }
+        return self._stage_semaphores[stage]
+    
+    def _needs_query_rewrite(self, question, conversation_history):
+        """Solo se reescribe con el LLM cuando hay historial y la pregunta lo referencia."""
+        if not conversation_history or not conversation_history.strip():
+            logger.debug("Sin historial: se omite la reescritura de la consulta")
+            return False
+        
+        if not question_needs_context(question):
+            logger.debug("Pregunta autocontenida: se omite la reescritura de la consulta")
+            return False
         
-        return []
+        return True
     
-    def generate_search_query(self, question, conversation_history):
-        """Genera una consulta de búsqueda optimizada."""
+    def generate_search_query(self, question, conversation_history, llm=None):
+        """Genera una consulta de búsqueda optimizada.
+        
+        Solo reescribe con el LLM cuando hay historial y la pregunta hace
+        referencia a turnos anteriores; en otro caso la pregunta ya es
+        autocontenida y se usa tal cual.
+        """
+        if not self._needs_query_rewrite(question, conversation_history):
+            return question
+        
         try:
             # Usar RunnableSequence en lugar de LLMChain (deprecado)
-            cadena_reescritura = plantilla_reescritura_pregunta | self.llm
+            cadena_reescritura = plantilla_reescritura_pregunta | (llm or self.llm)
             
             result = cadena_reescritura.invoke({
                 "historial_chat": conversation_history, 
@@ -718,23 +1197,31 @@ class AISystem:
             logger.error(f"Error generando consulta de búsqueda: {e}")
             return question
     
-    def process_question(self, pregunta_obj):
-        """Procesa la pregunta principal usando el sistema completo con contexto preservado."""
-        question_text = pregunta_obj.texto
+    async def agenerate_search_query(self, question, conversation_history, llm=None):
+        """Versión asíncrona de generate_search_query."""
+        if not self._needs_query_rewrite(question, conversation_history):
+            return question
         
-        # Manejar cambio de modelo si se especifica
-        if hasattr(pregunta_obj, 'modelo') and pregunta_obj.modelo:
-            if pregunta_obj.modelo != self.current_model:
-                logger.info(f"🔄 Cambiando modelo para esta consulta: {pregunta_obj.modelo}")
-                success = self.switch_model(pregunta_obj.modelo)
-                if success:
-                    # Transferir contexto y verificar estado
-                    context_status = self.transfer_context_to_new_model(self.llm, pregunta_obj.modelo)
-                    logger.info(f"✅ Contexto transferido exitosamente al modelo {pregunta_obj.modelo}")
-                else:
-                    logger.warning(f"⚠️ Fallo cambio de modelo, usando {self.current_model}")
+        try:
+            cadena_reescritura = plantilla_reescritura_pregunta | (llm or self.llm)
+            
+            async with self._stage_semaphore("generation"):
+                result = await cadena_reescritura.ainvoke({
+                    "historial_chat": conversation_history, 
+                    "pregunta": question
+                })
+            
+            return result.strip() if isinstance(result, str) else str(result).strip()
+        except Exception as e:
+            logger.error(f"Error generando consulta de búsqueda: {e}")
+            return question
+    
+    def _build_conversation_history(self, ctx, pregunta_obj):
+        """Construye el historial de conversación COMPLETO a partir de la pregunta.
         
-        # Construir historial de conversación COMPLETO
+        Si el cliente no envía historial (p. ej. tareas de Celery) se usa la
+        memoria de la sesión identificada por chatToken.
+        """
         conversation_history = ""
         if pregunta_obj.history and isinstance(pregunta_obj.history, list):
             # Usar más historial para mejor contexto (aumentado de 10 a 15)
@@ -748,129 +1235,271 @@ class AISystem:
                     conversation_history += f"Usuario: {msg.get('text','')}\n"
                 elif msg.get('sender') == 'bot':
                     conversation_history += f"Bot: {msg.get('text','')}\n"
+        elif self.memory:
+            conversation_history = self.memory.get_history(ctx.session_id)
+            if conversation_history:
+                logger.info("📚 Usando historial de la memoria de sesión")
         
-        # Analizar tipo y complejidad
-        tipo_pregunta = self.detect_question_type(question_text)
-        tipo_respuesta = analyze_question_complexity(question_text)
+        # Recortar al presupuesto de historial de la ventana del modelo
+        return ctx.budget.fit_history(conversation_history)
+    
+    def _answer_cache_applies(self, conversation_history):
+        # Cache semántico de respuestas: solo para preguntas sin historial
+        return self.answer_cache is not None and self.embeddings is not None and not conversation_history
+    
+    def _lookup_cached_answer(self, ctx, question_text, question_vector, stage_timings, total_start, on_token=None):
+        """Devuelve la respuesta cacheada para el vector de la pregunta, o None.
         
-        logger.info(f"🔍 Análisis: Tipo={tipo_pregunta}, Complejidad={tipo_respuesta}, Modelo={self.current_model}")
+        Un acierto también se registra en la memoria de la sesión, igual que
+        una respuesta generada, para que la siguiente pregunta conserve el contexto.
+        """
+        cached = self.answer_cache.lookup(question_vector, ctx.model_name, self.corpus_version)
+        if not cached:
+            stage_timings["answer_cache"] = "miss"
+            return None
         
-        # Generar consulta optimizada
-        search_query = self.generate_search_query(question_text, conversation_history)
+        if on_token:
+            on_token(cached["answer"])
+        self._remember_turn(ctx, question_text, cached["answer"])
+        stage_timings["answer_cache"] = "hit"
+        stage_timings["total"] = round(time.time() - total_start, 4)
+        logger.info(f"⚡ Respuesta desde cache semántico (similitud {cached['similarity']})")
+        return cached["answer"]
+    
+    def _analyze_question(self, ctx, question_text):
+        """Analiza tipo y complejidad de la pregunta."""
+        tipo_pregunta, tipo_respuesta = classify_question(question_text)
         
-        # Recuperar documentos relevantes con más contexto
-        documentos_relevantes = self.retrieve_relevant_documents(search_query)
-        contexto_documentos = "\n".join([doc.page_content for doc in documentos_relevantes])
+        logger.info(f"🔍 Análisis: Tipo={tipo_pregunta}, Complejidad={tipo_respuesta}, Modelo={ctx.model_name}")
+        return tipo_pregunta
+    
+    def _build_answer_prompt(self, ctx, question_text, conversation_history, documentos_relevantes, tipo_pregunta):
+        """Selecciona la estrategia de generación y devuelve el prompt final.
         
+        Los documentos se ajustan al espacio que deja la ventana del modelo
+        una vez descontados la plantilla, la pregunta y el historial.
+        """
         logger.info(f"📖 Documentos recuperados: {len(documentos_relevantes)} fragmentos relevantes")
         
         # Seleccionar plantilla ESPECÍFICA según el tipo
         plantilla_seleccionada = self.get_template_by_type(tipo_pregunta)
         
+        if self.vector_store is not None and documentos_relevantes:
+            # Usar RAG con los documentos ya recuperados (sin segunda búsqueda)
+            logger.info(f"🔗 Generando respuesta con RAG usando modelo {ctx.model_name}")
+            # No agregar etiqueta aquí - se agrega en el worker
+            build = lambda docs: self._build_documents_prompt(question_text, docs)
+        elif plantilla_seleccionada:
+            # Usar plantilla específica con contexto
+            logger.info(f"📝 Generando respuesta con plantilla {tipo_pregunta}")
+            build = lambda docs: self._build_template_prompt(
+                plantilla_seleccionada, 
+                question_text, 
+                conversation_history, 
+                docs
+            )
+        else:
+            # Fallback con contexto completo
+            logger.info(f"🔄 Usando respuesta fallback con contexto")
+            build = lambda docs: self._build_fallback_prompt(
+                question_text, 
+                conversation_history, 
+                docs
+            )
+        
+        budget = ctx.budget
+        docs_budget = budget.documents_budget(build(""))
+        contexto_documentos = budget.fit_documents(
+            [doc.page_content for doc in documentos_relevantes], docs_budget
+        )
+        prompt = build(contexto_documentos)
+        
+        logger.info(
+            f"🧮 Prompt final: {budget.count(prompt)} tokens "
+            f"(ventana {budget.context_window}, modelo {ctx.model_name})"
+        )
+        return prompt
+    
+    def _remember_turn(self, ctx, question_text, respuesta):
+        """Actualiza la memoria de la sesión con la nueva interacción"""
+        if self.memory and ctx.session_id:
+            self.memory.add_turn(ctx.session_id, question_text, respuesta)
+            logger.info("🧠 Memoria de sesión actualizada con nueva interacción")
+    
+    def _finalize_answer(self, ctx, question_text, respuesta, question_vector, stage_timings, total_start):
+        """Limpia la respuesta, actualiza memoria y cache, y cierra los tiempos por etapa."""
+        respuesta_limpia = self._clean_response_artifacts(respuesta)
+        self._remember_turn(ctx, question_text, respuesta_limpia)
+        
+        if question_vector is not None and respuesta_limpia:
+            self.answer_cache.store(
+                question_vector, question_text, respuesta_limpia,
+                ctx.model_name, self.corpus_version
+            )
+        
+        stage_timings["total"] = round(time.time() - total_start, 4)
+        logger.info(f"⏱️ Tiempos por etapa: {stage_timings}")
+        logger.info(f"✅ Respuesta generada exitosamente con modelo {ctx.model_name}")
+        return respuesta_limpia
+    
+    def process_question(self, pregunta_obj, timings=None, on_token=None):
+        """Procesa la pregunta principal usando el sistema completo con contexto preservado.
+        
+        Si se entrega el dict ``timings`` se completa con los tiempos por etapa
+        (rewrite, embedding, search, generation, total) en segundos. Si se
+        entrega ``on_token`` la respuesta se genera en streaming y el callback
+        recibe cada fragmento de texto a medida que llega desde Ollama.
+        """
+        question_text = pregunta_obj.texto
+        stage_timings = timings if timings is not None else {}
+        total_start = time.time()
+        
+        # Contexto propio de la consulta: el modelo solicitado no cambia el modelo activo
+        ctx = self.create_request_context(
+            getattr(pregunta_obj, 'modelo', None),
+            getattr(pregunta_obj, 'chatToken', None)
+        )
+        conversation_history = self._build_conversation_history(ctx, pregunta_obj)
+        
+        question_vector = None
+        if self._answer_cache_applies(conversation_history):
+            try:
+                question_vector = self.embeddings.embed_query(question_text)
+                cached = self._lookup_cached_answer(ctx, question_text, question_vector, stage_timings, total_start, on_token)
+                if cached:
+                    return cached
+            except Exception as cache_error:
+                logger.warning(f"Error consultando cache de respuestas: {cache_error}")
+                question_vector = None
+        
+        tipo_pregunta = self._analyze_question(ctx, question_text)
+        
+        # Generar consulta optimizada
+        rewrite_start = time.time()
+        search_query = self.generate_search_query(question_text, conversation_history, ctx.llm)
+        stage_timings["rewrite"] = round(time.time() - rewrite_start, 4)
+        
+        # Etapa única de recuperación: un embedding, una búsqueda
+        documentos_relevantes = self.retrieve_relevant_documents(search_query, timings=stage_timings)
+        
         # Generar respuesta con contexto COMPLETO
+        generation_start = time.time()
         try:
-            if self.cadena and documentos_relevantes:
-                # Usar RAG con contexto completo
-                logger.info(f"🔗 Generando respuesta con RAG usando modelo {self.current_model}")
-                
-                # Preparar input completo para RetrievalQA
-                query_input = {
-                    "query": question_text,
-                    "chat_history": conversation_history  # Incluir historial
-                }
-                
-                resultado = self.cadena(query_input)
-                respuesta = resultado["result"]
-                
-                # No agregar etiqueta aquí - se agrega en el worker
-                
-            elif plantilla_seleccionada:
-                # Usar plantilla específica con contexto
-                logger.info(f"📝 Generando respuesta con plantilla {tipo_pregunta}")
-                respuesta = self._generate_with_template(
-                    plantilla_seleccionada, 
-                    question_text, 
-                    conversation_history, 
-                    contexto_documentos
-                )
-            else:
-                # Fallback con contexto completo
-                logger.info(f"🔄 Usando respuesta fallback con contexto")
-                respuesta = self._generate_fallback_response(
-                    question_text, 
-                    conversation_history, 
-                    contexto_documentos
-                )
-            
-            # Limpiar y mejorar respuesta
-            respuesta_limpia = self._clean_response_artifacts(respuesta)
-            
-            # Actualizar memoria con la nueva interacción
-            if self.memory:
-                self.memory.chat_memory.add_user_message(question_text)
-                self.memory.chat_memory.add_ai_message(respuesta_limpia)
-                logger.info("🧠 Memoria actualizada con nueva interacción")
+            prompt = self._build_answer_prompt(ctx, question_text, conversation_history, documentos_relevantes, tipo_pregunta)
+            respuesta = self._invoke_llm(prompt, on_token, ctx.llm)
+            stage_timings["generation"] = round(time.time() - generation_start, 4)
             
-            logger.info(f"✅ Respuesta generada exitosamente con modelo {self.current_model}")
-            return respuesta_limpia
+            return self._finalize_answer(ctx, question_text, respuesta, question_vector, stage_timings, total_start)
             
         except Exception as e:
             logger.error(f"❌ Error generando respuesta: {e}")
             logger.error(f"Traceback: {traceback.format_exc()}")
+            stage_timings["total"] = round(time.time() - total_start, 4)
             
             # Fallback de emergencia
-            return self._generate_emergency_fallback(question_text)
+            return self._generate_emergency_fallback(question_text, ctx.model_name)
+    
+    async def aprocess_question(self, pregunta_obj, timings=None, on_token=None):
+        """Versión asíncrona de process_question.
         
-        # Analizar tipo y complejidad
-        tipo_pregunta = self.detect_question_type(question_text)
-        tipo_respuesta = analyze_question_complexity(question_text)
+        Usa los clientes asíncronos de Ollama (embeddings y LLM) y la búsqueda
+        vectorial asíncrona, con concurrencia acotada por etapa, de modo que
+        el servidor no necesita un hilo por pregunta en curso.
+        """
+        question_text = pregunta_obj.texto
+        stage_timings = timings if timings is not None else {}
+        total_start = time.time()
         
-        logger.info(f"Tipo pregunta: {tipo_pregunta}, Tipo respuesta: {tipo_respuesta}")
+        # Contexto propio de la consulta: el modelo solicitado no cambia el modelo activo
+        ctx = self.create_request_context(
+            getattr(pregunta_obj, 'modelo', None),
+            getattr(pregunta_obj, 'chatToken', None)
+        )
+        conversation_history = self._build_conversation_history(ctx, pregunta_obj)
         
-        # Generar consulta optimizada
-        search_query = self.generate_search_query(question_text, conversation_history)
+        question_vector = None
+        if self._answer_cache_applies(conversation_history):
+            try:
+                async with self._stage_semaphore("embedding"):
+                    question_vector = await self.embeddings.aembed_query(question_text)
+                cached = self._lookup_cached_answer(ctx, question_text, question_vector, stage_timings, total_start, on_token)
+                if cached:
+                    return cached
+            except Exception as cache_error:
+                logger.warning(f"Error consultando cache de respuestas: {cache_error}")
+                question_vector = None
         
-        # Recuperar documentos relevantes
-        documentos_relevantes = self.retrieve_relevant_documents(search_query)
-        contexto_documentos = "\n".join([doc.page_content for doc in documentos_relevantes])
+        tipo_pregunta = self._analyze_question(ctx, question_text)
         
-        # Seleccionar plantilla y generar respuesta
-        plantilla_seleccionada = self.get_template_by_type(tipo_pregunta)
-        usar_retrieval_qa = plantilla_seleccionada is None
+        rewrite_start = time.time()
+        search_query = await self.agenerate_search_query(question_text, conversation_history, ctx.llm)
+        stage_timings["rewrite"] = round(time.time() - rewrite_start, 4)
         
+        documentos_relevantes = await self.aretrieve_relevant_documents(search_query, timings=stage_timings)
+        
+        generation_start = time.time()
         try:
-            if usar_retrieval_qa and self.cadena and self.using_vector_db:
-                result = self.cadena.invoke({"query": question_text})
-                respuesta = result["result"]
-                logger.info("Respuesta generada con RetrievalQA")
-            
-            elif plantilla_seleccionada:
-                respuesta = self._generate_with_template(
-                    plantilla_seleccionada, question_text, 
-                    conversation_history, contexto_documentos
-                )
-                logger.info("Respuesta generada con plantilla personalizada")
+            prompt = self._build_answer_prompt(ctx, question_text, conversation_history, documentos_relevantes, tipo_pregunta)
+            async with self._stage_semaphore("generation"):
+                respuesta = await self._ainvoke_llm(prompt, on_token, ctx.llm)
+            stage_timings["generation"] = round(time.time() - generation_start, 4)
             
-            else:
-                respuesta = self._generate_fallback_response(
-                    question_text, conversation_history, contexto_documentos
-                )
-                logger.info("Respuesta generada con fallback")
-            
-            # Limpiar respuesta
-            respuesta_limpia = clean_llm_response(respuesta)
-            respuesta_limpia = self._clean_response_artifacts(respuesta_limpia)
-            
-            return respuesta_limpia.strip()
+            return self._finalize_answer(ctx, question_text, respuesta, question_vector, stage_timings, total_start)
             
         except Exception as e:
-            logger.error(f"Error procesando pregunta: {e}")
-            return "Lo siento, no puedo procesar tu pregunta en este momento."
+            logger.error(f"❌ Error generando respuesta: {e}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            stage_timings["total"] = round(time.time() - total_start, 4)
+            
+            return self._generate_emergency_fallback(question_text, ctx.model_name)
+    
+    def _invoke_llm(self, prompt, on_token=None, llm=None):
+        """Invoca el LLM; con ``on_token`` transmite cada fragmento a medida que se genera."""
+        llm = llm or self.llm
+        if on_token is None:
+            return llm.invoke(prompt)
+        
+        # Se transmite el texto ya limpio: lo que ve el usuario coincide con la respuesta final
+        cleaner = ArtifactStreamCleaner()
+        partes = []
+        for chunk in llm.stream(prompt):
+            if chunk:
+                partes.append(chunk)
+                limpio = cleaner.feed(chunk)
+                if limpio:
+                    on_token(limpio)
+        limpio = cleaner.finish()
+        if limpio:
+            on_token(limpio)
+        return "".join(partes)
     
-    def _generate_with_template(self, template, question, conversation, context_docs):
-        """Genera respuesta usando plantilla específica."""
+    async def _ainvoke_llm(self, prompt, on_token=None, llm=None):
+        """Versión asíncrona de _invoke_llm sobre el cliente asíncrono de Ollama."""
+        llm = llm or self.llm
+        if on_token is None:
+            return await llm.ainvoke(prompt)
+        
+        cleaner = ArtifactStreamCleaner()
+        partes = []
+        async for chunk in llm.astream(prompt):
+            if chunk:
+                partes.append(chunk)
+                limpio = cleaner.feed(chunk)
+                if limpio:
+                    on_token(limpio)
+        limpio = cleaner.finish()
+        if limpio:
+            on_token(limpio)
+        return "".join(partes)
+    
+    def _build_documents_prompt(self, question, context_docs):
+        """Prompt RAG con PROMPT_QA_SIMPLE usando documentos ya recuperados."""
+        return PROMPT_QA_SIMPLE.format(context=context_docs, question=question)
+    
+    def _build_template_prompt(self, template, question, conversation, context_docs):
+        """Prompt usando plantilla específica."""
         if template in [plantilla_saludo, plantilla_despedida]:
-            return self.llm.invoke(template.format(contexto=contexto_base))
+            return template.format(contexto=contexto_base)
         
         template_modificado = (
             "{contexto}\n\n"
@@ -887,19 +1516,17 @@ class AISystem:
         instrucciones_match = re.search(r'Instrucciones específicas: ([^\\n]+(?:\\n[^\\n]+)*?)\\n\\n', template_str)
         instrucciones = instrucciones_match.group(1) if instrucciones_match else "Responde de manera clara y educativa."
         
-        prompt_formateado = template_modificado.format(
+        return template_modificado.format(
             contexto=contexto_base,
             contexto_documentos=context_docs or "No se encontraron documentos específicamente relevantes.",
             instrucciones_especificas=instrucciones,
             conversacion=conversation,
             pregunta=question
         )
-        
-        return self.llm.invoke(prompt_formateado)
     
-    def _generate_fallback_response(self, question, conversation, context_docs):
-        """Genera respuesta usando el método fallback general."""
-        prompt_fallback = f"""
+    def _build_fallback_prompt(self, question, conversation, context_docs):
+        """Prompt del método fallback general."""
+        return f"""
         {contexto_base}
         
         INFORMACIÓN RELEVANTE DE DOCUMENTOS:
@@ -912,77 +1539,100 @@ class AISystem:
         
         Responde de manera educativa y clara, usando la información de los documentos cuando sea relevante:
         """
-        
-        return self.llm.invoke(prompt_fallback)
     
     def _clean_response_artifacts(self, response):
         """Limpia artefactos comunes en las respuestas del LLM."""
-        # Eliminar frases introductorias genéricas
-        response = re.sub(r'^Como (un )?asistente educativo( conversacional)?,?\s*', '', response, flags=re.IGNORECASE)
-        response = re.sub(r'^Basado en (el syllabus|los documentos|la información)( del curso)?,?\s*', '', response, flags=re.IGNORECASE)
-        response = re.sub(r'^¡Claro! Aquí tienes un resumen:\s*', '', response, flags=re.IGNORECASE)
-        
-        # Normalizar saltos de línea
-        response = re.sub(r'\n{3,}', '\n\n', response)
-        
-        return response
+        return clean_response_artifacts(response)
 
-    def _generate_emergency_fallback(self, question):
+    def _generate_emergency_fallback(self, question, model_name=None):
         """Genera respuesta de emergencia cuando todo falla"""
         return (
             f"He recibido tu pregunta: '{question}'. "
             f"Estoy experimentando algunas dificultades técnicas, pero puedo ayudarte con "
             f"conceptos de inteligencia artificial, machine learning, algoritmos y más. "
             f"¿Podrías reformular tu pregunta o ser más específico sobre lo que necesitas saber? "
-            f"\n\n*[Respuesta de emergencia - Modelo: {self.get_current_model()}]*"
+            f"\n\n*[Respuesta de emergencia - Modelo: {model_name or self.get_current_model()}]*"
         )
 
+    def _build_suggestions_prompt(self, conversation_history):
+        """Devuelve (prompt, última respuesta del bot) o (None, texto) si no hay base para sugerir."""
+        # Extraer la última respuesta del bot (limitada para velocidad)
+        ultima_respuesta_bot = ""
+        
+        # Buscar solo la última respuesta del bot (más rápido)
+        for mensaje in reversed(conversation_history):
+            if isinstance(mensaje, dict) and mensaje.get('sender') == 'bot':
+                ultima_respuesta_bot = mensaje.get('text', '')
+                break
+        
+        if not ultima_respuesta_bot or len(ultima_respuesta_bot) < 20:
+            logger.info("No se encontró respuesta válida del bot, usando sugerencias por defecto")
+            return None, ultima_respuesta_bot
+        
+        # Limitar el tamaño de la respuesta para velocidad (máximo 300 caracteres)
+        if len(ultima_respuesta_bot) > 300:
+            ultima_respuesta_bot = ultima_respuesta_bot[:300] + "..."
+        
+        # Usar plantilla simplificada para generar sugerencias
+        from templates import plantilla_sugerencias_dinamicas
+        
+        prompt_formateado = plantilla_sugerencias_dinamicas.format(
+            ultima_respuesta=ultima_respuesta_bot,
+            contexto_conversacion="IA y Machine Learning"  # Contexto fijo para velocidad
+        )
+        return prompt_formateado, ultima_respuesta_bot
+    
+    def _select_suggestions(self, respuesta_llm, ultima_respuesta_bot):
+        """Extrae las sugerencias de la respuesta del LLM completando con fallback contextual."""
+        sugerencias = self._parse_suggestions_from_response_fast(respuesta_llm)
+        
+        if len(sugerencias) >= 2:  # Reducir requisito a 2 sugerencias mínimo
+            logger.info(f"Sugerencias dinámicas generadas exitosamente: {len(sugerencias)}")
+            # Asegurar que tenemos exactamente 3 sugerencias
+            while len(sugerencias) < 3:
+                sugerencias.extend(self._get_contextual_fallback_suggestions(ultima_respuesta_bot))
+            return sugerencias[:3]
+        else:
+            logger.info("LLM no generó suficientes sugerencias, usando fallback contextual")
+            return self._get_contextual_fallback_suggestions(ultima_respuesta_bot)
+    
     def generate_dynamic_suggestions(self, conversation_history):
         """Genera sugerencias dinámicas basadas en el historial de conversación."""
         try:
             if not self.llm or not conversation_history:
                 return self._get_fallback_suggestions()
             
-            # Extraer la última respuesta del bot (limitada para velocidad)
-            ultima_respuesta_bot = ""
-            
-            # Buscar solo la última respuesta del bot (más rápido)
-            for mensaje in reversed(conversation_history):
-                if isinstance(mensaje, dict) and mensaje.get('sender') == 'bot':
-                    ultima_respuesta_bot = mensaje.get('text', '')
-                    break
-            
-            if not ultima_respuesta_bot or len(ultima_respuesta_bot) < 20:
-                logger.info("No se encontró respuesta válida del bot, usando sugerencias por defecto")
+            prompt_formateado, ultima_respuesta_bot = self._build_suggestions_prompt(conversation_history)
+            if prompt_formateado is None:
                 return self._get_fallback_suggestions()
             
-            # Limitar el tamaño de la respuesta para velocidad (máximo 300 caracteres)
-            if len(ultima_respuesta_bot) > 300:
-                ultima_respuesta_bot = ultima_respuesta_bot[:300] + "..."
+            logger.info("Generando sugerencias dinámicas rápidas")
+            respuesta_llm = self.llm.invoke(prompt_formateado)
             
-            # Usar plantilla simplificada para generar sugerencias
-            from templates import plantilla_sugerencias_dinamicas
+            return self._select_suggestions(respuesta_llm, ultima_respuesta_bot)
+                
+        except Exception as e:
+            logger.error(f"Error generando sugerencias dinámicas: {e}")
+            return self._get_fallback_suggestions()
+    
+    async def agenerate_dynamic_suggestions(self, conversation_history):
+        """Versión asíncrona de generate_dynamic_suggestions.
+        
+        No toma el semáforo de generación: las sugerencias tienen su propio
+        timeout en el endpoint y no deben esperar detrás de respuestas largas.
+        """
+        try:
+            if not self.llm or not conversation_history:
+                return self._get_fallback_suggestions()
             
-            prompt_formateado = plantilla_sugerencias_dinamicas.format(
-                ultima_respuesta=ultima_respuesta_bot,
-                contexto_conversacion="IA y Machine Learning"  # Contexto fijo para velocidad
-            )
+            prompt_formateado, ultima_respuesta_bot = self._build_suggestions_prompt(conversation_history)
+            if prompt_formateado is None:
+                return self._get_fallback_suggestions()
             
             logger.info("Generando sugerencias dinámicas rápidas")
-            respuesta_llm = self.llm.invoke(prompt_formateado)
+            respuesta_llm = await self.llm.ainvoke(prompt_formateado)
             
-            # Procesar la respuesta para extraer las sugerencias
-            sugerencias = self._parse_suggestions_from_response_fast(respuesta_llm)
-            
-            if len(sugerencias) >= 2:  # Reducir requisito a 2 sugerencias mínimo
-                logger.info(f"Sugerencias dinámicas generadas exitosamente: {len(sugerencias)}")
-                # Asegurar que tenemos exactamente 3 sugerencias
-                while len(sugerencias) < 3:
-                    sugerencias.extend(self._get_contextual_fallback_suggestions(ultima_respuesta_bot))
-                return sugerencias[:3]
-            else:
-                logger.info("LLM no generó suficientes sugerencias, usando fallback contextual")
-                return self._get_contextual_fallback_suggestions(ultima_respuesta_bot)
+            return self._select_suggestions(respuesta_llm, ultima_respuesta_bot)
                 
         except Exception as e:
             logger.error(f"Error generando sugerencias dinámicas: {e}")
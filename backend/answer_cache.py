@@ -0,0 +1,123 @@
+"""
+Cache Semántico de Respuestas
+=============================
+
+Evita llamar al LLM cuando una pregunta casi idéntica ya fue respondida:
+- Clave: embedding de la pregunta + modelo + versión del corpus
+- Acierto cuando la similitud coseno supera un umbral configurable
+- Las entradas de versiones anteriores del corpus se descartan al
+  re-ingestar PDFs (invalidate)
+
+Solo se usa para preguntas sin historial de conversación, ya que la
+respuesta a una pregunta de seguimiento depende de los turnos previos.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional, Any, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("answer_cache")
+
+
+class _Bucket:
+    """Entradas de un par (modelo, versión del corpus)"""
+
+    def __init__(self, max_entries: int):
+        self.entries: deque = deque(maxlen=max_entries)
+        self._matrix: Optional[np.ndarray] = None
+
+    def add(self, vector: np.ndarray, question: str, answer: str):
+        self.entries.append((vector, question, answer, time.time()))
+        self._matrix = None
+
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix = np.vstack([entry[0] for entry in self.entries])
+        return self._matrix
+
+
+class SemanticAnswerCache:
+    """Cache de respuestas indexado por similitud coseno de embeddings"""
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 512, ttl_seconds: int = 86400):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.buckets: Dict[Tuple[str, str], _Bucket] = {}
+        self.lock = threading.Lock()
+
+        # Contadores
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> Optional[np.ndarray]:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        if norm == 0:
+            return None
+        return array / norm
+
+    def lookup(self, vector: List[float], model: str, corpus_version: str) -> Optional[Dict[str, Any]]:
+        """Busca una respuesta para una pregunta semánticamente equivalente"""
+        query = self._normalize(vector)
+        with self.lock:
+            bucket = self.buckets.get((model, corpus_version))
+            if query is None or bucket is None or not bucket.entries:
+                self.misses += 1
+                return None
+
+            similarities = bucket.matrix() @ query
+            best = int(np.argmax(similarities))
+            score = float(similarities[best])
+            _, question, answer, created_at = bucket.entries[best]
+
+            if score < self.threshold or time.time() - created_at > self.ttl_seconds:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return {"answer": answer, "question": question, "similarity": round(score, 4)}
+
+    def store(self, vector: List[float], question: str, answer: str, model: str, corpus_version: str):
+        """Guarda una respuesta recién generada"""
+        normalized = self._normalize(vector)
+        if normalized is None or not answer:
+            return
+        with self.lock:
+            key = (model, corpus_version)
+            if key not in self.buckets:
+                self.buckets[key] = _Bucket(self.max_entries)
+            self.buckets[key].add(normalized, question, answer)
+            self.stores += 1
+
+    def invalidate(self, keep_corpus_version: Optional[str] = None):
+        """Descarta las entradas de otras versiones del corpus (o todas)"""
+        with self.lock:
+            stale = [key for key in self.buckets if key[1] != keep_corpus_version]
+            for key in stale:
+                del self.buckets[key]
+            self.invalidations += 1
+        if stale:
+            logger.info(f"🧹 Cache de respuestas invalidado: {len(stale)} grupos descartados")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estadísticas del cache para el endpoint de métricas"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": sum(len(bucket.entries) for bucket in self.buckets.values()),
+                "buckets": len(self.buckets),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0
+            }
@@ -6,7 +6,6 @@ from fastapi.middleware.cors import CORSMiddleware
 from sse_starlette.sse import EventSourceResponse
 import logging
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 import time
 import json
 import uuid
@@ -75,6 +74,44 @@ if CELERY_AVAILABLE:
         logger.error(f"❌ Error configurando Celery: {e}")
         CELERY_AVAILABLE = False
 
+# ===== CLIENTE REDIS ASÍNCRONO PARA STREAMING DE TOKENS =====
+from config import REDIS_PORT, STREAM_CHANNEL_PREFIX
+async_redis_client = None
+
+def get_async_redis():
+    """Cliente Redis asíncrono compartido para suscribirse a los tokens del worker"""
+    global async_redis_client
+    if async_redis_client is None:
+        import redis.asyncio as aioredis
+        async_redis_client = aioredis.Redis(host=os.getenv("REDIS_HOST", "localhost"), port=REDIS_PORT, db=0)
+    return async_redis_client
+
+# ===== HISTORIAL DE CHAT CON ESCRITURA DIFERIDA =====
+from config import HISTORY_MAX_MESSAGES, HISTORY_FLUSH_INTERVAL, HISTORY_FLUSH_BATCH, HISTORY_CACHE_SESSIONS
+history_writer = None
+
+def get_history_writer():
+    """Historial por mensaje compartido (chat_messages, escritura diferida)"""
+    global history_writer
+    if history_writer is None:
+        from history_writer import ChatHistoryWriter
+        
+        def history_engine():
+            from models import engine
+            return engine
+        
+        from database import get_async_engine
+        
+        history_writer = ChatHistoryWriter(
+            history_engine,
+            max_messages=HISTORY_MAX_MESSAGES,
+            flush_interval=HISTORY_FLUSH_INTERVAL,
+            flush_batch=HISTORY_FLUSH_BATCH,
+            max_sessions=HISTORY_CACHE_SESSIONS,
+            async_engine_factory=get_async_engine
+        )
+    return history_writer
+
 # Ruta para manejar redirecciones incorrectas de /pages/index.html
 @app.get("/pages/index.html")
 def serve_pages_index_redirect():
@@ -84,6 +121,7 @@ def serve_pages_index_redirect():
 # Variable global para el sistema IA
 ai_system_instance = None
 ai_system_ready = False
+ai_warmup_task = None
 
 # Configurar CORS con headers adicionales
 app.add_middleware(
@@ -101,9 +139,6 @@ app.add_middleware(
 # app.mount("/assets", StaticFiles(directory="../frontend/assets"), name="assets")
 # app.mount("/pages", StaticFiles(directory="../frontend/pages"), name="pages")
 
-# Configurar executor para tareas asíncronas
-executor = ThreadPoolExecutor(max_workers=4)
-
 # Ruta raíz - PRINCIPAL
 @app.get("/")
 def serve_index():
@@ -135,7 +170,7 @@ def serve_metrics_pages():
 @app.on_event("startup")
 async def startup_event():
     """Evento que se ejecuta al iniciar el servidor"""
-    global ai_system_instance, ai_system_ready
+    global ai_system_instance, ai_system_ready, ai_warmup_task
     
     logger.info("=" * 60)
     logger.info("🚀 INICIANDO CHATBOT EDUCATIVO")
@@ -149,27 +184,60 @@ async def startup_event():
     else:
         logger.warning("⚠️ Problemas configurando algunas rutas")
     
+    get_history_writer().start()
+    
     try:
         # Importar y crear instancia del sistema IA
         from ai_system import AISystem
         ai_system_instance = AISystem()
-        
-        # Inicializar el sistema de forma síncrona
-        logger.info("🔄 Inicializando sistema de inteligencia artificial...")
-        start_time = time.time()
-        
-        success = ai_system_instance.initialize_system()
-        
+    except Exception as e:
+        logger.error(f"❌ Error crítico en startup: {e}")
+        logger.info("🔄 Continuando sin sistema IA avanzado...")
+        ai_system_ready = False
+        return
+    
+    # El calentamiento (PDFs, LLM, vector store) corre en segundo plano: el
+    # servidor atiende desde ya y /preguntar usa la respuesta rápida hasta
+    # que termine. El progreso por fase se consulta en /health/ready
+    ai_warmup_task = asyncio.create_task(warm_up_ai_system())
+    logger.info("🌡️ Servidor disponible; sistema IA calentando en segundo plano")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Escribe el historial pendiente y cierra el pool asíncrono antes de detener el servidor"""
+    if history_writer is not None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, history_writer.stop)
+        logger.info("💾 Historial pendiente escrito")
+    
+    import database
+    if database.async_engine is not None:
+        await database.async_engine.dispose()
+
+async def warm_up_ai_system():
+    """Ejecuta initialize_system en un hilo sin bloquear el event loop"""
+    global ai_system_ready
+    
+    logger.info("🔄 Inicializando sistema de inteligencia artificial...")
+    start_time = time.time()
+    loop = asyncio.get_running_loop()
+    
+    try:
+        success = await loop.run_in_executor(None, ai_system_instance.initialize_system)
         initialization_time = time.time() - start_time
         
         if success:
             ai_system_ready = True
             logger.info("=" * 60)
             logger.info(f"✅ SISTEMA LISTO EN {initialization_time:.2f} SEGUNDOS")
-            logger.info(f"🧠 Modelo: {'ChromaDB' if ai_system_instance.using_chroma else 'FAISS' if ai_system_instance.using_vector_db else 'Solo LLM'}")
+            logger.info(f"🧠 Modelo: {ai_system_instance.get_vector_store_type()}")
             logger.info(f"📚 Documentos: {len(ai_system_instance.documentos)}")
             logger.info(f"📄 Fragmentos: {len(ai_system_instance.fragmentos)}")
             logger.info("🌟 El chatbot está listo para recibir consultas")
+            
+            # Los workers de Celery comparan esta versión para recargar su corpus
+            from dashboard import notify_corpus_version
+            await loop.run_in_executor(None, notify_corpus_version, ai_system_instance.corpus_version)
             logger.info("=" * 60)
         else:
             logger.error("❌ Error en la inicialización del sistema IA")
@@ -192,7 +260,8 @@ class Pregunta(BaseModel):
 class SessionIn(BaseModel):
     user_id: str
     session_id: str
-    history: list
+    history: list = None   # Historial completo (clientes anteriores)
+    messages: list = None  # Solo lo nuevo o modificado desde el último guardado
 
 class SolicitudSugerencias(BaseModel):
     userId: str = None
@@ -225,84 +294,6 @@ def generar_respuesta_rapida(pregunta_texto):
     # Respuesta genérica pero útil
     return f"He recibido tu pregunta sobre '{pregunta_texto}'. Te puedo ayudar con conceptos de inteligencia artificial, algoritmos, historia de la IA, machine learning y más. ¿Hay algo específico que te gustaría saber?"
 
-# Función para guardar historial de forma segura
-def save_to_history_safe(user_id, chat_token, pregunta, respuesta):
-    """Guarda la interacción en el historial de forma segura y rápida"""
-    try:
-        from models import engine
-        from sqlalchemy import text
-        
-        # Limitar la longitud de pregunta y respuesta para evitar problemas de BD
-        pregunta_truncated = pregunta[:500] if len(pregunta) > 500 else pregunta
-        respuesta_truncated = respuesta[:2000] if len(respuesta) > 2000 else respuesta
-        
-        # Crear entradas de historial
-        history_entries = [
-            {"sender": "user", "text": pregunta_truncated, "timestamp": datetime.now().isoformat()},
-            {"sender": "bot", "text": respuesta_truncated, "timestamp": datetime.now().isoformat()}
-        ]
-        
-        with engine.connect() as connection:
-            # Verificar si existe la sesión
-            existing = connection.execute(
-                text("SELECT history FROM chat_sessions WHERE user_id = :user_id AND session_id = :session_id"),
-                {"user_id": user_id, "session_id": chat_token}
-            ).fetchone()
-            
-            if existing:
-                # Actualizar historial existente
-                current_history = []
-                if existing[0]:
-                    try:
-                        if isinstance(existing[0], str):
-                            current_history = json.loads(existing[0])
-                        elif isinstance(existing[0], (list, dict)):
-                            current_history = existing[0] if isinstance(existing[0], list) else [existing[0]]
-                        else:
-                            current_history = []
-                    except json.JSONDecodeError:
-                        logger.warning("Error decodificando JSON del historial, creando nuevo historial")
-                        current_history = []
-                
-                current_history.extend(history_entries)
-                
-                # Limitar el historial a los últimos 50 mensajes para evitar que crezca demasiado
-                if len(current_history) > 50:
-                    current_history = current_history[-50:]
-                
-                connection.execute(
-                    text("UPDATE chat_sessions SET history = :history WHERE user_id = :user_id AND session_id = :session_id"),
-                    {"user_id": user_id, "session_id": chat_token, "history": json.dumps(current_history)}
-                )
-            else:
-                # Crear nueva sesión
-                connection.execute(
-                    text("INSERT INTO chat_sessions (user_id, session_id, history) VALUES (:user_id, :session_id, :history)"),
-                    {"user_id": user_id, "session_id": chat_token, "history": json.dumps(history_entries)}
-                )
-            
-            connection.commit()
-            logger.debug(f"Historial guardado para usuario {user_id}, sesión {chat_token}")
-            
-    except Exception as e:
-        logger.warning(f"No se pudo guardar historial: {e}")
-
-async def save_to_history_async(user_id, chat_token, pregunta, respuesta):
-    """Versión asíncrona del guardado de historial"""
-    try:
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(executor, save_to_history_safe, user_id, chat_token, pregunta, respuesta)
-    except Exception as e:
-        logger.warning(f"Error en guardado asíncrono de historial: {e}")
-
-async def save_to_history_safe_silent(user_id, chat_token, pregunta, respuesta):
-    """Versión silenciosa del guardado de historial que nunca falla"""
-    try:
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(executor, lambda: save_to_history_safe(user_id, chat_token, pregunta, respuesta))
-    except:
-        pass  # Ignorar todos los errores
-
 # Endpoint de verificación de conexión básica
 @app.get("/check_connection")
 async def check_connection():
@@ -336,14 +327,13 @@ async def preguntar_basic(pregunta: Pregunta):
             try:
                 logger.info(f"Procesando pregunta con IA: {pregunta.texto}")
                 
-                # Tracking de tiempo de vector search y LLM
-                vector_start = time.time()
+                # Tiempos por etapa (rewrite, embedding, search, generation)
+                stage_timings = {}
                 
-                # Ejecutar procesamiento de pregunta
-                loop = asyncio.get_event_loop()
-                respuesta = await loop.run_in_executor(executor, ai_system_instance.process_question, pregunta)
+                # Pipeline asíncrono: no ocupa hilos del executor mientras espera a Ollama
+                respuesta = await ai_system_instance.aprocess_question(pregunta, stage_timings)
                 
-                vector_time = time.time() - vector_start
+                vector_time = stage_timings.get("embedding", 0) + stage_timings.get("search", 0)
                 processing_time = time.time() - start_time
                 
                 logger.info(f"Respuesta IA generada en {processing_time:.2f}s")
@@ -355,7 +345,8 @@ async def preguntar_basic(pregunta: Pregunta):
                         status="success",
                         response_length=len(respuesta) if respuesta else 0,
                         vector_search_time=vector_time,
-                        llm_processing_time=processing_time
+                        llm_processing_time=stage_timings.get("generation", processing_time),
+                        stage_timings=stage_timings
                     )
                     
             except Exception as ai_error:
@@ -390,13 +381,6 @@ async def preguntar_basic(pregunta: Pregunta):
         if not respuesta or respuesta.strip() == "":
             respuesta = "Lo siento, no pude generar una respuesta adecuada. ¿Podrías reformular tu pregunta?"
         
-        # Intentar guardar historial sin que falle la respuesta
-        if pregunta.userId and pregunta.chatToken:
-            try:
-                asyncio.create_task(save_to_history_safe_silent(pregunta.userId, pregunta.chatToken, pregunta.texto, respuesta))
-            except:
-                pass  # Ignorar errores de historial completamente
-        
         total_time = time.time() - start_time
         logger.info(f"Respuesta enviada: {len(respuesta)} caracteres en {total_time:.2f}s")
         
@@ -415,6 +399,30 @@ async def preguntar_basic(pregunta: Pregunta):
         
         return {"respuesta": "Lo siento, ocurrió un error inesperado. Por favor, inténtalo de nuevo.", "status": "error"}
 
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness: el proceso y el event loop responden (no depende del sistema IA)"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness: el servidor atiende (en modo rápido mientras calienta) y reporta cada fase"""
+    if ai_system_instance is None:
+        return {"status": "basic", "warm": False, "phases": {}}
+    
+    if ai_system_ready:
+        status = "ready"
+    elif ai_warmup_task is not None and not ai_warmup_task.done():
+        status = "warming"
+    else:
+        status = "degraded"
+    
+    return {
+        "status": status,
+        "warm": ai_system_ready,
+        "phases": ai_system_instance.get_startup_status()
+    }
+
 @app.get("/ai_status")
 async def get_ai_status():
     """Endpoint para verificar el estado del sistema IA"""
@@ -435,11 +443,12 @@ async def get_ai_status():
                 }
             }
         else:
+            warming = ai_warmup_task is not None and not ai_warmup_task.done()
             return {
                 "success": True,
                 "ready": False,
-                "message": "Sistema IA no disponible - usando modo básico",
-                "details": {}
+                "message": "Sistema IA calentando - usando modo básico" if warming else "Sistema IA no disponible - usando modo básico",
+                "details": {"phases": ai_system_instance.get_startup_status()} if ai_system_instance else {}
             }
     except Exception as e:
         logger.error(f"Error obteniendo estado IA: {e}")
@@ -554,89 +563,62 @@ async def get_context_status():
 
 # Endpoint optimizado para historial que no interfiera
 @app.get("/chat/history")
-def get_history_basic(user_id: str, session_id: str):
+async def get_history_basic(user_id: str, session_id: str, since_seq: int = None,
+                            before_seq: int = None, limit: int = None):
     try:
-        from models import engine
-        from sqlalchemy import text
-        
-        with engine.connect() as connection:
-            result = connection.execute(
-                text("SELECT history FROM chat_sessions WHERE user_id = :user_id AND session_id = :session_id"),
-                {"user_id": user_id, "session_id": session_id}
-            ).fetchone()
-            
-            if result and result[0]:
-                if isinstance(result[0], (dict, list)):
-                    return result[0]
-                else:
-                    return json.loads(result[0])
-            return []
+        # Paginación por seq: since_seq trae solo lo que el cliente aún no tiene,
+        # before_seq la página anterior; sin parámetros, los mensajes más recientes
+        return await get_history_writer().aget(user_id, session_id, since_seq=since_seq,
+                                               before_seq=before_seq, limit=limit)
     except:
         # Devolver array vacío sin logging de error para evitar spam
         return []
 
 # Otros endpoints básicos del chat
 @app.post("/chat/history")
-def save_history_basic(data: SessionIn):
+async def save_history_basic(data: SessionIn):
     try:
-        from models import engine
-        from sqlalchemy import text
-        
-        history_json = json.dumps(data.history)
-        
-        with engine.connect() as connection:
-            exists = connection.execute(
-                text("SELECT 1 FROM chat_sessions WHERE user_id = :user_id AND session_id = :session_id"),
-                {"user_id": data.user_id, "session_id": data.session_id}
-            ).fetchone()
-            
-            if exists:
-                connection.execute(
-                    text("UPDATE chat_sessions SET history = :history WHERE user_id = :user_id AND session_id = :session_id"),
-                    {"user_id": data.user_id, "session_id": data.session_id, "history": history_json}
-                )
-            else:
-                connection.execute(
-                    text("INSERT INTO chat_sessions (user_id, session_id, history) VALUES (:user_id, :session_id, :history)"),
-                    {"user_id": data.user_id, "session_id": data.session_id, "history": history_json}
-                )
-            
-            connection.commit()
-            return {"ok": True}
+        writer = get_history_writer()
+        if data.messages is not None:
+            # Escritura diferida: el cliente recibe el seq asignado a cada mensaje
+            seqs = await writer.asave(data.user_id, data.session_id, data.messages)
+            return {"ok": True, "seqs": seqs}
+        await writer.asave_history(data.user_id, data.session_id, data.history or [])
+        return {"ok": True}
     except Exception as db_error:
         logger.warning(f"No se pudo guardar en BD: {db_error}")
-        return {"ok": True}
+        return {"ok": False}
 
 @app.get("/chat/sessions")
-def get_sessions_basic(user_id: str):
+async def get_sessions_basic(user_id: str):
     try:
-        from models import engine
+        from database import get_async_engine
         from sqlalchemy import text
         
-        with engine.connect() as connection:
-            result = connection.execute(
+        async with get_async_engine().connect() as connection:
+            result = (await connection.execute(
                 text("SELECT session_id, updated_at as created_at FROM chat_sessions WHERE user_id = :user_id ORDER BY updated_at DESC"),
                 {"user_id": user_id}
-            ).fetchall()
+            )).fetchall()
             return [{"session_id": row[0], "created_at": row[1]} for row in result]
     except:
         return []
 
 @app.get("/chat/message_ratings")
-def get_ratings_basic(user_id: str, session_id: str):
+async def get_ratings_basic(user_id: str, session_id: str):
     try:
-        from models import engine
+        from database import get_async_engine
         from sqlalchemy import text
         
-        with engine.connect() as connection:
-            result = connection.execute(
+        async with get_async_engine().connect() as connection:
+            result = (await connection.execute(
                 text("""
                     SELECT pregunta, respuesta, rating 
                     FROM feedback 
                     WHERE user_id = :user_id AND session_id = :session_id
                 """),
                 {"user_id": user_id, "session_id": session_id}
-            ).fetchall()
+            )).fetchall()
             
             return [
                 {
@@ -653,6 +635,9 @@ def delete_session_basic(user_id: str, session_id: str):
     try:
         from models import SessionLocal, ChatSession
         
+        # Sin esto el hilo de escritura volvería a crear la sesión
+        get_history_writer().forget(user_id, session_id)
+        
         with SessionLocal() as db:
             session = db.query(ChatSession).filter(
                 ChatSession.user_id == user_id,
@@ -669,13 +654,13 @@ def delete_session_basic(user_id: str, session_id: str):
         return {"ok": True}
 
 @app.post("/chat/feedback")
-def save_feedback_basic(fb: FeedbackIn):
+async def save_feedback_basic(fb: FeedbackIn):
     try:
-        from models import engine
+        from database import get_async_engine
         from sqlalchemy import text
         
-        with engine.connect() as connection:
-            connection.execute(
+        async with get_async_engine().connect() as connection:
+            await connection.execute(
                 text("""
                     INSERT INTO feedback (user_id, session_id, pregunta, respuesta, rating, comentario) 
                     VALUES (:user_id, :session_id, :pregunta, :respuesta, :rating, :comentario)
@@ -683,7 +668,7 @@ def save_feedback_basic(fb: FeedbackIn):
                 {"user_id": fb.user_id, "session_id": fb.session_id, "pregunta": fb.pregunta, 
                  "respuesta": fb.respuesta, "rating": fb.rating, "comentario": fb.comentario}
             )
-            connection.commit()
+            await connection.commit()
             return {"ok": True}
     except:
         return {"ok": True}
@@ -820,16 +805,13 @@ async def sugerencias_dinamicas(solicitud: SolicitudSugerencias):
         historial = solicitud.history if solicitud.history else []
         
         # Si el sistema IA está disponible, generar sugerencias dinámicas con timeout
-        if ai_system_ready and ai_system_instance and hasattr(ai_system_instance, 'generate_dynamic_suggestions'):
+        if ai_system_ready and ai_system_instance and hasattr(ai_system_instance, 'agenerate_dynamic_suggestions'):
             try:
                 logger.info("Generando sugerencias dinámicas basadas en conversación")
                 
                 # Ejecutar generación de sugerencias con timeout de 8 segundos
-                loop = asyncio.get_event_loop()
-                sugerencias_task = loop.run_in_executor(
-                    executor, 
-                    ai_system_instance.generate_dynamic_suggestions, 
-                    historial
+                sugerencias_task = asyncio.ensure_future(
+                    ai_system_instance.agenerate_dynamic_suggestions(historial)
                 )
                 
                 # Usar timeout para evitar esperas largas
@@ -1128,7 +1110,6 @@ def get_ai_system_info():
                 "documentos_count": len(getattr(ai_system_instance, 'documentos', [])),
                 "fragmentos_count": len(getattr(ai_system_instance, 'fragmentos', [])),
                 "llm_available": getattr(ai_system_instance, 'llm', None) is not None,
-                "cadena_available": getattr(ai_system_instance, 'cadena', None) is not None,
                 "is_ready": ai_system_ready
             }
         else:
@@ -1138,7 +1119,6 @@ def get_ai_system_info():
                 "documentos_count": 0,
                 "fragmentos_count": 0,
                 "llm_available": False,
-                "cadena_available": False,
                 "error_details": "Sistema no disponible"
             }
     except Exception as e:
@@ -1148,8 +1128,7 @@ def get_ai_system_info():
             "using_vector_db": False,
             "documentos_count": 0,
             "fragmentos_count": 0,
-            "llm_available": False,
-            "cadena_available": False
+            "llm_available": False
         }
 
 # ===============================================
@@ -1200,12 +1179,20 @@ async def get_performance_metrics():
             return {"error": "Sistema de métricas no disponible", "enabled": False}
         
         summary = get_metrics_summary()
+        from database import get_pool_stats
         
         # Extraer solo métricas de rendimiento
         performance_data = {
             "response_times": summary.get("performance", {}),
             "system_resources": summary.get("system", {}),
             "model_performance": summary.get("models", {}),
+            "stage_timings": summary.get("stages", {}),
+            "embedding_cache": ai_system_instance.get_embedding_cache_stats() if ai_system_instance else {},
+            "answer_cache": ai_system_instance.get_answer_cache_stats() if ai_system_instance else {},
+            "retrieval_cache": ai_system_instance.get_retrieval_cache_stats() if ai_system_instance else {},
+            "session_memory": ai_system_instance.get_session_memory_stats() if ai_system_instance else {},
+            "history_writer": history_writer.get_stats() if history_writer else {},
+            "db_pool": get_pool_stats(),
             "active_requests": summary.get("general", {}).get("active_requests", 0),
             "error_rate": summary.get("general", {}).get("error_rate", 0),
             "timestamp": summary.get("timestamp")
@@ -1299,6 +1286,10 @@ def get_performance_recommendations(performance_data):
     if memory_usage > 85:
         recommendations.append("💾 Memoria alta - optimizar cache y liberación de recursos")
     
+    db_pool = performance_data.get("db_pool", {})
+    if db_pool.get("timeouts", 0) > 0 or db_pool.get("p95_wait_ms", 0) > 100:
+        recommendations.append("🗄️ Espera alta por conexiones a la BD - aumentar DB_POOL_SIZE o DB_MAX_OVERFLOW")
+    
     if not recommendations:
         recommendations.append("✅ Sistema funcionando dentro de parámetros normales")
     
@@ -1340,8 +1331,9 @@ async def chat_async(request: AsyncChatRequest):
         return await fallback_to_sync_chat(request)
     
     try:
-        # Generar ID único para la conversación si no se proporciona
-        conversation_id = request.conversation_id or str(uuid.uuid4())
+        # La sesión del chat (chatToken) identifica la conversación para la memoria;
+        # solo sin ninguno de los dos se genera un ID nuevo
+        conversation_id = request.conversation_id or request.chatToken or str(uuid.uuid4())
         
         # Enviar tarea a Celery worker
         task = celery_app.send_task(
@@ -1449,9 +1441,11 @@ async def chat_stream(request: AsyncChatRequest):
         return await fallback_to_sync_streaming(request)
     
     async def event_publisher():
+        pubsub = None
         try:
-            # Generar ID único para la conversación
-            conversation_id = request.conversation_id or str(uuid.uuid4())
+            # La sesión del chat (chatToken) identifica la conversación: así el
+            # worker acumula memoria entre preguntas de la misma sesión
+            conversation_id = request.conversation_id or request.chatToken or str(uuid.uuid4())
             
             # Enviar evento inicial
             yield {
@@ -1464,11 +1458,17 @@ async def chat_stream(request: AsyncChatRequest):
                 })
             }
             
+            # Suscribirse al canal de tokens ANTES de encolar la tarea para no perder eventos
+            task_id = str(uuid.uuid4())
+            pubsub = get_async_redis().pubsub()
+            await pubsub.subscribe(f"{STREAM_CHANNEL_PREFIX}{task_id}")
+            
             # Crear tarea en Celery
             task = celery_app.send_task(
                 'celery_worker.process_chat_task',
                 args=[request.texto, request.modelo, conversation_id],
-                task_id=str(uuid.uuid4())
+                kwargs={'stream_tokens': True},
+                task_id=task_id
             )
             
             logger.info(f"🌊 Streaming task creada: {task.id}")
@@ -1498,36 +1498,25 @@ async def chat_stream(request: AsyncChatRequest):
             except Exception as e:
                 logger.error(f"❌ Error al conectar con BD para registrar task: {e}")
             
-            # Polling del estado de la tarea
+            # Reenviar los tokens publicados por el worker a medida que llegan
             max_wait = 1000  # segundos máximo (para consultas complejas)
-            poll_interval = 0.5  # Polling cada 500ms
-            elapsed = 0
+            idle_check = 5.0  # Sin eventos por 5s: verificar estado de la tarea una vez
+            stream_start = time.time()
+            last_event = stream_start
+            first_token_time = None
+            finished = False
             
-            while elapsed < max_wait:
-                try:
-                    result = AsyncResult(task.id, app=celery_app)
+            while time.time() - stream_start < max_wait:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                
+                if message is None:
+                    if time.time() - last_event < idle_check:
+                        continue
+                    last_event = time.time()
                     
-                    if result.state == 'PENDING':
-                        yield {
-                            "event": "progress", 
-                            "data": json.dumps({
-                                "status": "pending",
-                                "message": "En cola de procesamiento...",
-                                "progress": min(10, elapsed * 2)
-                            })
-                        }
-                    elif result.state == 'PROCESSING':
-                        progress = result.info.get('progress', 50) if result.info else 50
-                        yield {
-                            "event": "progress",
-                            "data": json.dumps({
-                                "status": "processing", 
-                                "message": "Generando respuesta...",
-                                "progress": progress
-                            })
-                        }
-                    elif result.state == 'SUCCESS':
-                        # Tarea completada exitosamente
+                    # Respaldo: la tarea pudo terminar sin publicar eventos (p. ej. worker antiguo)
+                    result = AsyncResult(task.id, app=celery_app)
+                    if result.state == 'SUCCESS':
                         yield {
                             "event": "complete",
                             "data": json.dumps({
@@ -1537,9 +1526,9 @@ async def chat_stream(request: AsyncChatRequest):
                                 "timestamp": datetime.utcnow().isoformat()
                             })
                         }
+                        finished = True
                         break
                     elif result.state == 'FAILURE':
-                        # Error en la tarea
                         yield {
                             "event": "error",
                             "data": json.dumps({
@@ -1548,24 +1537,48 @@ async def chat_stream(request: AsyncChatRequest):
                                 "timestamp": datetime.utcnow().isoformat()
                             })
                         }
+                        finished = True
                         break
-                        
-                    await asyncio.sleep(poll_interval)
-                    elapsed += poll_interval
-                    
-                except Exception as poll_error:
-                    logger.error(f"❌ Error en polling: {poll_error}")
+                    continue
+                
+                last_event = time.time()
+                payload = json.loads(message["data"])
+                
+                if payload.get("type") == "token":
+                    if first_token_time is None:
+                        first_token_time = time.time() - stream_start
+                        logger.info(f"⚡ Primer token de {task.id[:8]}... en {first_token_time:.2f}s")
+                    yield {
+                        "event": "token",
+                        "data": json.dumps({"chunk": payload.get("content", "")})
+                    }
+                elif payload.get("type") == "done":
+                    yield {
+                        "event": "complete",
+                        "data": json.dumps({
+                            "status": "completed",
+                            "result": payload.get("result"),
+                            "progress": 100,
+                            "time_to_first_token": round(first_token_time, 3) if first_token_time is not None else None,
+                            "timestamp": datetime.utcnow().isoformat()
+                        })
+                    }
+                    finished = True
+                    break
+                elif payload.get("type") == "error":
                     yield {
                         "event": "error",
                         "data": json.dumps({
-                            "status": "error",
-                            "error": f"Error en seguimiento: {str(poll_error)}"
+                            "status": "failed",
+                            "error": payload.get("error"),
+                            "timestamp": datetime.utcnow().isoformat()
                         })
                     }
+                    finished = True
                     break
             
             # Timeout si llegamos aquí
-            if elapsed >= max_wait:
+            if not finished:
                 yield {
                     "event": "timeout",
                     "data": json.dumps({
@@ -1584,6 +1597,13 @@ async def chat_stream(request: AsyncChatRequest):
                     "error": str(e)
                 })
             }
+        finally:
+            if pubsub is not None:
+                try:
+                    await pubsub.unsubscribe()
+                    await pubsub.close()
+                except Exception as close_error:
+                    logger.warning(f"Error cerrando suscripción de streaming: {close_error}")
     
     return EventSourceResponse(event_publisher())
 
@@ -1602,35 +1622,38 @@ async def fallback_to_sync_streaming(request: AsyncChatRequest):
                 })
             }
             
-            # Simular progreso
-            for progress in [20, 40, 60, 80]:
+            # Procesar con el pipeline asíncrono, transmitiendo tokens a medida que llegan
+            conversation_id = request.conversation_id or request.chatToken or str(uuid.uuid4())
+            pregunta = Pregunta(
+                texto=request.texto,
+                userId=request.userId,
+                chatToken=request.chatToken or conversation_id,
+                modelo=request.modelo
+            )
+            
+            token_queue = asyncio.Queue()
+            
+            future = asyncio.create_task(
+                ai_system_instance.aprocess_question(pregunta, on_token=token_queue.put_nowait)
+            )
+            future.add_done_callback(lambda _: token_queue.put_nowait(None))
+            
+            while True:
+                chunk = await token_queue.get()
+                if chunk is None:
+                    break
                 yield {
-                    "event": "progress",
-                    "data": json.dumps({
-                        "status": "processing",
-                        "message": "Generando respuesta...",
-                        "progress": progress
-                    })
+                    "event": "token",
+                    "data": json.dumps({"chunk": chunk})
                 }
-                await asyncio.sleep(0.5)
-            
-            # Procesar usando el sistema sincrónico
-            conversation_id = request.conversation_id or str(uuid.uuid4())
             
-            # Usar el procesamiento sincrónico existente
-            with ThreadPoolExecutor(max_workers=1) as executor:
-                future = executor.submit(
-                    ai_system_instance.process_question,
-                    request.texto,
-                    request.modelo or "default"
-                )
-                result = future.result()
+            result = await future
             
             yield {
                 "event": "complete",
                 "data": json.dumps({
                     "status": "completed",
-                    "result": result,
+                    "result": {"response": result, "conversation_id": conversation_id},
                     "progress": 100,
                     "timestamp": datetime.utcnow().isoformat()
                 })
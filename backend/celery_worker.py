@@ -4,8 +4,10 @@
 
 import os
 import sys
+import json
 import logging
 import traceback
+import threading
 import time
 from datetime import datetime
 from celery import Celery, Task
@@ -104,6 +106,70 @@ def initialize_ai_system():
     
     return ai_system_instance
 
+# ===== PUBLICACIÓN DE TOKENS (STREAMING) =====
+# Cliente Redis compartido por los threads del worker
+stream_redis_client = None
+
+def get_stream_redis():
+    """Obtener el cliente Redis usado para publicar tokens"""
+    global stream_redis_client
+    
+    if stream_redis_client is None:
+        from redis import Redis
+        stream_redis_client = Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+    
+    return stream_redis_client
+
+def publish_stream_event(task_id, payload):
+    """Publica un evento de streaming en el canal pub/sub de la tarea"""
+    try:
+        get_stream_redis().publish(f"{STREAM_CHANNEL_PREFIX}{task_id}", json.dumps(payload))
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo publicar evento de streaming ({task_id}): {e}")
+
+# ===== REGISTRO DE TAREAS EN BD =====
+def update_task_record(task_id, **fields):
+    """Actualiza la fila de la tarea con un único UPDATE sobre el pool compartido"""
+    from sqlalchemy import update
+    from models import engine, ChatTask
+    with engine.begin() as connection:
+        result = connection.execute(
+            update(ChatTask).where(ChatTask.task_id == task_id).values(**fields)
+        )
+    return result.rowcount
+
+# ===== RECARGA DEL CORPUS =====
+corpus_reload_lock = threading.Lock()
+
+def sync_corpus_version(ai_system):
+    """Recarga el corpus en segundo plano si la API publicó una versión distinta"""
+    try:
+        published = get_stream_redis().get(CORPUS_VERSION_KEY)
+    except Exception as e:
+        logger.debug(f"No se pudo leer la versión del corpus: {e}")
+        return
+    
+    if not published:
+        return
+    published = published.decode() if isinstance(published, bytes) else published
+    if published == ai_system.corpus_version:
+        return
+    
+    # Solo un thread del worker lanza la recarga; el resto sigue con el corpus actual
+    if not corpus_reload_lock.acquire(blocking=False):
+        return
+    
+    def reload():
+        try:
+            logger.info(f"📚 Nueva versión del corpus publicada ({published}), recargando...")
+            ai_system.reload_corpus()
+        except Exception as e:
+            logger.error(f"❌ Error recargando el corpus en el worker: {e}")
+        finally:
+            corpus_reload_lock.release()
+    
+    threading.Thread(target=reload, daemon=True).start()
+
 # ===== TASK BASE CLASS =====
 # class CallbackTask(Task):
 #     """Clase base para tareas con callbacks de progreso"""
@@ -124,7 +190,7 @@ def initialize_ai_system():
 # ===== TAREAS ASINCRÓNICAS =====
 
 @celery_app.task(bind=True)
-def process_chat_task(self, user_input, model_name=None, conversation_id=None):
+def process_chat_task(self, user_input, model_name=None, conversation_id=None, stream_tokens=False):
     """
     Tarea asincrónica para procesar consultas de chat
     
@@ -132,6 +198,8 @@ def process_chat_task(self, user_input, model_name=None, conversation_id=None):
         user_input (str): Consulta del usuario
         model_name (str, optional): Modelo a usar
         conversation_id (str, optional): ID de conversación
+        stream_tokens (bool, optional): Publicar tokens en Redis pub/sub
+            (canal STREAM_CHANNEL_PREFIX + task_id) a medida que se generan
     
     Returns:
         dict: Resultado del procesamiento
@@ -156,23 +224,12 @@ def process_chat_task(self, user_input, model_name=None, conversation_id=None):
     
     # Actualizar BD: PROCESSING
     try:
-        from models import SessionLocal, ChatTask, TaskStatusEnum
-        db = SessionLocal()
-        try:
-            task_record = db.query(ChatTask).filter(ChatTask.task_id == task_id).first()
-            if task_record:
-                task_record.status = TaskStatusEnum.PROCESSING
-                task_record.started_at = datetime.utcnow()
-                task_record.worker_name = worker_hostname
-                db.commit()
-                logger.info(f"✅ BD actualizada: task {task_id} -> PROCESSING (Worker: {worker_hostname})")
-        except Exception as e:
-            db.rollback()
-            logger.error(f"❌ Error actualizando BD (PROCESSING): {e}")
-        finally:
-            db.close()
+        from models import TaskStatusEnum
+        if update_task_record(task_id, status=TaskStatusEnum.PROCESSING,
+                              started_at=datetime.utcnow(), worker_name=worker_hostname):
+            logger.info(f"✅ BD actualizada: task {task_id} -> PROCESSING (Worker: {worker_hostname})")
     except Exception as e:
-        logger.error(f"❌ Error conectando a BD: {e}")
+        logger.error(f"❌ Error actualizando BD (PROCESSING): {e}")
     
     try:
         # Actualizar estado: PROCESANDO
@@ -187,20 +244,10 @@ def process_chat_task(self, user_input, model_name=None, conversation_id=None):
         
         # Inicializar sistema de IA
         ai_system = initialize_ai_system()
+        sync_corpus_version(ai_system)
         
-        # Actualizar estado: CAMBIANDO MODELO (si es necesario)
-        if model_name and model_name != ai_system.current_model:
-            self.update_state(
-                state='PROCESSING',
-                meta={
-                    'status': f'Cambiando a modelo {model_name}...',
-                    'progress': 20,
-                    'start_time': start_time
-                }
-            )
-            
-            logger.info(f"🔄 Cambiando modelo a: {model_name}")
-            ai_system.switch_model(model_name)
+        # El modelo se resuelve por consulta: no se cambia el modelo activo del worker
+        model_used = ai_system.resolve_model_name(model_name)
         
         # Actualizar estado: PROCESANDO CONSULTA
         self.update_state(
@@ -221,14 +268,18 @@ def process_chat_task(self, user_input, model_name=None, conversation_id=None):
             texto=user_input,
             userId=conversation_id or task_id,
             chatToken=conversation_id or task_id,
-            history=[],  # Por ahora vacío, se podría implementar historial después
-            modelo=model_name or "llama3"
+            history=[],  # Sin historial del cliente: el contexto sale de la memoria de la sesión (chatToken)
+            modelo=model_used
         )
         
-        result = ai_system.process_question(pregunta_obj)
+        stage_timings = {}
+        on_token = None
+        if stream_tokens:
+            on_token = lambda chunk: publish_stream_event(task_id, {"type": "token", "content": chunk})
+        
+        result = ai_system.process_question(pregunta_obj, timings=stage_timings, on_token=on_token)
         
         # Agregar etiqueta del modelo a la respuesta
-        model_used = ai_system.current_model
         response_with_model = f"{result}\n\n[Respuesta generada con {model_used}]"
         
         end_time = time.time()
@@ -248,39 +299,37 @@ def process_chat_task(self, user_input, model_name=None, conversation_id=None):
                 'input_length': len(user_input),
                 'response_length': len(response_with_model),
                 'vector_db_used': ai_system.using_vector_db,
-                'documents_count': len(ai_system.documentos)
+                'documents_count': len(ai_system.documentos),
+                'stage_timings': stage_timings
             }
         }
         
+        if stream_tokens:
+            publish_stream_event(task_id, {"type": "done", "result": final_result})
+        
         logger.info(f"✅ Tarea {task_id} completada en {processing_time:.2f}s")
         logger.info(f"   - 🕒 Hora fin: {completion_time}")
         logger.info(f"   - Modelo: {model_used}")
         logger.info(f"   - Respuesta: {len(response_with_model)} chars (con etiqueta)")
         logger.info(f"   - 📊 Performance: {len(user_input)} chars input → {len(result)} chars output (+ etiqueta)")
+        logger.info(f"   - ⏱️ Etapas: {stage_timings}")
         
         # Actualizar BD: COMPLETED
         try:
-            from models import SessionLocal, ChatTask, TaskStatusEnum
-            db = SessionLocal()
-            try:
-                task_record = db.query(ChatTask).filter(ChatTask.task_id == task_id).first()
-                if task_record:
-                    task_record.status = TaskStatusEnum.COMPLETED
-                    task_record.completed_at = datetime.utcnow()
-                    task_record.processing_time = processing_time
-                    task_record.response = response_with_model
-                    task_record.response_length = len(response_with_model)
-                    task_record.vector_db_used = ai_system.using_vector_db
-                    task_record.documents_count = len(ai_system.documentos)
-                    db.commit()
-                    logger.info(f"✅ BD actualizada: task {task_id} -> COMPLETED")
-            except Exception as e:
-                db.rollback()
-                logger.error(f"❌ Error actualizando BD (COMPLETED): {e}")
-            finally:
-                db.close()
+            from models import TaskStatusEnum
+            if update_task_record(
+                task_id,
+                status=TaskStatusEnum.COMPLETED,
+                completed_at=datetime.utcnow(),
+                processing_time=processing_time,
+                response=response_with_model,
+                response_length=len(response_with_model),
+                vector_db_used=ai_system.using_vector_db,
+                documents_count=len(ai_system.documentos)
+            ):
+                logger.info(f"✅ BD actualizada: task {task_id} -> COMPLETED")
         except Exception as e:
-            logger.error(f"❌ Error conectando a BD: {e}")
+            logger.error(f"❌ Error actualizando BD (COMPLETED): {e}")
         
         return final_result
         
@@ -289,25 +338,17 @@ def process_chat_task(self, user_input, model_name=None, conversation_id=None):
         logger.error(f"❌ Tarea {task_id} falló: {error_msg}")
         logger.error(f"Traceback: {traceback.format_exc()}")
         
+        if stream_tokens:
+            publish_stream_event(task_id, {"type": "error", "error": error_msg})
+        
         # Actualizar BD: FAILED
         try:
-            from models import SessionLocal, ChatTask, TaskStatusEnum
-            db = SessionLocal()
-            try:
-                task_record = db.query(ChatTask).filter(ChatTask.task_id == task_id).first()
-                if task_record:
-                    task_record.status = TaskStatusEnum.FAILED
-                    task_record.completed_at = datetime.utcnow()
-                    task_record.error_message = error_msg[:500]  # Limitar longitud
-                    db.commit()
-                    logger.info(f"✅ BD actualizada: task {task_id} -> FAILED")
-            except Exception as db_error:
-                db.rollback()
-                logger.error(f"❌ Error actualizando BD (FAILED): {db_error}")
-            finally:
-                db.close()
-        except Exception as e:
-            logger.error(f"❌ Error conectando a BD: {e}")
+            from models import TaskStatusEnum
+            if update_task_record(task_id, status=TaskStatusEnum.FAILED, completed_at=datetime.utcnow(),
+                                  error_message=error_msg[:500]):  # Limitar longitud
+                logger.info(f"✅ BD actualizada: task {task_id} -> FAILED")
+        except Exception as db_error:
+            logger.error(f"❌ Error actualizando BD (FAILED): {db_error}")
         
         # Retornar error en lugar de usar update_state para evitar conflictos con Redis
         return {
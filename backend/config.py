@@ -24,6 +24,19 @@ DB_NAME = os.getenv("DB_NAME", "bd_chatbot")
 
 # Usar pymysql para compatibilidad
 DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}?charset=utf8mb4"
+# Driver asíncrono para los endpoints async def (SQLAlchemy asyncio)
+ASYNC_DATABASE_URL = f"mysql+aiomysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}?charset=utf8mb4"
+
+# Pool de conexiones del engine compartido (database.py): conexiones fijas y extra,
+# segundos de espera por una conexión libre, reciclaje y timeouts del driver
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+DB_READ_TIMEOUT = int(os.getenv("DB_READ_TIMEOUT", "60"))
+DB_WRITE_TIMEOUT = int(os.getenv("DB_WRITE_TIMEOUT", "60"))
 
 # Configuración de Ollama
 # En Kubernetes usar IP privada, en Docker usar host.docker.internal, en local usar localhost
@@ -34,6 +47,7 @@ PDFS_DIR = os.path.join(os.path.dirname(__file__), "data", "pdfs")
 CACHE_DIR = os.path.join(os.path.dirname(__file__), "data", "cache")  
 CHROMA_PATH = os.path.join(os.path.dirname(__file__), "data", "chroma_db")  
 FAISS_PATH = os.path.join(os.path.dirname(__file__), "data", "faiss_index") 
+NUMPY_INDEX_PATH = os.getenv("NUMPY_INDEX_PATH", os.path.join(os.path.dirname(__file__), "data", "numpy_index"))
 
 # Configuración del modelo
 MODEL_NAME = "llama3"
@@ -41,19 +55,94 @@ MODEL_TEMPERATURE = 0.3
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
 
+# Procesos para parsear y hashear PDFs en paralelo durante la ingesta
+PDF_INGEST_WORKERS = int(os.getenv("PDF_INGEST_WORKERS", str(os.cpu_count() or 1)))
+
+# Configuración de embeddings y su cache de consultas
+EMBEDDING_MODEL = "nomic-embed-text"
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+EMBEDDING_CACHE_PERSIST = os.getenv("EMBEDDING_CACHE_PERSIST", "true").lower() in ("1", "true", "yes")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(CACHE_DIR, "query_embeddings.sqlite3"))
+EMBEDDING_CACHE_DISK_MAX = int(os.getenv("EMBEDDING_CACHE_DISK_MAX", "50000"))
+
+# Cache semántico de respuestas (preguntas sin historial)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+
+# Tamaño de lote al sincronizar el vector store (altas y bajas por ID de fragmento)
+VECTOR_SYNC_BATCH_SIZE = int(os.getenv("VECTOR_SYNC_BATCH_SIZE", "256"))
+
+# Construcción de índices: lote por petición a Ollama, peticiones en vuelo y checkpoint
+INDEX_EMBEDDING_BATCH_SIZE = int(os.getenv("INDEX_EMBEDDING_BATCH_SIZE", "64"))
+INDEX_EMBEDDING_MAX_IN_FLIGHT = int(os.getenv("INDEX_EMBEDDING_MAX_IN_FLIGHT", "4"))
+INDEX_CHECKPOINT_PATH = os.getenv("INDEX_CHECKPOINT_PATH", os.path.join(CACHE_DIR, "index_checkpoint.sqlite3"))
+INDEX_CHECKPOINT_MAX = int(os.getenv("INDEX_CHECKPOINT_MAX", "500000"))
+
+# Configuración de recuperación (búsqueda MMR única por pregunta)
+RETRIEVAL_K = 8
+RETRIEVAL_LAMBDA_MULT = 0.5
+
+# Backend vectorial: "chroma" (por defecto) o "numpy" (matriz float32 mapeada en memoria,
+# compartida entre procesos del mismo host). Si ChromaDB falla se usa NumPy y, en último caso, FAISS
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+NUMPY_INDEX_BLOCK_ROWS = int(os.getenv("NUMPY_INDEX_BLOCK_ROWS", "65536"))
+
+# Búsqueda híbrida: índice BM25 en memoria fusionado con la búsqueda vectorial (RRF)
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() in ("1", "true", "yes")
+KEYWORD_SEARCH_K = int(os.getenv("KEYWORD_SEARCH_K", "8"))
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+
+# Cache de resultados de recuperación (consulta normalizada + versión del corpus → IDs),
+# compartido entre la API y los workers a través de Redis
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "2048"))
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", "3600"))
+RETRIEVAL_CACHE_PREFIX = "retrieval:"
+
+# Memoria de conversación por sesión (chatToken)
+SESSION_MEMORY_MAX_TOKENS = int(os.getenv("SESSION_MEMORY_MAX_TOKENS", "1500"))
+SESSION_MEMORY_SUMMARY_TOKENS = int(os.getenv("SESSION_MEMORY_SUMMARY_TOKENS", "300"))
+SESSION_MEMORY_MAX_SESSIONS = int(os.getenv("SESSION_MEMORY_MAX_SESSIONS", "1000"))
+SESSION_MEMORY_TTL = int(os.getenv("SESSION_MEMORY_TTL", "7200"))
+
+# Historial de chat por mensaje con escritura diferida: mensajes recientes cacheados por sesión
+# (también la página por defecto de /chat/history), vaciado periódico en lotes
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "50"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))
+HISTORY_FLUSH_BATCH = int(os.getenv("HISTORY_FLUSH_BATCH", "200"))
+HISTORY_CACHE_SESSIONS = int(os.getenv("HISTORY_CACHE_SESSIONS", "1000"))
+
+# Presupuesto de tokens del prompt (ventana del modelo en AVAILABLE_MODELS)
+DEFAULT_CONTEXT_WINDOW = 4096
+PROMPT_RESPONSE_RESERVE = int(os.getenv("PROMPT_RESPONSE_RESERVE", "1024"))
+PROMPT_HISTORY_SHARE = float(os.getenv("PROMPT_HISTORY_SHARE", "0.3"))
+
+# Concurrencia máxima por etapa en el pipeline asíncrono de /preguntar
+ASYNC_EMBEDDING_CONCURRENCY = int(os.getenv("ASYNC_EMBEDDING_CONCURRENCY", "8"))
+ASYNC_SEARCH_CONCURRENCY = int(os.getenv("ASYNC_SEARCH_CONCURRENCY", "8"))
+ASYNC_GENERATION_CONCURRENCY = int(os.getenv("ASYNC_GENERATION_CONCURRENCY", "4"))
+
 # Configuración de modelos disponibles
 AVAILABLE_MODELS = {
     "llama3": {
         "name": "llama3",
         "display_name": "Llama 3",
         "description": "Modelo rápido y general",
-        "temperature": 0.3
+        "temperature": 0.3,
+        "context_window": 8192,
+        "chars_per_token": 3.5
     },
     "phi4": {
         "name": "phi4", 
         "display_name": "Phi 4",
         "description": "Modelo avanzado de razonamiento",
-        "temperature": 0.2
+        "temperature": 0.2,
+        "context_window": 16384,
+        "chars_per_token": 3.5
     }
 }
 
@@ -63,3 +152,12 @@ DEFAULT_MODEL = "llama3"
 # Redis
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+
+# Canal pub/sub de Redis por tarea para transmitir tokens al endpoint SSE
+STREAM_CHANNEL_PREFIX = "chat_stream:"
+
+# Clave de Redis con la versión vigente del corpus (los workers recargan si cambia)
+CORPUS_VERSION_KEY = "corpus_version"
+
+# Fases del arranque del AISystem, en orden de ejecución
+STARTUP_PHASES = ("fragments", "llm", "vector_store")
@@ -3,7 +3,7 @@ from fastapi import APIRouter, Request, HTTPException
 from fastapi.responses import JSONResponse
 import logging
 from pydantic import BaseModel
-from sqlalchemy import text
+from sqlalchemy import text, select
 from sqlalchemy.orm import Session  
 from datetime import datetime, timedelta
 import json
@@ -46,6 +46,9 @@ User = None
 ChatSession = None
 Feedback = None
 check_db_connection = None
+get_async_engine = None
+get_async_session = None
+check_db_connection_async = None
 pwd_context = None
 llm = None
 fragmentos = []
@@ -176,6 +179,10 @@ try:
     else:
         logger.info("Database engine imported successfully")
     
+    # Engine asíncrono para los endpoints de lectura más consultados
+    from database import get_async_engine, get_async_session
+    from database import is_database_available_async as check_db_connection_async
+    
     from auth import pwd_context
     logger.info("Auth context imported successfully")
     
@@ -208,6 +215,17 @@ def is_database_available():
         logger.error(f"Error checking database availability: {e}")
         return False
 
+async def is_database_available_async():
+    """``is_database_available`` sobre el engine asíncrono (no ocupa un thread)"""
+    try:
+        if check_db_connection_async is None:
+            logger.warning("Async database engine is not available")
+            return False
+        return await check_db_connection_async()
+    except Exception as e:
+        logger.error(f"Error checking database availability: {e}")
+        return False
+
 # Response models for dashboard
 class UserDeleteResponse(BaseModel):
     success: bool
@@ -393,20 +411,21 @@ async def upload_pdf_file(file: UploadFile = File(...)):
     finally:
         file.file.close()
 
-    # 3. Intentar recargar los documentos del sistema de IA (Paso Crítico)
+    # 3. Recargar el corpus en segundo plano: las consultas siguen atendiéndose
     try:
         from app import ai_system_instance
-        if hasattr(ai_system_instance, 'load_documents'):
-            # Si existe un método para recargar, lo llamamos.
-            ai_system_instance.load_documents() 
-            logger.info("Se ha activado la recarga de documentos en el sistema de IA.")
-            message = "Archivo subido y sistema de IA actualizado."
+        if ai_system_instance is not None and hasattr(ai_system_instance, 'reload_corpus'):
+            started = start_corpus_reload(ai_system_instance, file.filename)
+            message = (
+                "Archivo subido. El chatbot se está actualizando en segundo plano."
+                if started else
+                "Archivo subido. Se incorporará al terminar la actualización en curso."
+            )
         else:
-            # Si no, informamos que se requiere un reinicio.
-            logger.warning("El sistema de IA no tiene un método 'load_documents'. Se requerirá un reinicio para que el nuevo PDF sea utilizado.")
-            message = "Archivo subido. Se requiere reiniciar el servidor para que el chatbot lo utilice."
+            logger.warning("El sistema de IA no está disponible; el PDF se cargará en el próximo inicio.")
+            message = "Archivo subido. El sistema de IA aún no está disponible; se usará al iniciar."
 
-        return {"success": True, "filename": file.filename, "message": message}
+        return {"success": True, "filename": file.filename, "message": message, "reload": dict(_corpus_reload_state)}
         
     except Exception as e:
         logger.error(f"Error al intentar recargar los documentos del sistema de IA: {e}")
@@ -414,18 +433,89 @@ async def upload_pdf_file(file: UploadFile = File(...)):
         return {"success": True, "filename": file.filename, "message": "Archivo subido, pero no se pudo actualizar el chatbot automáticamente."}
 
 
+# Estado de la recarga del corpus en segundo plano
+_corpus_reload_state = {
+    "status": "idle",
+    "filename": None,
+    "started_at": None,
+    "finished_at": None,
+    "summary": None,
+    "error": None,
+    "pending": False
+}
+_corpus_reload_lock = threading.Lock()
+
+
+def start_corpus_reload(ai_system_instance, filename):
+    """Lanza la recarga incremental del corpus; si ya hay una en curso la deja pendiente"""
+    with _corpus_reload_lock:
+        if _corpus_reload_state["status"] == "running":
+            # Los PDFs subidos mientras tanto se incorporan en una segunda pasada
+            _corpus_reload_state["pending"] = True
+            return False
+        _corpus_reload_state.update({
+            "status": "running",
+            "filename": filename,
+            "started_at": datetime.now().isoformat(),
+            "finished_at": None,
+            "summary": None,
+            "error": None,
+            "pending": False
+        })
+
+    Thread(target=_run_corpus_reload, args=(ai_system_instance,), daemon=True).start()
+    return True
+
+
+def _run_corpus_reload(ai_system_instance):
+    while True:
+        # Cada pasada informa solo su propio resultado
+        with _corpus_reload_lock:
+            _corpus_reload_state["summary"] = None
+            _corpus_reload_state["error"] = None
+        try:
+            summary = ai_system_instance.reload_corpus()
+            notify_corpus_version(ai_system_instance.corpus_version)
+            with _corpus_reload_lock:
+                _corpus_reload_state["summary"] = summary
+        except Exception as e:
+            logger.error(f"❌ Error recargando el corpus: {e}")
+            with _corpus_reload_lock:
+                _corpus_reload_state["error"] = str(e)
+
+        with _corpus_reload_lock:
+            if _corpus_reload_state["pending"]:
+                _corpus_reload_state["pending"] = False
+                continue
+            _corpus_reload_state["status"] = "error" if _corpus_reload_state["error"] else "completed"
+            _corpus_reload_state["finished_at"] = datetime.now().isoformat()
+            return
 
 
+def notify_corpus_version(corpus_version):
+    """Publica la versión del corpus en Redis para que los workers de Celery la recarguen"""
+    try:
+        from redis import Redis
+        from config import REDIS_HOST, REDIS_PORT, CORPUS_VERSION_KEY
+        Redis(host=REDIS_HOST, port=REDIS_PORT, db=0).set(CORPUS_VERSION_KEY, corpus_version)
+        logger.info(f"📣 Versión del corpus publicada para los workers: {corpus_version}")
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo notificar la versión del corpus a los workers: {e}")
 
 
+@router.get("/corpus-reload-status")
+def get_corpus_reload_status():
+    """Estado de la última recarga del corpus lanzada desde /upload-pdf"""
+    with _corpus_reload_lock:
+        return dict(_corpus_reload_state)
 
 
 # Nuevo endpoint para estadísticas del dashboard
 @router.get("/stats")
-def get_dashboard_stats():
+async def get_dashboard_stats():
     """Obtiene estadísticas generales del dashboard - MEJORADO CON AI INFO"""
     try:
-        if not is_database_available():
+        if not await is_database_available_async():
             logger.warning("Database not available, returning fallback stats")
             # Obtener información del sistema de IA aunque la BD no esté disponible
             ai_info = get_ai_system_info()
@@ -453,28 +543,28 @@ def get_dashboard_stats():
         # Obtener información del sistema de IA
         ai_info = get_ai_system_info()
 
-        with engine.connect() as connection:
+        async with get_async_engine().connect() as connection:
             # Estadísticas de usuarios
-            users_result = connection.execute(text("SELECT COUNT(*) FROM users")).fetchone()
+            users_result = (await connection.execute(text("SELECT COUNT(*) FROM users"))).fetchone()
             total_users = users_result[0] if users_result else 0
             
             # Estadísticas de sesiones
-            sessions_result = connection.execute(text("SELECT COUNT(*) FROM chat_sessions")).fetchone()
+            sessions_result = (await connection.execute(text("SELECT COUNT(*) FROM chat_sessions"))).fetchone()
             total_sessions = sessions_result[0] if sessions_result else 0
             
             # Estadísticas de feedback con más detalle
-            feedback_result = connection.execute(
+            feedback_result = (await connection.execute(
                 text("SELECT COUNT(*), AVG(rating), MIN(rating), MAX(rating) FROM feedback")
-            ).fetchone()
+            )).fetchone()
             total_feedback = feedback_result[0] if feedback_result else 0
             avg_rating = round(feedback_result[1], 2) if feedback_result[1] else 0
             min_rating = feedback_result[2] if feedback_result[2] else 0
             max_rating = feedback_result[3] if feedback_result[3] else 0
             
             # Usuarios activos últimos 7 días
-            active_users_result = connection.execute(
+            active_users_result = (await connection.execute(
                 text("SELECT COUNT(DISTINCT user_id) FROM chat_sessions WHERE updated_at >= DATE_SUB(NOW(), INTERVAL 7 DAY)")
-            ).fetchone()
+            )).fetchone()
             active_users = active_users_result[0] if active_users_result else 0
             
             # Determinar estado del sistema basado en componentes críticos - MEJORADO
@@ -556,10 +646,10 @@ def get_dashboard_stats():
         }
 
 @router.get("/user-sessions")
-def get_user_sessions_stats():
+async def get_user_sessions_stats():
     """Obtiene estadísticas de sesiones de usuarios - CON FALLBACK"""
     try:
-        if not is_database_available():
+        if not await is_database_available_async():
             logger.warning("Database not available for user sessions stats")
             return {
                 "sessions_by_day": [],
@@ -572,31 +662,33 @@ def get_user_sessions_stats():
                 "error": "Database connection not available"
             }
 
-        with engine.connect() as connection:
+        async with get_async_engine().connect() as connection:
             # Generar los últimos 30 días con datos de sesiones o 0
             today = datetime.now().date()
-            sessions_by_day = []
+            first_day = today - timedelta(days=29)
+            
+            # Una sola consulta agrupada por día (antes, una por cada fecha)
+            counts = (await connection.execute(
+                text("""
+                    SELECT DATE(updated_at) as day, COUNT(*) as sessions
+                    FROM chat_sessions 
+                    WHERE updated_at >= :first_day
+                    GROUP BY DATE(updated_at)
+                """),
+                {"first_day": first_day}
+            )).fetchall()
+            sessions_per_date = {row[0]: row[1] for row in counts}
             
+            sessions_by_day = []
             for i in range(29, -1, -1):  # Desde 29 días atrás hasta hoy
                 date = today - timedelta(days=i)
-                
-                # Buscar si hay datos para esta fecha
-                session_count = connection.execute(
-                    text("""
-                        SELECT COUNT(*) as sessions
-                        FROM chat_sessions 
-                        WHERE DATE(updated_at) = :date
-                    """),
-                    {"date": date}
-                ).fetchone()
-                
                 sessions_by_day.append({
                     "date": date.isoformat(),
-                    "sessions": session_count[0] if session_count else 0
+                    "sessions": sessions_per_date.get(date, 0)
                 })
             
             # Usuarios más activos
-            active_users = connection.execute(
+            active_users = (await connection.execute(
                 text("""
                     SELECT cs.user_id, u.nombre, u.email, COUNT(*) as session_count,
                            MAX(cs.updated_at) as last_activity
@@ -606,7 +698,7 @@ def get_user_sessions_stats():
                     ORDER BY session_count DESC
                     LIMIT 10
                 """)
-            ).fetchall()
+            )).fetchall()
             
             top_users = []
             for row in active_users:
@@ -833,11 +925,11 @@ def get_dashboard_users():
         }
     
 @router.get("/recent-feedback")
-def get_dashboard_recent_feedback(limit: int = 50):
+async def get_dashboard_recent_feedback(limit: int = 50):
     """Obtiene feedback reciente con información de usuarios para el dashboard"""
     try:
-        with engine.connect() as connection:
-            result = connection.execute(
+        async with get_async_engine().connect() as connection:
+            result = (await connection.execute(
                 text("""
                     SELECT f.id, f.user_id, f.pregunta, f.respuesta, f.rating, 
                            f.comentario, f.created_at, u.nombre, u.email
@@ -847,7 +939,7 @@ def get_dashboard_recent_feedback(limit: int = 50):
                     LIMIT :limit
                 """),
                 {"limit": limit}
-            ).fetchall()
+            )).fetchall()
             
             feedback_list = []
             for row in result:
@@ -1192,10 +1284,10 @@ def get_dashboard_analytics(days: int = 30):
         }
     
 @router.get("/users-paginated")
-def get_dashboard_users_paginated(page: int = 1, limit: int = 10, search: str = "", status: str = "", activity: str = ""):
+async def get_dashboard_users_paginated(page: int = 1, limit: int = 10, search: str = "", status: str = "", activity: str = ""):
     """Obtiene usuarios con paginación y filtros para el dashboard - CON FALLBACK"""
     try:
-        if not is_database_available():
+        if not await is_database_available_async():
             logger.warning("Database not available for paginated users")
             return {
                 "users": [],
@@ -1212,7 +1304,7 @@ def get_dashboard_users_paginated(page: int = 1, limit: int = 10, search: str =
                 "error": "Database connection not available"
             }
 
-        with engine.connect() as connection:
+        async with get_async_engine().connect() as connection:
             # Query base
             base_query = """
                 SELECT u.id, u.nombre, u.email, u.created_at, u.permisos,
@@ -1237,7 +1329,7 @@ def get_dashboard_users_paginated(page: int = 1, limit: int = 10, search: str =
             # Query para contar total
             count_query = f"{base_query}{group_by}{having}"
             count_query_wrapped = f"SELECT COUNT(*) FROM ({count_query}) as filtered_users"
-            total_result = connection.execute(text(count_query_wrapped), params).fetchone()
+            total_result = (await connection.execute(text(count_query_wrapped), params)).fetchone()
             total_count = total_result[0] if total_result else 0
 
             # Query principal con paginación
@@ -1245,7 +1337,7 @@ def get_dashboard_users_paginated(page: int = 1, limit: int = 10, search: str =
             main_query = f"{base_query}{group_by}{having} ORDER BY u.created_at DESC LIMIT :limit OFFSET :offset"
             params.update({"limit": limit, "offset": offset})
 
-            users_result = connection.execute(text(main_query), params).fetchall()
+            users_result = (await connection.execute(text(main_query), params)).fetchall()
 
             users_list = []
             week_ago = datetime.now() - timedelta(days=7)
@@ -1287,7 +1379,7 @@ def get_dashboard_users_paginated(page: int = 1, limit: int = 10, search: str =
                 users_list.append(user_data)
 
             # Estadísticas generales
-            stats_result = connection.execute(
+            stats_result = (await connection.execute(
                 text("""
                     SELECT 
                         COUNT(*) as total_users,
@@ -1296,7 +1388,7 @@ def get_dashboard_users_paginated(page: int = 1, limit: int = 10, search: str =
                     FROM users u
                     LEFT JOIN chat_sessions cs ON u.id = cs.user_id
                 """)
-            ).fetchone()
+            )).fetchone()
 
             stats = {
                 "total_users": stats_result[0] if stats_result else 0,
@@ -1332,10 +1424,10 @@ def get_dashboard_users_paginated(page: int = 1, limit: int = 10, search: str =
         }
     
 @router.get("/feedback-paginated")
-def get_dashboard_feedback_paginated(page: int = 1, limit: int = 10, search: str = "", rating: str = ""):
+async def get_dashboard_feedback_paginated(page: int = 1, limit: int = 10, search: str = "", rating: str = ""):
     """Obtiene feedback con paginación y filtros para el dashboard - CON FALLBACK"""
     try:
-        if not is_database_available():
+        if not await is_database_available_async():
             logger.warning("Database not available for paginated feedback")
             return {
                 "feedback": [],
@@ -1353,7 +1445,7 @@ def get_dashboard_feedback_paginated(page: int = 1, limit: int = 10, search: str
                 "error": "Database connection not available"
             }
 
-        with engine.connect() as connection:
+        async with get_async_engine().connect() as connection:
             # Query base
             base_query = """
                 SELECT f.id, f.user_id, f.pregunta, f.respuesta, f.rating, 
@@ -1381,7 +1473,7 @@ def get_dashboard_feedback_paginated(page: int = 1, limit: int = 10, search: str
             
             # Query para contar total
             count_query = f"SELECT COUNT(*) FROM ({base_query}{where_clause}) as filtered_feedback"
-            total_result = connection.execute(text(count_query), params).fetchone()
+            total_result = (await connection.execute(text(count_query), params)).fetchone()
             total_count = total_result[0] if total_result else 0
             
             # Query principal con paginación
@@ -1389,7 +1481,7 @@ def get_dashboard_feedback_paginated(page: int = 1, limit: int = 10, search: str
             main_query = f"{base_query}{where_clause} ORDER BY f.created_at DESC LIMIT :limit OFFSET :offset"
             params.update({"limit": limit, "offset": offset})
             
-            feedback_result = connection.execute(text(main_query), params).fetchall()
+            feedback_result = (await connection.execute(text(main_query), params)).fetchall()
             
             feedback_list = []
             for row in feedback_result:
@@ -1407,7 +1499,7 @@ def get_dashboard_feedback_paginated(page: int = 1, limit: int = 10, search: str
                 feedback_list.append(feedback_item)
             
             # Estadísticas generales de feedback
-            stats_result = connection.execute(
+            stats_result = (await connection.execute(
                 text("""
                     SELECT 
                         COUNT(*) as total_feedback,
@@ -1416,7 +1508,7 @@ def get_dashboard_feedback_paginated(page: int = 1, limit: int = 10, search: str
                         COUNT(CASE WHEN rating <= 2 THEN 1 END) as negative_feedback
                     FROM feedback
                 """)
-            ).fetchone()
+            )).fetchone()
             
             stats = {
                 "total_feedback": stats_result[0] if stats_result else 0,
@@ -1838,12 +1930,12 @@ def get_workers_status():
         }
 
 @router.get("/active-tasks")
-def get_active_tasks():
+async def get_active_tasks():
     """
     Obtiene todas las tareas de chat activas y recientes desde la base de datos
     """
     try:
-        if not is_database_available():
+        if not await is_database_available_async():
             return {
                 "active_count": 0,
                 "total_count": 0,
@@ -1853,7 +1945,7 @@ def get_active_tasks():
                 "timestamp": datetime.now().isoformat()
             }
         
-        with engine.connect() as connection:
+        async with get_async_engine().connect() as connection:
             # Importar ChatTask del models
             from models import ChatTask
             
@@ -1874,7 +1966,7 @@ def get_active_tasks():
                 LIMIT 100
             """)
             
-            result = connection.execute(query)
+            result = await connection.execute(query)
             tasks = []
             
             for row in result:
@@ -1982,8 +2074,7 @@ async def get_hardware_info():
 async def get_stress_tests(limit: int = 20):
     """Obtiene historial de tests de estres"""
     try:
-        engine_db = engine
-        with engine_db.connect() as connection:
+        async with get_async_engine().connect() as connection:
             query = text("""
                 SELECT 
                     t.id, t.test_id, t.name, t.config, t.status,
@@ -1997,7 +2088,7 @@ async def get_stress_tests(limit: int = 20):
                 LIMIT :limit
             """)
             
-            result = connection.execute(query, {"limit": limit})
+            result = await connection.execute(query, {"limit": limit})
             tests = []
             
             for row in result:
@@ -2034,9 +2125,10 @@ async def get_stress_tests(limit: int = 20):
 async def get_stress_test_detail(test_id: str):
     """Obtiene detalle completo de un test de estres"""
     try:
-        db = SessionLocal()
-        try:
-            test = db.query(StressTest).filter(StressTest.test_id == test_id).first()
+        async with get_async_session() as db:
+            test = (await db.execute(
+                select(StressTest).where(StressTest.test_id == test_id)
+            )).scalars().first()
             
             if not test:
                 raise HTTPException(status_code=404, detail="Test no encontrado")
@@ -2060,8 +2152,6 @@ async def get_stress_test_detail(test_id: str):
                     "created_at": test.created_at.isoformat() if test.created_at else None
                 }
             }
-        finally:
-            db.close()
             
     except HTTPException:
         raise
@@ -2225,9 +2315,10 @@ async def get_stress_test_status(test_id: str):
                 }
         
         # Si no esta en ejecucion, buscar en BD
-        db = SessionLocal()
-        try:
-            test = db.query(StressTest).filter(StressTest.test_id == test_id).first()
+        async with get_async_session() as db:
+            test = (await db.execute(
+                select(StressTest).where(StressTest.test_id == test_id)
+            )).scalars().first()
             
             if not test:
                 raise HTTPException(status_code=404, detail="Test no encontrado")
@@ -2240,8 +2331,6 @@ async def get_stress_test_status(test_id: str):
                 "is_running": False,
                 "summary": test.summary
             }
-        finally:
-            db.close()
             
     except HTTPException:
         raise
@@ -1,22 +1,140 @@
 """
 Database module - Centraliza la configuración de la base de datos
+=================================================================
+
+Un único engine por proceso, compartido por la API, el dashboard, auth,
+el historial y los workers de Celery (``models`` reexporta ``engine`` y
+``SessionLocal`` desde aquí), más un engine asíncrono (aiomysql) para los
+endpoints ``async def`` de la API, cuya I/O no ocupa threads del pool de
+Starlette:
+- Pool configurable por entorno (tamaño, overflow, espera máxima,
+  reciclaje, pre-ping) y timeouts de conexión/lectura/escritura del driver
+- Las conexiones se reutilizan en orden LIFO: las más usadas se
+  mantienen calientes y las ociosas terminan recicladas
+- Los pools miden cuánto espera cada checkout; ``get_pool_stats`` lo
+  expone junto con las conexiones en uso y el overflow para
+  /metrics/performance
 """
+import time
+import threading
+import logging
+from collections import deque
+from typing import Any, Dict
+
 from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
-from config import DATABASE_URL
-import logging
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from config import (
+    DATABASE_URL, ASYNC_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING, DB_CONNECT_TIMEOUT, DB_READ_TIMEOUT, DB_WRITE_TIMEOUT
+)
 
 logger = logging.getLogger(__name__)
 
+# Checkouts recientes considerados para el promedio y el p95 de espera
+WAIT_WINDOW = 1000
+
+
+class _CheckoutTimingMixin:
+    """Registra el tiempo de espera de cada checkout del pool.
+
+    La espera incluye abrir la conexión cuando el pool crece (hasta
+    ``pool_size + max_overflow``); con el pool caliente es solo la cola.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_overflow = kwargs.get("max_overflow", 10)
+        self._stats_lock = threading.Lock()
+        self._waits = deque(maxlen=WAIT_WINDOW)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            wait = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self._waits.append(wait)
+                self.max_wait = max(self.max_wait, wait)
+
+    def wait_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            waits = sorted(self._waits)
+            stats = {
+                "max_overflow": self.max_overflow,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "max_wait_ms": round(self.max_wait * 1000, 2),
+            }
+        stats["avg_wait_ms"] = round(sum(waits) / len(waits) * 1000, 2) if waits else 0.0
+        stats["p95_wait_ms"] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 2) if waits else 0.0
+        return stats
+
+
+class InstrumentedQueuePool(_CheckoutTimingMixin, QueuePool):
+    """QueuePool con tiempos de espera por checkout"""
+
+
+class InstrumentedAsyncQueuePool(_CheckoutTimingMixin, AsyncAdaptedQueuePool):
+    """Pool del engine asíncrono con tiempos de espera por checkout"""
+
+
+def _pool_options() -> Dict[str, Any]:
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_use_lifo": True,
+        "echo": False,  # No mostrar SQL queries en logs
+    }
+
+
+def create_db_engine(url: str = DATABASE_URL, **overrides):
+    """Engine con el pool y los timeouts configurados por entorno"""
+    options = _pool_options()
+    options.update(
+        poolclass=InstrumentedQueuePool,
+        connect_args={
+            "connect_timeout": DB_CONNECT_TIMEOUT,
+            "read_timeout": DB_READ_TIMEOUT,
+            "write_timeout": DB_WRITE_TIMEOUT,
+        },
+    )
+    options.update(overrides)
+    return create_engine(url, **options)
+
+
+def create_async_db_engine(url: str = ASYNC_DATABASE_URL, **overrides):
+    """Engine asíncrono (SQLAlchemy asyncio) con la misma configuración de pool"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+    options = _pool_options()
+    options.update(
+        poolclass=InstrumentedAsyncQueuePool,
+        connect_args={"connect_timeout": DB_CONNECT_TIMEOUT},
+    )
+    options.update(overrides)
+    return create_async_engine(url, **options)
+
+
 # Crear engine de SQLAlchemy
 try:
-    engine = create_engine(
-        DATABASE_URL,
-        pool_pre_ping=True,  # Verifica conexiones antes de usarlas
-        pool_recycle=3600,   # Recicla conexiones después de 1 hora
-        echo=False            # No mostrar SQL queries en logs
+    engine = create_db_engine()
+    logger.info(
+        f"✅ Database engine creado correctamente (pool={DB_POOL_SIZE}+{DB_MAX_OVERFLOW}, "
+        f"recycle={DB_POOL_RECYCLE}s, pre_ping={DB_POOL_PRE_PING})"
     )
-    logger.info("✅ Database engine creado correctamente")
 except Exception as e:
     logger.error(f"❌ Error creando database engine: {e}")
     engine = None
@@ -31,9 +149,59 @@ def get_db():
     if not SessionLocal:
         logger.warning("⚠️ Database SessionLocal no está disponible")
         return None
-    
+
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+# Engine y sesiones asíncronas: se crean con el primer endpoint async que los usa
+async_engine = None
+AsyncSessionLocal = None
+
+def get_async_engine():
+    """Engine asíncrono compartido por los endpoints ``async def``"""
+    global async_engine, AsyncSessionLocal
+    if async_engine is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        async_engine = create_async_db_engine()
+        AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+        logger.info("✅ Database engine asíncrono creado (aiomysql)")
+    return async_engine
+
+def get_async_session():
+    """Sesión ORM asíncrona: ``async with get_async_session() as db: ...``"""
+    get_async_engine()
+    return AsyncSessionLocal()
+
+async def is_database_available_async() -> bool:
+    """Equivalente asíncrono de ``check_db_connection``"""
+    from sqlalchemy import text
+    try:
+        async with get_async_engine().connect() as connection:
+            await connection.execute(text("SELECT 1"))
+        return True
+    except Exception as e:
+        logger.error(f"Error verificando conexión DB (async): {e}")
+        return False
+
+def _describe_pool(pool) -> Dict[str, Any]:
+    stats = {
+        "pool_size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+    }
+    if isinstance(pool, _CheckoutTimingMixin):
+        stats.update(pool.wait_stats())
+    return stats
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Estado de los pools para el endpoint de métricas"""
+    if engine is None:
+        return {}
+    stats = _describe_pool(engine.pool)
+    if async_engine is not None:
+        stats["async"] = _describe_pool(async_engine.pool)
+    return stats
@@ -0,0 +1,147 @@
+# Classifier Benchmark
+# Micro-benchmark del clasificador de preguntas precompilado frente a la
+# implementacion anterior (un re.search por patron y por llamada)
+#
+# Uso (desde backend/):
+#   python -m diagnostics.classifier_benchmark
+#   python -m diagnostics.classifier_benchmark --archivo preguntas.txt --repeticiones 200
+
+import re
+import sys
+import time
+import argparse
+from typing import Callable, Dict, List
+
+from question_classifier import (
+    QUESTION_TYPE_PATTERNS, DETAILED_PATTERNS, CONCISE_PATTERNS, CONCISE_MAX_WORDS,
+    classify_question
+)
+from .stress_runner import SAMPLE_QUERIES
+
+
+# Preguntas reales de estudiantes (con y sin tildes, mayusculas y signos)
+STUDENT_QUESTIONS = [
+    "Hola, buenas tardes",
+    "hola! me ayudas con la tarea de IA?",
+    "Gracias por tu ayuda",
+    "adiós, nos vemos la próxima clase",
+    "¿Qué es un agente racional?",
+    "que es la heuristica admisible",
+    "¿Qué significa PEAS?",
+    "Define aprendizaje supervisado",
+    "Explícame el algoritmo A*",
+    "explica backpropagation paso a paso",
+    "Dame un ejemplo de búsqueda en anchura",
+    "pon unos ejemplos de funciones de activación",
+    "¿Cuál es la diferencia entre BFS y DFS?",
+    "Compara entre regresión lineal y logística",
+    "¿Qué es mejor, minimax o alfa-beta?",
+    "Resume la unidad 3 en pocas palabras",
+    "brevemente, qué es el overfitting",
+    "No entiendo la poda alfa-beta",
+    "¿Puedes explicar mejor lo del gradiente descendente?",
+    "y qué pasa si la heurística no es consistente?",
+    "¿Podrías ampliar lo de las redes convolucionales?",
+    "¿Quién es el coordinador del curso?",
+    "¿Cuál es el temario de la asignatura?",
+    "¿Cuándo es la prueba 2?",
+    "¿Cuáles son los tipos de aprendizaje automático?",
+    "Menciona las etapas del proceso de KDD",
+    "Enumera los supuestos de la regresión lineal",
+    "¿Cómo funciona una red neuronal?",
+    "como se implementa un arbol de decision en python",
+    "Analiza la complejidad temporal de A* con una heurística perfecta",
+    "¿Qué implica que un problema sea NP-completo?",
+    "Describe el ciclo de vida de un proyecto de ciencia de datos y sus riesgos principales",
+    "necesito saber por que mi modelo tiene un accuracy tan alto en entrenamiento pero tan bajo en validacion",
+    "A*",
+    "k-means",
+    "¿Qué?",
+    "tengo dudas con el laboratorio, la funcion de costo no converge y no se si el learning rate esta bien",
+]
+
+
+# --- Implementacion anterior (referencia) ---
+
+def legacy_question_type(question_text):
+    for tipo, patrones in QUESTION_TYPE_PATTERNS:
+        for patron in patrones:
+            if re.search(patron, question_text.lower()):
+                return tipo
+    return None
+
+
+def legacy_complexity(question):
+    word_count = len(question.split())
+    for pattern in DETAILED_PATTERNS:
+        if re.search(pattern, question.lower()):
+            return "detailed"
+    for pattern in CONCISE_PATTERNS:
+        if re.search(pattern, question.lower()):
+            return "concise"
+    return "concise" if word_count <= CONCISE_MAX_WORDS else "mixed"
+
+
+def legacy_classify(question):
+    return legacy_question_type(question), legacy_complexity(question)
+
+
+# --- Benchmark ---
+
+def load_questions(path: str = None) -> List[str]:
+    questions = list(STUDENT_QUESTIONS)
+    for group in SAMPLE_QUERIES.values():
+        questions.extend(group)
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            questions.extend(line.strip() for line in f if line.strip())
+    return questions
+
+
+def time_classifier(classify: Callable, questions: List[str], repetitions: int) -> float:
+    """Microsegundos promedio por pregunta (mejor de 3 rondas)"""
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            for question in questions:
+                classify(question)
+        best = min(best, time.perf_counter() - start)
+    return best / (repetitions * len(questions)) * 1e6
+
+
+def run_benchmark(questions: List[str], repetitions: int = 100) -> Dict:
+    mismatches = [
+        (question, legacy_classify(question), classify_question(question))
+        for question in questions
+        if legacy_classify(question) != classify_question(question)
+    ]
+    legacy_us = time_classifier(legacy_classify, questions, repetitions)
+    compiled_us = time_classifier(classify_question, questions, repetitions)
+    return {
+        "questions": len(questions),
+        "mismatches": mismatches,
+        "legacy_us": round(legacy_us, 2),
+        "compiled_us": round(compiled_us, 2),
+        "speedup": round(legacy_us / compiled_us, 2) if compiled_us else 0,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del clasificador de preguntas")
+    parser.add_argument("--archivo", help="Archivo con una pregunta por linea (se suma al corpus incluido)")
+    parser.add_argument("--repeticiones", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    result = run_benchmark(load_questions(args.archivo), args.repeticiones)
+    print(f"Preguntas:        {result['questions']}")
+    print(f"Implementacion anterior: {result['legacy_us']} us/pregunta")
+    print(f"Precompilado:            {result['compiled_us']} us/pregunta")
+    print(f"Aceleracion:             x{result['speedup']}")
+    for question, legacy, compiled in result["mismatches"]:
+        print(f"DIFERENCIA: {question!r}: anterior={legacy} precompilado={compiled}")
+    return 1 if result["mismatches"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
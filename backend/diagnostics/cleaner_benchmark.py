@@ -0,0 +1,165 @@
+# Cleaner Benchmark
+# Micro-benchmark de la limpieza de respuestas en una sola pasada frente a la
+# implementacion anterior (varios re.sub encadenados sobre la respuesta completa)
+#
+# Verifica ademas que la limpieza incremental de artefactos sobre un stream de
+# tokens (cortado en trozos aleatorios) produce exactamente el mismo texto.
+#
+# Uso (desde backend/):
+#   python -m diagnostics.cleaner_benchmark
+#   python -m diagnostics.cleaner_benchmark --archivo respuestas.jsonl --repeticiones 200
+#
+# El archivo opcional tiene una respuesta grabada por linea, como string JSON
+# o como objeto con la clave "respuesta" (p. ej. exportado de la tabla feedback).
+
+import re
+import sys
+import json
+import time
+import random
+import argparse
+from typing import Callable, Dict, List
+
+from response_cleaner import clean_llm_response, clean_response_artifacts, ArtifactStreamCleaner
+
+
+# Respuestas grabadas del chatbot (con los artefactos tipicos de los modelos locales)
+RECORDED_ANSWERS = [
+    "Como asistente educativo, te explico:\n\nUn **agente racional** es aquel que, para cada secuencia de percepciones, "
+    "selecciona la acción que maximiza su medida de rendimiento esperada.\n\n\n\n"
+    "Componentes del entorno (PEAS):\n- **P**erformance: medida de rendimiento\n- **E**nvironment: entorno\n"
+    "- **A**ctuators: actuadores\n- **S**ensors: sensores   \n\nEn resumen, la racionalidad depende de la informa\nción "
+    "disponible y no de la omnisciencia.",
+    "Basado en los documentos del curso, el algoritmo A* combina el costo real g(n) con una heurística h(n):\n\n"
+    "    f(n) = g(n) + h(n)\n\nSi la heurística es **admisible** (nunca sobreestima), A* es óptimo.  Si además es "
+    "consistente,\nno es necesario reabrir nodos.\n\n\n\nEjemplo:\n1. Nodo inicial S con h(S) = 7\n2. Se expanden "
+    "los sucesores\n3. Se elige el de menor f(n)\n",
+    "¡Claro! Aquí tienes un resumen:\n\nLa unidad 3 trata sobre aprendizaje supervisado. Los temas principales son:\n\n"
+    "* Regresión lineal y logística\n* Árboles de decisión\n* Sobreajuste (overfitting) y regularización\n\n"
+    "El objetivo es generali\nzar a datos no vistos.   ",
+    "Basado en el syllabus, el coordinador del curso es el profesor indicado en la sección 1. Las evaluaciones "
+    "son:\n\n| Evaluación | Ponderación |\n|---|---|\n| Prueba 1 | 30% |\n| Prueba 2 | 30% |\n| Proyecto | 40% |\n\n\n"
+    "Puedes revisar el calendario en el aula virtual.",
+    "La diferencia principal entre BFS y DFS es el orden de expansión:\nBFS usa una cola (FIFO) y explora por "
+    "niveles;\nDFS usa una pila (LIFO) y profundiza primero.\n\nComplejidad espacial:\n- BFS: O(b^d)\n- DFS: "
+    "O(b·m)\n\n\n\nEn la práctica, DFS con profundidad iterativa combina lo mejor de ambos.  \n \n",
+    "   La retropropagación (backpropagation) calcula el gradiente de la función de pérdida respecto de cada "
+    "peso aplicando la regla de la cade\nna capa por capa, desde la salida hacia la entrada.\n\n```python\n"
+    "for epoch in range(10):\n    loss = model(x, y)\n    loss.backward()\n    optimizer.step()\n```\n\n"
+    "Luego el optimizador actualiza los pesos: w = w - η · ∂L/∂w;\n  la tasa η controla el tamaño del paso.",
+    "Como un asistente educativo conversacional,\n\nBasado en la información del curso, ¡Claro! Aquí tienes un "
+    "resumen:\nEl overfitting ocurre cuando el modelo memoriza el ruido del entrenamiento.\n\n\n\nSe detecta "
+    "comparando el error de entrenamiento y validación.",
+    "Hola! Soy tu asistente del curso de Inteligencia Artificial. ¿En qué tema te puedo ayudar hoy?",
+]
+
+
+# --- Implementacion anterior (referencia) ---
+
+def legacy_clean_llm_response(response_text):
+    if not response_text:
+        return response_text
+    corrected_text = re.sub(r'([a-zA-ZáéíóúñÁÉÍÓÚÑ])\n([a-zA-ZáéíóúñÁÉÍÓÚÑ])', r'\1\2', response_text)
+    corrected_text = re.sub(r'([a-zA-ZáéíóúñÁÉÍÓÚÑ]{2,})\n([a-zA-ZáéíóúñÁÉÍÓÚÑ]{1,})', r'\1\2', corrected_text)
+    corrected_text = re.sub(r' {2,}', ' ', corrected_text)
+    corrected_text = re.sub(r'([.!?:;])\s*\n', r'\1\n\n', corrected_text)
+    corrected_text = re.sub(r'\n{3,}', '\n\n', corrected_text)
+    corrected_text = re.sub(r' +\n', '\n', corrected_text)
+    return corrected_text.strip()
+
+
+def legacy_clean_response_artifacts(response):
+    response = re.sub(r'^Como (un )?asistente educativo( conversacional)?,?\s*', '', response, flags=re.IGNORECASE)
+    response = re.sub(r'^Basado en (el syllabus|los documentos|la información)( del curso)?,?\s*', '', response, flags=re.IGNORECASE)
+    response = re.sub(r'^¡Claro! Aquí tienes un resumen:\s*', '', response, flags=re.IGNORECASE)
+    response = re.sub(r'\n{3,}', '\n\n', response)
+    return response
+
+
+# --- Benchmark ---
+
+def load_answers(path: str = None) -> List[str]:
+    answers = list(RECORDED_ANSWERS)
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    answers.append(record["respuesta"] if isinstance(record, dict) else record)
+    return answers
+
+
+def stream_clean(cleaner, text: str, rng: random.Random) -> str:
+    """Limpia ``text`` entregandolo en trozos de 1 a 12 caracteres, como un stream de tokens"""
+    parts = []
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 12)
+        parts.append(cleaner.feed(text[position:position + size]))
+        position += size
+    parts.append(cleaner.finish())
+    return "".join(parts)
+
+
+def time_cleaner(clean: Callable, answers: List[str], repetitions: int) -> float:
+    """Microsegundos promedio por respuesta (mejor de 3 rondas)"""
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            for answer in answers:
+                clean(answer)
+        best = min(best, time.perf_counter() - start)
+    return best / (repetitions * len(answers)) * 1e6
+
+
+def run_benchmark(answers: List[str], repetitions: int = 100, seed: int = 7) -> Dict:
+    rng = random.Random(seed)
+    cleaners = [
+        # clean_llm_response solo se aplica a respuestas completas
+        ("clean_llm_response", legacy_clean_llm_response, clean_llm_response, None),
+        ("clean_response_artifacts", legacy_clean_response_artifacts, clean_response_artifacts, ArtifactStreamCleaner),
+    ]
+    results = {"answers": len(answers), "cleaners": []}
+    for name, legacy, compiled, stream_cleaner in cleaners:
+        mismatches = []
+        for answer in answers:
+            expected = legacy(answer)
+            if compiled(answer) != expected:
+                mismatches.append(("completa", answer))
+            if stream_cleaner and stream_clean(stream_cleaner(), answer, rng) != expected:
+                mismatches.append(("stream", answer))
+        legacy_us = time_cleaner(legacy, answers, repetitions)
+        compiled_us = time_cleaner(compiled, answers, repetitions)
+        results["cleaners"].append({
+            "name": name,
+            "mismatches": mismatches,
+            "legacy_us": round(legacy_us, 2),
+            "compiled_us": round(compiled_us, 2),
+            "speedup": round(legacy_us / compiled_us, 2) if compiled_us else 0,
+        })
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de la limpieza de respuestas")
+    parser.add_argument("--archivo", help="JSONL con respuestas grabadas (se suma al corpus incluido)")
+    parser.add_argument("--repeticiones", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(load_answers(args.archivo), args.repeticiones)
+    print(f"Respuestas: {results['answers']}")
+    failed = False
+    for result in results["cleaners"]:
+        print(f"\n{result['name']}")
+        print(f"  Implementacion anterior: {result['legacy_us']} us/respuesta")
+        print(f"  Una sola pasada:         {result['compiled_us']} us/respuesta")
+        print(f"  Aceleracion:             x{result['speedup']}")
+        for mode, answer in result["mismatches"]:
+            failed = True
+            print(f"  DIFERENCIA ({mode}): {answer[:80]!r}...")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""
+Cache de Embeddings de Consultas
+================================
+
+Envuelve el modelo de embeddings (OllamaEmbeddings) con un cache
+texto normalizado → vector:
+- Nivel en memoria con desalojo LRU y tamaño máximo
+- Nivel persistente opcional en SQLite para que las entradas
+  "calientes" sobrevivan a reinicios del proceso
+- Contadores de aciertos/fallos expuestos en /metrics/performance
+
+Solo se cachean los embeddings de consultas (embed_query); los de
+documentos durante la indexación pasan directo al modelo.
+"""
+
+import re
+import time
+import sqlite3
+import logging
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger("embedding_cache")
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n¿?¡!.,;:"
+
+
+def normalize_query_text(text: str) -> str:
+    """Normaliza el texto de una consulta para usarlo como clave de cache."""
+    if not text:
+        return ""
+    normalized = unicodedata.normalize("NFC", text).lower()
+    normalized = _WHITESPACE_RE.sub(" ", normalized)
+    return normalized.strip(_EDGE_PUNCTUATION)
+
+
+class SQLiteEmbeddingStore:
+    """Nivel persistente del cache: vectores float32 en una tabla SQLite"""
+
+    def __init__(self, path: str, max_entries: int = 50000):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self._writes_since_prune = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                model TEXT NOT NULL,
+                text_key TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_key)
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_query_embeddings_last_used ON query_embeddings (last_used)"
+        )
+        self.conn.commit()
+
+    def get(self, model: str, text_key: str) -> Optional[List[float]]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT vector FROM query_embeddings WHERE model = ? AND text_key = ?",
+                (model, text_key)
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE query_embeddings SET last_used = ? WHERE model = ? AND text_key = ?",
+                (time.time(), model, text_key)
+            )
+            self.conn.commit()
+        vector = array("f")
+        vector.frombytes(row[0])
+        return vector.tolist()
+
+    def put(self, model: str, text_key: str, vector: List[float]):
+        blob = array("f", vector).tobytes()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (model, text_key, vector, last_used) VALUES (?, ?, ?, ?)",
+                (model, text_key, blob, time.time())
+            )
+            self.conn.commit()
+            self._writes_since_prune += 1
+            if self._writes_since_prune >= 500:
+                self._prune()
+                self._writes_since_prune = 0
+
+    def get_many(self, model: str, text_keys: List[str]) -> Dict[str, List[float]]:
+        """Lectura en bloque; devuelve solo las claves encontradas"""
+        found: Dict[str, List[float]] = {}
+        with self.lock:
+            for start in range(0, len(text_keys), 500):
+                chunk = text_keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT text_key, vector FROM query_embeddings WHERE model = ? AND text_key IN ({placeholders})",
+                    [model, *chunk]
+                ).fetchall()
+                for text_key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[text_key] = vector.tolist()
+        return found
+
+    def put_many(self, model: str, items: Dict[str, List[float]]):
+        """Escritura en bloque en una sola transacción"""
+        now = time.time()
+        rows = [(model, text_key, array("f", vector).tobytes(), now) for text_key, vector in items.items()]
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO query_embeddings (model, text_key, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self.conn.commit()
+            self._writes_since_prune += len(rows)
+            if self._writes_since_prune >= 500:
+                self._prune()
+                self._writes_since_prune = 0
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+
+    def _prune(self):
+        """Elimina las entradas menos usadas si se supera el máximo (llamar con el lock tomado)"""
+        total = self.conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+        excess = total - self.max_entries
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM query_embeddings WHERE rowid IN "
+                "(SELECT rowid FROM query_embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,)
+            )
+            self.conn.commit()
+            logger.info(f"🧹 Cache persistente de embeddings podado: {excess} entradas eliminadas")
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings con cache LRU en memoria y nivel persistente opcional"""
+
+    def __init__(self, base_embeddings: Embeddings, model_name: str,
+                 max_entries: int = 2048, persist_path: Optional[str] = None,
+                 persist_max_entries: int = 50000):
+        self.base_embeddings = base_embeddings
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+        # Contadores
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.store = None
+        if persist_path:
+            try:
+                self.store = SQLiteEmbeddingStore(persist_path, persist_max_entries)
+                logger.info(f"💾 Cache persistente de embeddings en: {persist_path}")
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo abrir el cache persistente de embeddings: {e}")
+                self.store = None
+
+    def _remember(self, text_key: str, vector: List[float]):
+        """Inserta en el nivel en memoria respetando el tamaño máximo (llamar con el lock tomado)"""
+        self.memory[text_key] = vector
+        self.memory.move_to_end(text_key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.evictions += 1
+
+    def _lookup(self, text_key: str) -> Optional[List[float]]:
+        """Busca en memoria y luego en disco; None si hay que calcular el embedding"""
+        with self.lock:
+            vector = self.memory.get(text_key)
+            if vector is not None:
+                self.memory.move_to_end(text_key)
+                self.hits += 1
+                return vector
+
+        if self.store is not None:
+            try:
+                vector = self.store.get(self.model_name, text_key)
+            except Exception as e:
+                logger.warning(f"Error leyendo cache persistente de embeddings: {e}")
+                vector = None
+            if vector is not None:
+                with self.lock:
+                    self.disk_hits += 1
+                    self._remember(text_key, vector)
+                return vector
+
+        return None
+
+    def _save(self, text_key: str, vector: List[float]):
+        with self.lock:
+            self.misses += 1
+            self._remember(text_key, vector)
+
+        if self.store is not None:
+            try:
+                self.store.put(self.model_name, text_key, vector)
+            except Exception as e:
+                logger.warning(f"Error escribiendo cache persistente de embeddings: {e}")
+
+    def embed_query(self, text: str) -> List[float]:
+        text_key = normalize_query_text(text)
+        vector = self._lookup(text_key)
+        if vector is None:
+            vector = self.base_embeddings.embed_query(text_key or text)
+            self._save(text_key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Igual que embed_query pero usando el cliente asíncrono del modelo en un fallo"""
+        text_key = normalize_query_text(text)
+        vector = self._lookup(text_key)
+        if vector is None:
+            vector = await self.base_embeddings.aembed_query(text_key or text)
+            self._save(text_key, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base_embeddings.embed_documents(texts)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estadísticas del cache para el endpoint de métricas"""
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            stats = {
+                "model": self.model_name,
+                "memory_entries": len(self.memory),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups * 100, 2) if lookups else 0,
+                "persistent": self.store is not None
+            }
+        if self.store is not None:
+            try:
+                stats["disk_entries"] = self.store.count()
+            except Exception:
+                stats["disk_entries"] = None
+        return stats
@@ -0,0 +1,210 @@
+"""
+Cache de Fragmentos por Archivo
+===============================
+
+Reemplaza el fragments.pkl monolítico por un cache direccionado por
+contenido con una entrada por PDF:
+- Clave: hash SHA-256 del PDF (un PDF renombrado reutiliza su entrada)
+- Solo se parsean y dividen los PDFs nuevos o modificados
+- Las entradas de PDFs eliminados se descartan sin reprocesar el resto,
+  recién después de que el corpus nuevo reemplazó al anterior
+- La carga en caliente es perezosa: cada entrada se deserializa la
+  primera vez que se accede a alguno de sus fragmentos
+- Cada entrada guarda también sus IDs de fragmento y sus estadísticas
+  de términos para el índice BM25 (keyword_index)
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import logging
+import threading
+from collections.abc import Sequence
+from typing import Dict, List, Iterable, Any
+
+from keyword_index import term_stats
+
+logger = logging.getLogger("fragment_cache")
+
+LEGACY_FRAGMENTS_FILE = "fragments.pkl"
+
+# Archivos de una entrada del cache: estadísticas BM25, fragmentos e IDs
+# (".terms.pkl" va antes que ".pkl" para reconocer el hash correctamente)
+ENTRY_SUFFIXES = (".terms.pkl", ".pkl", ".ids.json")
+
+
+def fragment_id(content: str) -> str:
+    """ID estable de un fragmento: hash de su contenido.
+
+    Dos fragmentos con el mismo texto comparten ID (y embedding), de modo
+    que editar un PDF solo cambia los IDs de los fragmentos que cambiaron.
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+
+def get_fragment_id(fragment: Any) -> str:
+    return fragment.metadata.get("fragment_id") or fragment_id(fragment.page_content)
+
+
+class FragmentStore:
+    """Directorio con un archivo pickle de fragmentos por hash de PDF"""
+
+    def __init__(self, cache_dir: str):
+        self.directory = os.path.join(cache_dir, "fragments")
+        os.makedirs(self.directory, exist_ok=True)
+        self._drop_legacy_cache(cache_dir)
+
+    def _path(self, file_hash: str) -> str:
+        return os.path.join(self.directory, f"{file_hash}.pkl")
+
+    def _ids_path(self, file_hash: str) -> str:
+        return os.path.join(self.directory, f"{file_hash}.ids.json")
+
+    def _terms_path(self, file_hash: str) -> str:
+        return os.path.join(self.directory, f"{file_hash}.terms.pkl")
+
+    def has(self, file_hash: str) -> bool:
+        return os.path.exists(self._path(file_hash))
+
+    def load(self, file_hash: str) -> List[Any]:
+        with open(self._path(file_hash), "rb") as f:
+            return pickle.load(f)
+
+    def load_ids(self, file_hash: str) -> List[str]:
+        """IDs de los fragmentos de un PDF sin deserializar su contenido"""
+        try:
+            with open(self._ids_path(file_hash), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            ids = [get_fragment_id(fragment) for fragment in self.load(file_hash)]
+            self._write_atomic(self._ids_path(file_hash), json.dumps(ids).encode("utf-8"))
+            return ids
+
+    def load_terms(self, file_hash: str) -> Dict[str, Any]:
+        """Estadísticas BM25 de un PDF; se recalculan si faltan (caches anteriores)"""
+        try:
+            with open(self._terms_path(file_hash), "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            stats = term_stats(self.load(file_hash))
+            self._write_atomic(self._terms_path(file_hash), pickle.dumps(stats, protocol=pickle.HIGHEST_PROTOCOL))
+            return stats
+
+    def save(self, file_hash: str, fragments: List[Any]):
+        """Escritura atómica: un lector nunca ve una entrada a medio escribir"""
+        ids = [get_fragment_id(fragment) for fragment in fragments]
+        self._write_atomic(self._path(file_hash), pickle.dumps(fragments, protocol=pickle.HIGHEST_PROTOCOL))
+        self._write_atomic(self._ids_path(file_hash), json.dumps(ids).encode("utf-8"))
+        self._write_atomic(self._terms_path(file_hash), pickle.dumps(term_stats(fragments), protocol=pickle.HIGHEST_PROTOCOL))
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def prune(self, keep_hashes: Iterable[str]) -> int:
+        """Elimina las entradas de PDFs que ya no forman parte del corpus"""
+        keep = set(keep_hashes)
+        removed = 0
+        for name in os.listdir(self.directory):
+            suffix = next((suffix for suffix in ENTRY_SUFFIXES if name.endswith(suffix)), None)
+            if suffix is None:
+                continue
+            file_hash = name[:-len(suffix)]
+            if file_hash in keep:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+                removed += suffix == ".pkl"
+            except OSError as e:
+                logger.warning(f"No se pudo eliminar la entrada de cache {name}: {e}")
+        if removed:
+            logger.info(f"🧹 Cache de fragmentos: {removed} entradas de PDFs eliminados descartadas")
+        return removed
+
+    def _drop_legacy_cache(self, cache_dir: str):
+        legacy = os.path.join(cache_dir, LEGACY_FRAGMENTS_FILE)
+        if os.path.exists(legacy):
+            try:
+                os.remove(legacy)
+                logger.info("🧹 Eliminado cache monolítico antiguo (fragments.pkl)")
+            except OSError as e:
+                logger.warning(f"No se pudo eliminar {legacy}: {e}")
+
+
+class LazyFragmentList(Sequence):
+    """Lista de fragmentos de varios PDFs que se cargan bajo demanda.
+
+    ``entries`` es una lista ordenada de (hash, cantidad de fragmentos);
+    ``len()`` no necesita deserializar nada.
+    """
+
+    def __init__(self, store: FragmentStore, entries: List[tuple], preloaded: Dict[str, List[Any]] = None):
+        self.store = store
+        self.entries = [(file_hash, count) for file_hash, count in entries if count]
+        self._loaded: Dict[str, List[Any]] = dict(preloaded or {})
+        self._lock = threading.Lock()
+        self._offsets = []
+        total = 0
+        for _, count in self.entries:
+            self._offsets.append(total)
+            total += count
+        self._length = total
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _entry(self, file_hash: str) -> List[Any]:
+        fragments = self._loaded.get(file_hash)
+        if fragments is None:
+            with self._lock:
+                fragments = self._loaded.get(file_hash)
+                if fragments is None:
+                    fragments = self.store.load(file_hash)
+                    self._loaded[file_hash] = fragments
+        return fragments
+
+    def _locate(self, index: int):
+        # Búsqueda binaria del PDF que contiene el índice global
+        low, high = 0, len(self._offsets) - 1
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self._offsets[mid] <= index:
+                low = mid
+            else:
+                high = mid - 1
+        return self.entries[low][0], index - self._offsets[low]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("índice de fragmento fuera de rango")
+        file_hash, offset = self._locate(index)
+        return self._entry(file_hash)[offset]
+
+    def __iter__(self):
+        for file_hash, _ in self.entries:
+            yield from self._entry(file_hash)
+
+    def fragment_ids(self) -> List[str]:
+        """IDs de todos los fragmentos en el mismo orden que la lista"""
+        ids: List[str] = []
+        for file_hash, _ in self.entries:
+            if file_hash in self._loaded:
+                ids.extend(get_fragment_id(fragment) for fragment in self._loaded[file_hash])
+            else:
+                ids.extend(self.store.load_ids(file_hash))
+        return ids
+
+    def term_stats(self) -> List[Dict[str, Any]]:
+        """Estadísticas BM25 de cada entrada, en el mismo orden que la lista"""
+        return [self.store.load_terms(file_hash) for file_hash, _ in self.entries]
+
+    def loaded_entries(self) -> int:
+        return len(self._loaded)
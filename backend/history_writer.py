@@ -0,0 +1,635 @@
+"""
+Historial de Chat por Mensaje con Escritura Diferida (write-behind)
+===================================================================
+
+Cada mensaje es una fila de ``chat_messages`` con un número de secuencia
+por sesión (``seq``), en lugar de un único JSON que crece en
+``chat_sessions.history``:
+- Agregar mensajes es una operación en memoria O(1): se asigna el
+  siguiente ``seq`` de la sesión y la fila queda pendiente de inserción
+- Un hilo inserta las filas pendientes cada pocos segundos (o antes, si
+  se acumulan muchas sesiones) en una única transacción por lotes
+- Las lecturas son paginadas por clave (``seq``): los mensajes recientes
+  de cada sesión se sirven desde una cola cacheada y solo las páginas
+  más antiguas llegan a la base, por el índice (user_id, session_id, seq)
+- ``since_seq`` devuelve solo lo que el cliente aún no tiene
+
+Las sesiones que aún guardan su historial en la columna JSON se migran a
+filas la primera vez que se tocan (``migrate_legacy_history``); la
+migración masiva está en ``migrate_chat_history.py``.
+
+Los métodos ``aget``/``asave``/``asave_history`` hacen la misma lectura de
+la base sobre el engine asíncrono, para los endpoints ``async def``; el
+hilo de vaciado sigue usando el engine síncrono.
+
+La API debe ser el único proceso que escribe el historial (un solo
+worker de uvicorn y una sola réplica): asigna los ``seq`` en memoria y su
+cache es la versión vigente de cada sesión. Si igualmente aparece un
+``seq`` ya existente (un segundo proceso, un reinicio con la cola
+desactualizada), el vaciado relee ``MAX(seq)``, renumera los mensajes
+pendientes y reintenta; solo se descarta una sesión cuyo usuario o
+sesión ya no existe. Al
+detener el servidor se vacía todo lo pendiente; ante una caída se pierde
+como máximo el último intervalo de vaciado.
+"""
+
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("history_writer")
+
+SessionKey = Tuple[str, str]
+
+# Tope de mensajes por página de /chat/history
+MAX_PAGE_SIZE = 500
+
+# Códigos de error de MySQL al escribir mensajes
+DUPLICATE_KEY_ERROR = 1062
+FOREIGN_KEY_ERRORS = (1216, 1452)
+# Reintentos de una sesión cuyos seq ya existen en la base
+SEQ_CONFLICT_RETRIES = 3
+
+
+def parse_history(value: Any) -> List[Dict[str, Any]]:
+    """Historial guardado en la columna JSON (string, lista u objeto suelto)"""
+    if not value:
+        return []
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        return [value]
+    try:
+        parsed = json.loads(value)
+    except (TypeError, ValueError):
+        logger.warning("Error decodificando JSON del historial, creando nuevo historial")
+        return []
+    return parsed if isinstance(parsed, list) else [parsed]
+
+
+def _message(seq: int, entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "seq": seq,
+        "sender": entry.get("sender") or "user",
+        "text": entry.get("text") or "",
+        "timestamp": entry.get("timestamp"),
+    }
+
+
+def _mysql_error_code(error: Exception) -> Optional[int]:
+    args = getattr(getattr(error, "orig", None), "args", ())
+    return args[0] if args and isinstance(args[0], int) else None
+
+
+def _insert_messages(connection, key: SessionKey, messages: List[Dict[str, Any]]):
+    from sqlalchemy import text
+    connection.execute(
+        text("""
+            INSERT INTO chat_messages (user_id, session_id, seq, sender, text, timestamp)
+            VALUES (:user_id, :session_id, :seq, :sender, :text, :timestamp)
+        """),
+        [{"user_id": key[0], "session_id": key[1], **message} for message in messages]
+    )
+
+
+def migrate_legacy_history(connection, user_id, session_id) -> List[Dict[str, Any]]:
+    """Copia a ``chat_messages`` el historial que la sesión aún guarda en la columna JSON.
+
+    Vacía la columna JSON sin tocar ``updated_at`` (el orden de las
+    sesiones en el frontend no cambia). Devuelve los mensajes creados.
+    """
+    from sqlalchemy import text
+    key = (str(user_id), str(session_id))
+    row = connection.execute(
+        text("SELECT history FROM chat_sessions WHERE user_id = :user_id AND session_id = :session_id FOR UPDATE"),
+        {"user_id": key[0], "session_id": key[1]}
+    ).fetchone()
+    entries = [entry for entry in parse_history(row[0]) if isinstance(entry, dict)] if row else []
+    if not entries:
+        return []
+
+    messages = [_message(seq, entry) for seq, entry in enumerate(entries, start=1)]
+    _insert_messages(connection, key, messages)
+    connection.execute(
+        text("""
+            UPDATE chat_sessions SET history = JSON_ARRAY(), updated_at = updated_at
+            WHERE user_id = :user_id AND session_id = :session_id
+        """),
+        {"user_id": key[0], "session_id": key[1]}
+    )
+    return messages
+
+
+class SessionLog:
+    """Estado en memoria de una sesión: último ``seq`` y mensajes recientes"""
+
+    __slots__ = ("last_seq", "tail", "complete", "aliases")
+
+    def __init__(self, last_seq: int = 0, tail: Optional[List[Dict[str, Any]]] = None, complete: bool = True):
+        self.last_seq = last_seq
+        self.tail = tail or []
+        # La cola contiene todos los mensajes de la sesión
+        self.complete = complete
+        # seq entregados al cliente que se renumeraron por un conflicto: viejo -> nuevo
+        self.aliases: Dict[int, int] = {}
+
+    @property
+    def tail_start(self) -> int:
+        return self.tail[0]["seq"] if self.tail else self.last_seq + 1
+
+    def find(self, seq: int) -> Optional[Dict[str, Any]]:
+        index = seq - self.tail_start
+        if 0 <= index < len(self.tail) and self.tail[index]["seq"] == seq:
+            return self.tail[index]
+        return next((message for message in self.tail if message["seq"] == seq), None)
+
+
+class ChatHistoryWriter:
+    """Historial por mensaje con inserciones diferidas, combinadas por lote"""
+
+    def __init__(self, engine_factory: Callable, max_messages: int = 50,
+                 flush_interval: float = 1.0, flush_batch: int = 200,
+                 max_sessions: int = 1000, async_engine_factory: Optional[Callable] = None):
+        self.engine_factory = engine_factory
+        # Engine asíncrono para los métodos a* (endpoints async def)
+        self.async_engine_factory = async_engine_factory
+        # Mensajes recientes cacheados por sesión (y tamaño de página por defecto)
+        self.max_messages = max(1, max_messages)
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.max_sessions = max_sessions
+
+        self.sessions: "OrderedDict[SessionKey, SessionLog]" = OrderedDict()
+        # Filas pendientes de insertar y textos pendientes de actualizar
+        self.inserts: Dict[SessionKey, List[Dict[str, Any]]] = {}
+        self.updates: Dict[SessionKey, Dict[int, str]] = {}
+        self.dirty: set = set()
+        self.flushing: set = set()
+
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+        # Contadores
+        self.appended = 0
+        self.updated = 0
+        self.migrated_sessions = 0
+        self.pages_from_cache = 0
+        self.pages_from_db = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.flush_errors = 0
+        self.last_flush_seconds = 0.0
+
+    @staticmethod
+    def _key(user_id, session_id) -> SessionKey:
+        return (str(user_id), str(session_id))
+
+    def _remember(self, key: SessionKey, log: SessionLog) -> SessionLog:
+        """Instala el estado de una sesión (con el lock tomado); gana el ya instalado"""
+        current = self.sessions.setdefault(key, log)
+        self.sessions.move_to_end(key)
+        # Solo se descartan sesiones sin escrituras pendientes ni en curso
+        excess = len(self.sessions) - self.max_sessions
+        if excess > 0:
+            busy = self.dirty | self.flushing
+            for old_key in [k for k in self.sessions if k not in busy and k != key][:excess]:
+                del self.sessions[old_key]
+        return current
+
+    def _trim(self, key: SessionKey, log: SessionLog):
+        # Las filas aún no insertadas siempre permanecen en la cola
+        keep = max(self.max_messages, len(self.inserts.get(key, ())))
+        if len(log.tail) > keep:
+            del log.tail[:len(log.tail) - keep]
+            log.complete = False
+
+    def _mark_dirty(self, key: SessionKey):
+        self.dirty.add(key)
+        if len(self.dirty) >= self.flush_batch:
+            self._wake.set()
+
+    # --- Estado de las sesiones ---
+
+    def _load(self, connection, key: SessionKey) -> SessionLog:
+        from sqlalchemy import text
+        # Primero la migración: bloquea la fila de la sesión, así no compite con migrate_chat_history.py
+        migrated = migrate_legacy_history(connection, *key)
+        if migrated:
+            self.migrated_sessions += 1
+            logger.info(f"📦 Historial JSON migrado a filas: sesión {key[1]} ({len(migrated)} mensajes)")
+
+        rows = connection.execute(
+            text("""
+                SELECT seq, sender, text, timestamp FROM chat_messages
+                WHERE user_id = :user_id AND session_id = :session_id
+                ORDER BY seq DESC LIMIT :limit
+            """),
+            {"user_id": key[0], "session_id": key[1], "limit": self.max_messages + 1}
+        ).fetchall()
+        if not rows:
+            return SessionLog()
+        tail = [{"seq": row[0], "sender": row[1], "text": row[2], "timestamp": row[3]} for row in reversed(rows)]
+        return SessionLog(tail[-1]["seq"], tail[-self.max_messages:], complete=len(rows) <= self.max_messages)
+
+    def _session(self, key: SessionKey) -> SessionLog:
+        """Estado de la sesión; la base se lee solo la primera vez (llamar sin el lock)"""
+        with self.lock:
+            log = self.sessions.get(key)
+            if log is not None:
+                self.sessions.move_to_end(key)
+                return log
+        with self.load_lock:
+            with self.lock:
+                log = self.sessions.get(key)
+            if log is None:
+                with self.engine_factory().begin() as connection:
+                    log = self._load(connection, key)
+                with self.lock:
+                    log = self._remember(key, log)
+            return log
+
+    async def _asession(self, key: SessionKey) -> SessionLog:
+        """``_session`` sobre el engine asíncrono (la lectura no ocupa un thread)"""
+        with self.lock:
+            log = self.sessions.get(key)
+            if log is not None:
+                self.sessions.move_to_end(key)
+                return log
+        # Dos cargas simultáneas de la misma sesión son inofensivas: gana la primera instalada
+        async with self.async_engine_factory().begin() as connection:
+            log = await connection.run_sync(self._load, key)
+        with self.lock:
+            return self._remember(key, log)
+
+    # --- Escritura ---
+
+    def _append_locked(self, key: SessionKey, log: SessionLog, entry: Dict[str, Any]) -> int:
+        log.last_seq += 1
+        message = _message(log.last_seq, entry)
+        log.tail.append(message)
+        self.inserts.setdefault(key, []).append(message)
+        self.appended += 1
+        return log.last_seq
+
+    def _update_locked(self, key: SessionKey, log: SessionLog, seq: int, text: str) -> bool:
+        if not 0 < seq <= log.last_seq:
+            return False
+        message = log.find(seq)
+        if message is not None:
+            if message["text"] == text:
+                return False
+            message["text"] = text
+            pending = self.inserts.get(key)
+            if pending and seq >= pending[0]["seq"]:
+                # La fila todavía no se insertó: se escribe ya con el texto nuevo
+                return True
+        self.updates.setdefault(key, {})[seq] = text
+        self.updated += 1
+        return True
+
+    def _save_locked(self, key: SessionKey, log: SessionLog, messages: List[Dict[str, Any]]) -> List[int]:
+        seqs = []
+        with self.lock:
+            log = self._remember(key, log)
+            for entry in messages:
+                seq = entry.get("seq")
+                if isinstance(seq, int) and seq > 0:
+                    # El cliente adopta el seq devuelto si el mensaje se renumeró
+                    seq = log.aliases.get(seq, seq)
+                    self._update_locked(key, log, seq, entry.get("text") or "")
+                    seqs.append(seq)
+                else:
+                    seqs.append(self._append_locked(key, log, entry))
+            self._trim(key, log)
+            self._mark_dirty(key)
+        return seqs
+
+    def save(self, user_id, session_id, messages: List[Dict[str, Any]]) -> List[int]:
+        """Guarda un delta del cliente: los mensajes sin ``seq`` se agregan y
+        los que traen ``seq`` actualizan su texto. Devuelve el ``seq`` de cada uno."""
+        key = self._key(user_id, session_id)
+        return self._save_locked(key, self._session(key), messages)
+
+    async def asave(self, user_id, session_id, messages: List[Dict[str, Any]]) -> List[int]:
+        key = self._key(user_id, session_id)
+        return self._save_locked(key, await self._asession(key), messages)
+
+    def _save_history_locked(self, key: SessionKey, log: SessionLog, history: List[Dict[str, Any]]):
+        with self.lock:
+            log = self._remember(key, log)
+            position = 0
+            for entry in history:
+                if not isinstance(entry, dict):
+                    continue
+                seq = entry.get("seq")
+                position = log.aliases.get(seq, seq) if isinstance(seq, int) and seq > 0 else position + 1
+                if position > log.last_seq:
+                    position = self._append_locked(key, log, entry)
+                else:
+                    self._update_locked(key, log, position, entry.get("text") or "")
+            self._trim(key, log)
+            self._mark_dirty(key)
+
+    def save_history(self, user_id, session_id, history: List[Dict[str, Any]]):
+        """Historial completo enviado por clientes anteriores al protocolo por deltas.
+
+        Cada entrada se ubica por su ``seq`` o, si no lo trae, a continuación
+        de la última entrada que sí lo trae (o desde el inicio); solo lo
+        posterior al último ``seq`` guardado se agrega.
+        """
+        key = self._key(user_id, session_id)
+        self._save_history_locked(key, self._session(key), history)
+
+    async def asave_history(self, user_id, session_id, history: List[Dict[str, Any]]):
+        key = self._key(user_id, session_id)
+        self._save_history_locked(key, await self._asession(key), history)
+
+    def forget(self, user_id, session_id):
+        """Descarta la sesión del cache y sus escrituras pendientes (al eliminarla)"""
+        key = self._key(user_id, session_id)
+        with self.lock:
+            self.sessions.pop(key, None)
+            self.inserts.pop(key, None)
+            self.updates.pop(key, None)
+            self.dirty.discard(key)
+
+    # --- Lectura paginada ---
+
+    def _query(self, connection, key: SessionKey, condition: str, params: Dict[str, Any], order: str, limit: int):
+        from sqlalchemy import text
+        rows = connection.execute(
+            text(f"""
+                SELECT seq, sender, text, timestamp FROM chat_messages
+                WHERE user_id = :user_id AND session_id = :session_id AND {condition}
+                ORDER BY seq {order} LIMIT :limit
+            """),
+            {"user_id": key[0], "session_id": key[1], "limit": limit, **params}
+        ).fetchall()
+        with self.lock:
+            # Textos actualizados que aún no llegaron a la base
+            pending = dict(self.updates.get(key, {}))
+            self.pages_from_db += 1
+        return [
+            {"seq": row[0], "sender": row[1], "text": pending.get(row[0], row[2]), "timestamp": row[3]}
+            for row in rows
+        ]
+
+    def _plan_page(self, log: SessionLog, since_seq: Optional[int], before_seq: Optional[int], limit: int):
+        """Parte de la página que sale de la cola cacheada y, si no alcanza,
+        la consulta que la completa: ``(cached, query o None)``"""
+        with self.lock:
+            tail_start = log.tail_start
+            complete = log.complete
+            if since_seq is not None:
+                cached = [dict(m) for m in log.tail if m["seq"] > since_seq][:limit]
+                covered = complete or since_seq + 1 >= tail_start
+            else:
+                cached = [dict(m) for m in log.tail if before_seq is None or m["seq"] < before_seq][-limit:]
+                covered = complete or len(cached) == limit or tail_start <= 1
+            if covered:
+                self.pages_from_cache += 1
+                return cached, None
+
+        if since_seq is not None:
+            return cached, ("seq > :since_seq AND seq < :tail_start",
+                            {"since_seq": since_seq, "tail_start": tail_start}, "ASC", limit)
+        end = tail_start if before_seq is None else min(before_seq, tail_start)
+        return cached, ("seq < :end", {"end": end}, "DESC", limit - len(cached))
+
+    @staticmethod
+    def _merge_page(cached, older, since_seq: Optional[int], limit: int) -> List[Dict[str, Any]]:
+        if since_seq is not None:
+            return (older + cached)[:limit]
+        return list(reversed(older)) + cached
+
+    def get(self, user_id, session_id, since_seq: Optional[int] = None,
+            before_seq: Optional[int] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Página de mensajes en orden ascendente.
+
+        - ``since_seq``: los primeros ``limit`` mensajes posteriores a ese seq
+        - ``before_seq``: los ``limit`` mensajes anteriores a ese seq
+        - sin parámetros: los ``limit`` mensajes más recientes
+        """
+        key = self._key(user_id, session_id)
+        limit = max(1, min(limit or self.max_messages, MAX_PAGE_SIZE))
+        cached, query = self._plan_page(self._session(key), since_seq, before_seq, limit)
+        if query is None:
+            return cached
+        with self.engine_factory().connect() as connection:
+            older = self._query(connection, key, *query)
+        return self._merge_page(cached, older, since_seq, limit)
+
+    async def aget(self, user_id, session_id, since_seq: Optional[int] = None,
+                   before_seq: Optional[int] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """``get`` sobre el engine asíncrono"""
+        key = self._key(user_id, session_id)
+        limit = max(1, min(limit or self.max_messages, MAX_PAGE_SIZE))
+        cached, query = self._plan_page(await self._asession(key), since_seq, before_seq, limit)
+        if query is None:
+            return cached
+        async with self.async_engine_factory().connect() as connection:
+            older = await connection.run_sync(self._query, key, *query)
+        return self._merge_page(cached, older, since_seq, limit)
+
+    # --- Vaciado ---
+
+    def _write(self, connection, keys, inserts: Dict[SessionKey, List[Dict[str, Any]]],
+               updates: Dict[SessionKey, Dict[int, str]]):
+        from sqlalchemy import text
+        # La sesión debe existir antes que sus mensajes; de paso se actualiza updated_at
+        connection.execute(
+            text("""
+                INSERT INTO chat_sessions (user_id, session_id, history)
+                VALUES (:user_id, :session_id, JSON_ARRAY())
+                ON DUPLICATE KEY UPDATE updated_at = CURRENT_TIMESTAMP
+            """),
+            [{"user_id": key[0], "session_id": key[1]} for key in keys]
+        )
+        for key, messages in inserts.items():
+            _insert_messages(connection, key, messages)
+        rows = [
+            {"user_id": key[0], "session_id": key[1], "seq": seq, "text": message_text}
+            for key, changes in updates.items() for seq, message_text in changes.items()
+        ]
+        if rows:
+            connection.execute(
+                text("""
+                    UPDATE chat_messages SET text = :text
+                    WHERE user_id = :user_id AND session_id = :session_id AND seq = :seq
+                """),
+                rows
+            )
+
+    def _reassign_seqs(self, key: SessionKey, messages: List[Dict[str, Any]]) -> bool:
+        """Renumera los mensajes pendientes de la sesión a continuación del
+        ``MAX(seq)`` de la base; False si el conflicto no se explica así"""
+        from sqlalchemy import text
+        with self.engine_factory().connect() as connection:
+            max_seq = connection.execute(
+                text("SELECT COALESCE(MAX(seq), 0) FROM chat_messages WHERE user_id = :user_id AND session_id = :session_id"),
+                {"user_id": key[0], "session_id": key[1]}
+            ).scalar() or 0
+
+        with self.lock:
+            first = messages[0]["seq"]
+            offset = max_seq + 1 - first
+            if offset <= 0:
+                return False
+            # Los mismos dicts están en el lote, en la cola y en lo agregado después del lote
+            pending = {id(message): message for message in messages + self.inserts.get(key, [])}
+            log = self.sessions.get(key)
+            if log is not None:
+                # Lo anterior al lote quedó separado por filas ajenas: la cola ya no es contigua
+                log.tail = [message for message in log.tail if message["seq"] >= first]
+                log.complete = False
+                pending.update((id(message), message) for message in log.tail)
+                log.aliases = {old: new + offset if new >= first else new for old, new in log.aliases.items()}
+                log.aliases.update((message["seq"], message["seq"] + offset) for message in pending.values())
+                log.last_seq += offset
+            for message in pending.values():
+                message["seq"] += offset
+        logger.warning(f"⚠️ seq en conflicto en la sesión {key[1]} del usuario {key[0]}: "
+                       f"{len(pending)} mensajes renumerados desde {max_seq + 1}")
+        return True
+
+    def _write_individually(self, keys, inserts, updates):
+        """Escribe sesión por sesión cuando el lote falla por integridad.
+
+        - ``seq`` duplicado (otro proceso escribió la sesión o la cola quedó
+          desactualizada): se relee ``MAX(seq)``, se renumera y se reintenta
+        - clave foránea (usuario o sesión eliminados): se descarta la sesión
+        - cualquier otro error: la sesión vuelve a quedar pendiente
+        """
+        from sqlalchemy.exc import IntegrityError
+        failed = {}
+        for key in list(keys):
+            for attempt in range(SEQ_CONFLICT_RETRIES + 1):
+                try:
+                    with self.engine_factory().begin() as connection:
+                        self._write(connection, [key], {key: inserts[key]} if key in inserts else {},
+                                    {key: updates[key]} if key in updates else {})
+                    break
+                except IntegrityError as e:
+                    code = _mysql_error_code(e)
+                    if (code == DUPLICATE_KEY_ERROR and key in inserts and attempt < SEQ_CONFLICT_RETRIES
+                            and self._reassign_seqs(key, inserts[key])):
+                        continue
+                    if code in FOREIGN_KEY_ERRORS:
+                        logger.warning(f"⚠️ Historial descartado para la sesión {key[1]} del usuario {key[0]}: {e}")
+                        keys.discard(key)
+                        inserts.pop(key, None)
+                        updates.pop(key, None)
+                        self.forget(*key)
+                    else:
+                        failed[key] = e
+                    break
+                except Exception as e:
+                    failed[key] = e
+                    break
+
+        if failed:
+            # Solo lo no escrito vuelve a quedar pendiente (reintentar lo escrito duplicaría filas)
+            failed_keys = set(failed)
+            keys -= failed_keys
+            self._restore(failed_keys,
+                          {key: inserts.pop(key) for key in failed_keys if key in inserts},
+                          {key: updates.pop(key) for key in failed_keys if key in updates},
+                          next(iter(failed.values())))
+
+    def flush(self) -> int:
+        """Escribe todas las sesiones pendientes en una transacción; devuelve las filas escritas"""
+        from sqlalchemy.exc import IntegrityError
+        with self.flush_lock:
+            with self.lock:
+                keys, self.dirty = self.dirty, set()
+                inserts = {key: self.inserts.pop(key) for key in keys if key in self.inserts}
+                updates = {key: self.updates.pop(key) for key in keys if key in self.updates}
+                self.flushing = set(keys)
+            if not keys:
+                return 0
+
+            start = time.time()
+            try:
+                with self.engine_factory().begin() as connection:
+                    self._write(connection, keys, inserts, updates)
+            except IntegrityError:
+                self._write_individually(keys, inserts, updates)
+            except Exception as e:
+                self._restore(keys, inserts, updates, e)
+                return 0
+
+            rows = sum(len(m) for m in inserts.values()) + sum(len(u) for u in updates.values())
+            with self.lock:
+                self.flushing = set()
+                self.flushes += 1
+                self.rows_written += rows
+                self.last_flush_seconds = round(time.time() - start, 4)
+            logger.debug(f"💾 Historial: {rows} mensajes de {len(keys)} sesiones escritos en {self.last_flush_seconds}s")
+            return rows
+
+    def _restore(self, keys, inserts, updates, error: Exception):
+        """Vuelve a dejar pendiente lo que no se pudo escribir"""
+        with self.lock:
+            self.flushing = set()
+            self.flush_errors += 1
+            for key in keys:
+                if key not in self.sessions:
+                    continue  # Sesión eliminada mientras tanto
+                if key in inserts:
+                    self.inserts[key] = inserts[key] + self.inserts.get(key, [])
+                if key in updates:
+                    self.updates[key] = {**updates[key], **self.updates.get(key, {})}
+                self.dirty.add(key)
+        logger.warning(f"⚠️ No se pudo escribir el historial ({len(keys)} sesiones), se reintentará: {error}")
+
+    # --- Hilo de vaciado ---
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self.dirty and not self.flush() and self.dirty:
+                # Sin base de datos no tiene sentido reintentar en cada despertar
+                time.sleep(self.flush_interval)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+            logger.info(f"💾 Historial write-behind activo (vaciado cada {self.flush_interval}s)")
+
+    def stop(self):
+        """Detiene el hilo y escribe lo pendiente"""
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        if self.dirty:
+            self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estadísticas para el endpoint de métricas"""
+        with self.lock:
+            return {
+                "cached_sessions": len(self.sessions),
+                "pending_sessions": len(self.dirty),
+                "pending_messages": sum(len(m) for m in self.inserts.values()),
+                "appended_messages": self.appended,
+                "updated_messages": self.updated,
+                "migrated_sessions": self.migrated_sessions,
+                "pages_from_cache": self.pages_from_cache,
+                "pages_from_db": self.pages_from_db,
+                "flushes": self.flushes,
+                "rows_written": self.rows_written,
+                "flush_errors": self.flush_errors,
+                "last_flush_seconds": self.last_flush_seconds
+            }
@@ -0,0 +1,136 @@
+"""
+Constructor de Índices de Embeddings
+====================================
+
+Embebe fragmentos para el vector store sin depender del ritmo de
+``Chroma.from_documents`` / ``FAISS.from_documents``:
+- Lotes de tamaño configurable (una petición a Ollama por lote)
+- Número acotado de peticiones en vuelo para saturar el servidor de
+  embeddings sin desbordarlo
+- Checkpoint en SQLite por ID de fragmento: tras una caída, los lotes
+  ya embebidos se recuperan del checkpoint en lugar de recalcularse
+- Progreso (fragmentos/seg y ETA) en el log y en un callback
+"""
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Optional, Any
+
+from embedding_cache import SQLiteEmbeddingStore
+
+logger = logging.getLogger("index_builder")
+
+# Segundos mínimos entre dos líneas de progreso en el log
+PROGRESS_LOG_INTERVAL = 5.0
+
+
+class EmbeddingIndexBuilder:
+    """Embebe fragmentos en lotes concurrentes con checkpoints reanudables"""
+
+    def __init__(self, embeddings, model_name: str, batch_size: int = 64,
+                 max_in_flight: int = 4, checkpoint_path: Optional[str] = None,
+                 checkpoint_max_entries: int = 500000,
+                 progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.max_in_flight = max(1, max_in_flight)
+        self.progress_callback = progress_callback
+
+        self.checkpoint = None
+        if checkpoint_path:
+            try:
+                self.checkpoint = SQLiteEmbeddingStore(checkpoint_path, checkpoint_max_entries)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo abrir el checkpoint de indexación: {e}")
+
+    def build(self, ids: List[str], texts: List[str],
+              sink: Callable[[List[str], List[List[float]]], None]) -> Dict[str, Any]:
+        """Embebe ``texts`` y entrega cada lote terminado a ``sink(ids, vectores)``.
+
+        ``sink`` se llama siempre desde el hilo que invoca ``build``.
+        """
+        start = time.time()
+        progress = {
+            "status": "building",
+            "total": len(ids),
+            "done": 0,
+            "resumed": 0,
+            "fragments_per_sec": 0.0,
+            "eta_seconds": None
+        }
+        self._report(progress)
+
+        # Reanudar: los fragmentos ya embebidos en una ejecución previa
+        pending = list(range(len(ids)))
+        if self.checkpoint is not None and ids:
+            stored = self.checkpoint.get_many(self.model_name, ids)
+            if stored:
+                resumed = [i for i in pending if ids[i] in stored]
+                for offset in range(0, len(resumed), self.batch_size):
+                    batch = resumed[offset:offset + self.batch_size]
+                    sink([ids[i] for i in batch], [stored[ids[i]] for i in batch])
+                progress["resumed"] = progress["done"] = len(resumed)
+                pending = [i for i in pending if ids[i] not in stored]
+                logger.info(f"♻️ {len(resumed)} fragmentos recuperados del checkpoint de indexación")
+
+        batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+        embedded = 0
+        last_log = 0.0
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="embed") as pool:
+            in_flight = {}
+            next_batch = 0
+            while next_batch < len(batches) or in_flight:
+                # Mantener como máximo max_in_flight peticiones a Ollama
+                while next_batch < len(batches) and len(in_flight) < self.max_in_flight:
+                    batch = batches[next_batch]
+                    future = pool.submit(self.embeddings.embed_documents, [texts[i] for i in batch])
+                    in_flight[future] = batch
+                    next_batch += 1
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = in_flight.pop(future)
+                    vectors = future.result()
+                    batch_ids = [ids[i] for i in batch]
+
+                    if self.checkpoint is not None:
+                        try:
+                            self.checkpoint.put_many(self.model_name, dict(zip(batch_ids, vectors)))
+                        except Exception as e:
+                            logger.warning(f"Error escribiendo checkpoint de indexación: {e}")
+                    sink(batch_ids, vectors)
+
+                    embedded += len(batch)
+                    progress["done"] += len(batch)
+                    elapsed = time.time() - start
+                    rate = embedded / elapsed if elapsed > 0 else 0.0
+                    progress["fragments_per_sec"] = round(rate, 1)
+                    progress["eta_seconds"] = round((progress["total"] - progress["done"]) / rate, 1) if rate else None
+                    self._report(progress)
+
+                    if elapsed - last_log >= PROGRESS_LOG_INTERVAL:
+                        last_log = elapsed
+                        logger.info(
+                            f"📈 Indexando: {progress['done']}/{progress['total']} fragmentos "
+                            f"({progress['fragments_per_sec']} frag/s, ETA {progress['eta_seconds']}s)"
+                        )
+
+        progress["status"] = "completed"
+        progress["eta_seconds"] = 0
+        progress["seconds"] = round(time.time() - start, 2)
+        self._report(progress)
+        logger.info(
+            f"✅ Embeddings de índice listos: {embedded} calculados, {progress['resumed']} desde checkpoint "
+            f"en {progress['seconds']}s ({progress['fragments_per_sec']} frag/s)"
+        )
+        return progress
+
+    def _report(self, progress: Dict[str, Any]):
+        if self.progress_callback:
+            try:
+                self.progress_callback(dict(progress))
+            except Exception:
+                pass
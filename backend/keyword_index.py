@@ -0,0 +1,216 @@
+"""
+Índice Invertido BM25 sobre los Fragmentos
+==========================================
+
+Búsqueda léxica en memoria que complementa a la búsqueda vectorial:
+- Encuentra términos exactos que los embeddings suelen diluir
+  ("A*", "backpropagation", el nombre de un docente del syllabus)
+- Las estadísticas de términos se calculan al ingerir cada PDF y se
+  guardan junto a su entrada del cache de fragmentos, de modo que el
+  índice se arma en el arranque sin volver a tokenizar
+- Permite responder sin embedding (sin ir a Ollama) en preguntas de
+  términos exactos (frases entre comillas, "a*", "c++") y en todas las
+  preguntas cuando el servidor de embeddings está degradado
+- Los resultados se combinan con los vectoriales mediante
+  reciprocal rank fusion (RRF)
+- Es también el buscador local (solo CPU) del modo degradado sin
+  vector store
+"""
+
+import re
+import math
+import logging
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # Sin SciPy se usa la implementación en Python puro
+    np = None
+    sparse = None
+
+logger = logging.getLogger("keyword_index")
+
+# Palabras con símbolos finales ("a*", "c++", "c#") se conservan como un término
+_TOKEN_RE = re.compile(r"\w+[*+#]*")
+_QUOTED_RE = re.compile(r"[\"“«']([^\"”»']{2,})[\"”»']")
+
+STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes asi cada como con contra cual cuales
+cuando cuanto de del desde donde dos e el ella ellas ellos en entre era es esa esas ese eso esos
+esta estan estas este esto estos fue ha hay la las le les lo los mas me mi mis muy nada ni no nos
+o os otra otro para pero poco por porque que quien quienes se sea ser si sin sobre son su sus
+tambien te tiene tienen toda todas todo todos tu tus un una unas uno unos y ya yo
+dame explica explicame dime puedes podrias significa cual cuales hola gracias
+""".split())
+
+
+# Tabla de traducción para quitar tildes sin recorrer el texto carácter a carácter
+_ACCENT_TABLE = str.maketrans("áàäâãéèëêíìïîóòöôõúùüûñç", "aaaaaeeeeiiiiooooouuuunc")
+
+
+def fold_text(text: str) -> str:
+    """Minúsculas y sin tildes, para que "qué" y "que" coincidan"""
+    return unicodedata.normalize("NFC", text).lower().translate(_ACCENT_TABLE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Términos indexables de un texto (sin palabras vacías)"""
+    if not text:
+        return []
+    return [token for token in _TOKEN_RE.findall(fold_text(text)) if token not in STOPWORDS]
+
+
+def is_keyword_query(query: str) -> bool:
+    """Pregunta que pide términos exactos: una frase entre comillas o un
+    término con símbolos ("a*", "c++"). Las preguntas conceptuales cortas
+    ("¿Qué es una red neuronal?") no cuentan: necesitan la búsqueda semántica."""
+    if _QUOTED_RE.search(query):
+        return True
+    return any(term[-1] in "*+#" for term in tokenize(query))
+
+
+def term_stats(fragments: Iterable[Any]) -> Dict[str, Any]:
+    """Estadísticas BM25 de una lista de fragmentos (una entrada del cache).
+
+    ``lengths`` es la cantidad de términos de cada fragmento; ``docs`` y
+    ``freqs`` mapean cada término a listas paralelas de índices locales y
+    frecuencias (listas planas: mucho más rápidas de serializar).
+    """
+    lengths: List[int] = []
+    docs: Dict[str, List[int]] = defaultdict(list)
+    freqs: Dict[str, List[int]] = defaultdict(list)
+    for local_index, fragment in enumerate(fragments):
+        terms = tokenize(fragment.page_content)
+        lengths.append(len(terms))
+        for term, frequency in Counter(terms).items():
+            docs[term].append(local_index)
+            freqs[term].append(frequency)
+    return {"lengths": lengths, "docs": dict(docs), "freqs": dict(freqs)}
+
+
+class BM25Index:
+    """Índice BM25 inmutable ligado a una lista de fragmentos concreta.
+
+    Se reemplaza completo al recargar el corpus, así una búsqueda nunca
+    mezcla posiciones de dos versiones distintas del corpus.
+
+    Con NumPy/SciPy los pesos BM25 (que no dependen de la consulta) se
+    precalculan en una matriz dispersa término × fragmento: una consulta
+    es la suma de unas pocas filas y un top-k parcial, del orden de
+    milisegundos con decenas de miles de fragmentos. Sin SciPy se usan
+    listas de postings en Python puro.
+    """
+
+    def __init__(self, fragments: Sequence, stats: Sequence[Dict[str, Any]],
+                 k1: float = 1.5, b: float = 0.75):
+        self.fragments = fragments
+        self.k1 = k1
+        self.b = b
+        self.term_ids: Dict[str, int] = {}
+
+        # Concatenar las entradas por PDF desplazando los índices locales
+        lengths: List[int] = []
+        rows: List[int] = []
+        cols: List[int] = []
+        tfs: List[int] = []
+        for entry in stats:
+            offset = len(lengths)
+            lengths.extend(entry["lengths"])
+            entry_freqs = entry["freqs"]
+            for term, local_docs in entry["docs"].items():
+                term_id = self.term_ids.setdefault(term, len(self.term_ids))
+                rows.extend([term_id] * len(local_docs))
+                cols.extend([offset + local_index for local_index in local_docs] if offset else local_docs)
+                tfs.extend(entry_freqs[term])
+
+        self.size = len(lengths)
+        self.avg_length = (sum(lengths) / self.size) if self.size else 0.0
+        if sparse is not None:
+            self._build_matrix(lengths, rows, cols, tfs)
+        else:
+            self._build_postings(lengths, rows, cols, tfs)
+
+    def _idf(self, document_frequency):
+        return math.log(1 + (self.size - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def _build_matrix(self, lengths, rows, cols, tfs):
+        rows = np.asarray(rows, dtype=np.int32)
+        cols = np.asarray(cols, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float32)
+        doc_lengths = np.asarray(lengths, dtype=np.float32)
+
+        document_frequency = np.bincount(rows, minlength=len(self.term_ids)).astype(np.float32)
+        idf = np.log1p((self.size - document_frequency + 0.5) / (document_frequency + 0.5))
+        norm = self.k1 * (1 - self.b + self.b * doc_lengths[cols] / (self.avg_length or 1.0))
+        weights = idf[rows] * tfs * (self.k1 + 1) / (tfs + norm)
+
+        self.matrix = sparse.csr_matrix(
+            (weights.astype(np.float32), (rows, cols)),
+            shape=(len(self.term_ids), self.size)
+        )
+        self.postings = None
+
+    def _build_postings(self, lengths, rows, cols, tfs):
+        # término → [(índice global, peso BM25), ...]
+        postings: List[List[Tuple[int, float]]] = [[] for _ in self.term_ids]
+        for term_id, index, frequency in zip(rows, cols, tfs):
+            postings[term_id].append((index, frequency))
+
+        avg_length = self.avg_length or 1.0
+        self.postings = []
+        for term_postings in postings:
+            idf = self._idf(len(term_postings))
+            self.postings.append([
+                (index, idf * frequency * (self.k1 + 1) /
+                 (frequency + self.k1 * (1 - self.b + self.b * lengths[index] / avg_length)))
+                for index, frequency in term_postings
+            ])
+        self.matrix = None
+
+    @classmethod
+    def from_fragments(cls, fragments: Sequence, k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """Construye el índice tokenizando los fragmentos (sin estadísticas en cache)"""
+        return cls(fragments, [term_stats(fragments)], k1=k1, b=b)
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def vocabulary_size(self) -> int:
+        return len(self.term_ids)
+
+    def search(self, query: str, k: int = 8) -> List[Tuple[int, float]]:
+        """Índices de los ``k`` fragmentos con mayor puntaje BM25"""
+        term_ids = sorted({self.term_ids[term] for term in tokenize(query) if term in self.term_ids})
+        if not term_ids or k <= 0:
+            return []
+
+        if self.matrix is not None:
+            scores = np.asarray(self.matrix[term_ids].sum(axis=0)).ravel()
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+            ranked = candidates[np.argsort(scores[candidates])[::-1]]
+            return [(int(index), float(scores[index])) for index in ranked]
+
+        totals: Dict[int, float] = {}
+        for term_id in term_ids:
+            for index, weight in self.postings[term_id]:
+                totals[index] = totals.get(index, 0.0) + weight
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def search_documents(self, query: str, k: int = 8) -> List[Any]:
+        """Igual que ``search`` pero devolviendo los fragmentos"""
+        return [self.fragments[index] for index, _ in self.search(query, k)]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[str]:
+    """Fusiona varias listas ordenadas de IDs: puntaje = Σ 1 / (k + posición)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for position, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + position)
+    return sorted(scores, key=scores.get, reverse=True)
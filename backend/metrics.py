@@ -45,6 +45,7 @@ class RequestMetric:
     llm_processing_time: Optional[float] = None
     memory_used_mb: Optional[float] = None
     cpu_percent: Optional[float] = None
+    stage_timings: Optional[Dict[str, float]] = None
 
 @dataclass
 class SystemMetric:
@@ -140,7 +141,8 @@ class MetricsCollector:
     
     def end_request(self, request_id: str, status: str = "success", 
                    response_length: int = 0, error_details: str = None,
-                   vector_search_time: float = None, llm_processing_time: float = None):
+                   vector_search_time: float = None, llm_processing_time: float = None,
+                   stage_timings: Dict[str, float] = None):
         """Finaliza el tracking de una request"""
         with self.lock:
             if request_id not in self.active_requests:
@@ -158,6 +160,7 @@ class MetricsCollector:
             metric.error_details = error_details
             metric.vector_search_time = vector_search_time
             metric.llm_processing_time = llm_processing_time
+            metric.stage_timings = stage_timings
             
             # Mover a historial
             self.request_metrics.append(metric)
@@ -234,9 +237,29 @@ class MetricsCollector:
                     "memory_used_mb": latest_system_metric.memory_used_mb if latest_system_metric else 0
                 },
                 "models": dict(self.model_stats),
+                "stages": self._get_stage_stats(),
                 "timestamp": now
             }
     
+    def _get_stage_stats(self) -> Dict[str, Any]:
+        """Calcula promedio y p95 por etapa del pipeline (llamar con el lock tomado)"""
+        stage_values = defaultdict(list)
+        for m in self.request_metrics:
+            if m.stage_timings:
+                for stage, value in m.stage_timings.items():
+                    if isinstance(value, (int, float)):
+                        stage_values[stage].append(value)
+        
+        stages = {}
+        for stage, values in stage_values.items():
+            ordered = sorted(values)
+            stages[stage] = {
+                "count": len(ordered),
+                "avg": round(sum(ordered) / len(ordered), 4),
+                "p95": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 4)
+            }
+        return stages
+    
     def get_bottleneck_analysis(self) -> Dict[str, Any]:
         """Analiza cuellos de botella en el sistema"""
         with self.lock:
@@ -336,10 +359,10 @@ def start_request_tracking(endpoint: str, model_used: str, user_id: str, questio
 
 def end_request_tracking(request_id: str, status: str = "success", response_length: int = 0, 
                         error_details: str = None, vector_search_time: float = None, 
-                        llm_processing_time: float = None):
+                        llm_processing_time: float = None, stage_timings: Dict[str, float] = None):
     """Finaliza tracking de una request"""
     metrics_collector.end_request(request_id, status, response_length, error_details, 
-                                 vector_search_time, llm_processing_time)
+                                 vector_search_time, llm_processing_time, stage_timings)
 
 def record_model_switch(from_model: str, to_model: str):
     """Registra cambio de modelo"""
@@ -0,0 +1,97 @@
+"""
+Migración del Historial JSON a chat_messages
+============================================
+
+Para bases creadas antes de la tabla ``chat_messages``:
+- Crea la tabla si no existe (misma definición que init-db.sql)
+- Recorre ``chat_sessions`` por lotes y copia a filas el historial de
+  las sesiones que aún lo guardan en la columna JSON, una transacción
+  por sesión (se puede interrumpir y volver a ejecutar)
+- Comparte ``migrate_legacy_history`` con la migración perezosa que hace
+  la API al tocar por primera vez una sesión sin migrar
+
+Uso (desde backend/):
+    python migrate_chat_history.py
+    python migrate_chat_history.py --lote 200
+"""
+
+import sys
+import time
+import logging
+import argparse
+
+from history_writer import migrate_legacy_history
+
+logger = logging.getLogger("migrate_chat_history")
+
+CHAT_MESSAGES_DDL = """
+    CREATE TABLE IF NOT EXISTS `chat_messages` (
+        `user_id` INT NOT NULL,
+        `session_id` VARCHAR(255) NOT NULL,
+        `seq` INT NOT NULL,
+        `sender` VARCHAR(20) NOT NULL,
+        `text` MEDIUMTEXT NOT NULL,
+        `timestamp` VARCHAR(40) NULL,
+        `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (`user_id`, `session_id`, `seq`),
+        CONSTRAINT `fk_messages_session`
+            FOREIGN KEY (`user_id`, `session_id`)
+            REFERENCES `chat_sessions` (`user_id`, `session_id`)
+            ON DELETE CASCADE
+            ON UPDATE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+"""
+
+
+def migrate(engine, batch_size: int = 500) -> dict:
+    """Migra todas las sesiones pendientes; devuelve sesiones y mensajes migrados"""
+    from sqlalchemy import text
+    with engine.begin() as connection:
+        connection.execute(text(CHAT_MESSAGES_DDL))
+
+    stats = {"sessions": 0, "messages": 0}
+    start = time.time()
+    last_key = (-1, "")
+    while True:
+        # Recorrido por clave primaria: cada lote continúa donde terminó el anterior
+        with engine.connect() as connection:
+            keys = connection.execute(
+                text("""
+                    SELECT user_id, session_id FROM chat_sessions
+                    WHERE (user_id, session_id) > (:user_id, :session_id)
+                      AND JSON_LENGTH(history) > 0
+                    ORDER BY user_id, session_id
+                    LIMIT :limit
+                """),
+                {"user_id": last_key[0], "session_id": last_key[1], "limit": batch_size}
+            ).fetchall()
+        if not keys:
+            break
+
+        for user_id, session_id in keys:
+            with engine.begin() as connection:
+                migrated = migrate_legacy_history(connection, user_id, session_id)
+            if migrated:
+                stats["sessions"] += 1
+                stats["messages"] += len(migrated)
+        last_key = tuple(keys[-1])
+        logger.info(f"📦 {stats['sessions']} sesiones migradas ({stats['messages']} mensajes)")
+
+    stats["seconds"] = round(time.time() - start, 2)
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Migra el historial JSON de chat_sessions a chat_messages")
+    parser.add_argument("--lote", type=int, default=500, help="Sesiones leídas por consulta")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    from models import engine
+    stats = migrate(engine, args.lote)
+    logger.info(f"✅ Migración completa: {stats['sessions']} sesiones, {stats['messages']} mensajes en {stats['seconds']}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,15 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, text, JSON, TIMESTAMP, Float, Boolean, Enum
+from sqlalchemy import Column, Integer, String, Text, text, JSON, TIMESTAMP, Float, Boolean, Enum
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 from pydantic import BaseModel
 from passlib.context import CryptContext
 from datetime import datetime
-from config import DATABASE_URL
+from database import engine, SessionLocal
 import enum
 
 # Configurar bcrypt para el hash de contraseñas
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-# Crear engine y sesión
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# El engine y la sesión son los compartidos de database.py (un solo pool por proceso)
 
 # Función para verificar conexión a la base de datos
 def check_db_connection():
@@ -45,6 +42,17 @@ class ChatSession(Base):
     history = Column(JSON, nullable=False)
     updated_at = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP'))
 
+class ChatMessage(Base):
+    __tablename__ = "chat_messages"
+    user_id = Column(String(255), primary_key=True)
+    session_id = Column(String(255), primary_key=True)
+    seq = Column(Integer, primary_key=True, autoincrement=False)
+    sender = Column(String(20), nullable=False)
+    timestamp = Column(String(40))
+    created_at = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+    # Al final: dentro de la clase este nombre oculta la función text() de SQLAlchemy
+    text = Column(Text, nullable=False)
+
 class Feedback(Base):
     __tablename__ = "feedback"
     id = Column(Integer, primary_key=True, autoincrement=True)
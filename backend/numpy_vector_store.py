@@ -0,0 +1,320 @@
+"""
+Vector Store NumPy Mapeado en Memoria
+=====================================
+
+Tercer backend vectorial, además de ChromaDB y FAISS:
+- Los embeddings de los fragmentos (normalizados) se guardan en una
+  matriz float32 ``vectors.npy`` que se abre con ``np.load(mmap_mode="r")``.
+  Varios workers de Uvicorn y hilos de Celery en el mismo host comparten
+  así el page cache del sistema operativo en lugar de cargar cada uno
+  su propia copia
+- Búsqueda por fuerza bruta en bloques de filas (producto punto
+  vectorizado y top-k parcial por bloque) y MMR sobre los candidatos
+- Construcción incremental: las filas de los fragmentos que ya estaban
+  indexados se copian de la generación anterior y solo se embeben los
+  fragmentos nuevos (con el checkpoint de EmbeddingIndexBuilder)
+- Cada construcción escribe una generación nueva y actualiza el puntero
+  ``CURRENT`` de forma atómica: un lector nunca ve una matriz a medio
+  escribir ni IDs de otra generación
+
+Se expone con la interfaz VectorStore de LangChain (búsqueda MMR por
+vector, ``as_retriever`` y variantes asíncronas).
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from vector_sync import corpus_fragment_ids
+
+logger = logging.getLogger("numpy_vector_store")
+
+CURRENT_POINTER = "CURRENT"
+VECTORS_FILE = "vectors.npy"
+IDS_FILE = "ids.json"
+MANIFEST_FILE = "manifest.json"
+
+# Generaciones que se conservan (la vigente y la anterior, que otro proceso aún puede tener abierta)
+KEEP_GENERATIONS = 2
+
+# Filas copiadas por tramo al reutilizar la generación anterior
+COPY_CHUNK_ROWS = 16384
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def current_generation(directory: str) -> Optional[str]:
+    """Ruta de la generación vigente, o None si aún no hay índice"""
+    try:
+        with open(os.path.join(directory, CURRENT_POINTER), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except OSError:
+        return None
+    path = os.path.join(directory, name)
+    return path if name and os.path.isdir(path) else None
+
+
+def _read_generation(path: str) -> Tuple[Dict[str, Any], List[str], np.ndarray]:
+    with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    with open(os.path.join(path, IDS_FILE), "r", encoding="utf-8") as f:
+        ids = json.load(f)
+    vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+    if vectors.shape[0] != len(ids):
+        raise ValueError(f"Índice NumPy inconsistente: {vectors.shape[0]} vectores y {len(ids)} IDs")
+    return manifest, ids, vectors
+
+
+def build_numpy_index(directory: str, fragments: Sequence, builder, model_name: str) -> Dict[str, Any]:
+    """Deja en ``directory`` una generación con los vectores del corpus actual.
+
+    Si la generación vigente ya contiene exactamente los mismos fragmentos
+    no se escribe nada (lo habitual en un arranque en caliente o cuando
+    otro proceso ya la construyó).
+    """
+    start = time.time()
+    os.makedirs(directory, exist_ok=True)
+
+    # IDs únicos en el orden del corpus: el contenido repetido se indexa una vez
+    desired: Dict[str, int] = {}
+    for index, fragment_id in enumerate(corpus_fragment_ids(fragments)):
+        desired.setdefault(fragment_id, index)
+    ids = list(desired)
+
+    previous_rows: Dict[str, int] = {}
+    previous_vectors = None
+    previous_path = current_generation(directory)
+    if previous_path:
+        try:
+            manifest, previous_ids, previous_vectors = _read_generation(previous_path)
+            if manifest.get("model") != model_name:
+                logger.info(f"🔁 Modelo de embeddings distinto ({manifest.get('model')}), índice NumPy completo")
+                previous_vectors = None
+            elif previous_ids == ids:
+                stats = {"fragments": len(ids), "unchanged": len(ids), "added": 0, "deleted": 0,
+                         "seconds": round(time.time() - start, 2)}
+                logger.info(f"⚡ Índice NumPy vigente reutilizado: {len(ids)} vectores")
+                return stats
+            else:
+                previous_rows = {fragment_id: row for row, fragment_id in enumerate(previous_ids)}
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo leer el índice NumPy anterior: {e}")
+            previous_vectors = None
+
+    generation = f"gen-{int(time.time() * 1000)}-{os.getpid()}"
+    generation_path = os.path.join(directory, generation)
+    os.makedirs(generation_path)
+    vectors_path = os.path.join(generation_path, VECTORS_FILE)
+
+    rows = {fragment_id: row for row, fragment_id in enumerate(ids)}
+    reused = [fragment_id for fragment_id in ids if previous_vectors is not None and fragment_id in previous_rows]
+    missing = [fragment_id for fragment_id in ids if previous_vectors is None or fragment_id not in previous_rows]
+    output = {"matrix": None}
+
+    def allocate(dimension: int) -> np.ndarray:
+        if output["matrix"] is None:
+            output["matrix"] = np.lib.format.open_memmap(
+                vectors_path, mode="w+", dtype=np.float32, shape=(len(ids), dimension)
+            )
+        return output["matrix"]
+
+    try:
+        if reused:
+            # Copiar por tramos para no cargar la matriz anterior completa en memoria
+            matrix = allocate(previous_vectors.shape[1])
+            for offset in range(0, len(reused), COPY_CHUNK_ROWS):
+                chunk = reused[offset:offset + COPY_CHUNK_ROWS]
+                matrix[[rows[fragment_id] for fragment_id in chunk]] = \
+                    previous_vectors[[previous_rows[fragment_id] for fragment_id in chunk]]
+
+        if missing:
+            texts = [fragments[desired[fragment_id]].page_content for fragment_id in missing]
+
+            def sink(batch_ids, batch_vectors):
+                batch = _normalize(np.asarray(batch_vectors, dtype=np.float32))
+                matrix = allocate(batch.shape[1])
+                matrix[[rows[fragment_id] for fragment_id in batch_ids]] = batch
+
+            builder.build(missing, texts, sink)
+
+        matrix = output["matrix"]
+        if matrix is None:
+            raise ValueError("No hay vectores para construir el índice NumPy")
+        matrix.flush()
+        dimension = matrix.shape[1]
+        del matrix
+        output["matrix"] = None
+
+        _write_atomic(os.path.join(generation_path, IDS_FILE), json.dumps(ids).encode("utf-8"))
+        _write_atomic(
+            os.path.join(generation_path, MANIFEST_FILE),
+            json.dumps({"model": model_name, "dimension": dimension, "count": len(ids),
+                        "created_at": time.time()}).encode("utf-8")
+        )
+        _write_atomic(os.path.join(directory, CURRENT_POINTER), generation.encode("utf-8"))
+    except Exception:
+        output["matrix"] = None
+        shutil.rmtree(generation_path, ignore_errors=True)
+        raise
+
+    _prune_generations(directory, generation)
+
+    stats = {
+        "fragments": len(ids),
+        "unchanged": len(reused),
+        "added": len(missing),
+        "deleted": len(set(previous_rows) - set(rows)),
+        "seconds": round(time.time() - start, 2)
+    }
+    logger.info(
+        f"💾 Índice NumPy escrito ({generation}): +{stats['added']} / -{stats['deleted']} "
+        f"({stats['unchanged']} reutilizados) en {stats['seconds']}s"
+    )
+    return stats
+
+
+def _prune_generations(directory: str, current: str):
+    """Elimina generaciones antiguas; en Linux un proceso que aún las tenga mapeadas sigue funcionando"""
+    generations = sorted(
+        (name for name in os.listdir(directory) if name.startswith("gen-") and name != current),
+        key=lambda name: os.path.getmtime(os.path.join(directory, name)),
+        reverse=True
+    )
+    for name in generations[KEEP_GENERATIONS - 1:]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+class NumpyMemmapVectorStore(VectorStore):
+    """Vector store de solo lectura sobre la generación vigente de ``directory``"""
+
+    def __init__(self, directory: str, fragments: Sequence, embedding: Embeddings,
+                 block_rows: int = 65536):
+        path = current_generation(directory)
+        if path is None:
+            raise FileNotFoundError(f"No hay índice NumPy en {directory}")
+
+        self.directory = directory
+        self.generation = os.path.basename(path)
+        self.fragments = fragments
+        self._embedding = embedding
+        self.block_rows = max(1, block_rows)
+        self.manifest, self.ids, self.vectors = _read_generation(path)
+
+        # Fila del índice → posición del fragmento en la lista del corpus
+        positions: Dict[str, int] = {}
+        for index, fragment_id in enumerate(corpus_fragment_ids(fragments)):
+            positions.setdefault(fragment_id, index)
+        self.positions = [positions.get(fragment_id) for fragment_id in self.ids]
+        stale = sum(position is None for position in self.positions)
+        if stale:
+            logger.warning(f"⚠️ {stale} vectores del índice NumPy no tienen fragmento en el corpus actual")
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _query_array(self, embedding: Sequence[float]) -> np.ndarray:
+        return _normalize(np.asarray(embedding, dtype=np.float32))
+
+    def _top_k(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k por similitud coseno recorriendo la matriz en bloques de filas"""
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        total = self.vectors.shape[0]
+        for start in range(0, total, self.block_rows):
+            scores = self.vectors[start:start + self.block_rows] @ query
+            if len(scores) > k:
+                local = np.argpartition(scores, -k)[-k:]
+            else:
+                local = np.arange(len(scores))
+            best_rows = np.concatenate([best_rows, local + start])
+            best_scores = np.concatenate([best_scores, scores[local]])
+            if len(best_rows) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        order = np.argsort(best_scores)[::-1]
+        return best_rows[order], best_scores[order]
+
+    def _documents(self, rows: Iterable[int]) -> List[Any]:
+        return [self.fragments[self.positions[row]] for row in rows if self.positions[row] is not None]
+
+    # --- Interfaz VectorStore ---
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4) -> List[Tuple[Any, float]]:
+        if not self.ids or k <= 0:
+            return []
+        rows, scores = self._top_k(self._query_array(embedding), k)
+        return [
+            (self.fragments[self.positions[row]], float(score))
+            for row, score in zip(rows, scores) if self.positions[row] is not None
+        ]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Any]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Any]:
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k)
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Any, float]]:
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k)
+
+    def _select_relevance_score_fn(self):
+        # Similitud coseno en [-1, 1] → relevancia en [0, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    def max_marginal_relevance_search_by_vector(self, embedding: List[float], k: int = 4,
+                                                fetch_k: int = 20, lambda_mult: float = 0.5,
+                                                **kwargs: Any) -> List[Any]:
+        if not self.ids or k <= 0:
+            return []
+        query = self._query_array(embedding)
+        rows, scores = self._top_k(query, max(k, fetch_k))
+        # Leer los candidatos en orden de fila (acceso secuencial al memmap)
+        order = np.argsort(rows)
+        rows, scores = rows[order], scores[order]
+        candidates = np.asarray(self.vectors[rows], dtype=np.float32)
+
+        selected: List[int] = [int(np.argmax(scores))]
+        max_similarity = candidates @ candidates[selected[0]]
+        while len(selected) < min(k, len(rows)):
+            mmr = lambda_mult * scores - (1 - lambda_mult) * max_similarity
+            mmr[selected] = -np.inf
+            best = int(np.argmax(mmr))
+            selected.append(best)
+            max_similarity = np.maximum(max_similarity, candidates @ candidates[best])
+        return self._documents(int(rows[index]) for index in selected)
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20,
+                                      lambda_mult: float = 0.5, **kwargs: Any) -> List[Any]:
+        return self.max_marginal_relevance_search_by_vector(
+            self._embedding.embed_query(query), k=k, fetch_k=fetch_k, lambda_mult=lambda_mult
+        )
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        raise NotImplementedError("El índice NumPy es de solo lectura; se reconstruye con build_numpy_index")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings,
+                   metadatas: Optional[List[dict]] = None, **kwargs: Any) -> "NumpyMemmapVectorStore":
+        raise NotImplementedError("Usar build_numpy_index y luego NumpyMemmapVectorStore(directorio, fragmentos, embeddings)")
@@ -0,0 +1,84 @@
+"""
+Presupuesto de Tokens del Prompt
+================================
+
+Ajusta el historial y los documentos recuperados a la ventana de
+contexto de cada modelo definido en AVAILABLE_MODELS:
+- Se reserva espacio para la respuesta (PROMPT_RESPONSE_RESERVE)
+- El historial recibe como máximo PROMPT_HISTORY_SHARE de lo disponible
+  y se recorta desde los mensajes más antiguos
+- Los documentos ocupan el resto, en orden de relevancia; el último
+  fragmento que no cabe entero se trunca
+"""
+
+import logging
+from typing import List
+
+from config import (
+    AVAILABLE_MODELS, DEFAULT_CONTEXT_WINDOW,
+    PROMPT_RESPONSE_RESERVE, PROMPT_HISTORY_SHARE
+)
+from utils import estimate_tokens
+
+logger = logging.getLogger("prompt_budget")
+
+# Por debajo de este espacio no vale la pena incluir un fragmento truncado
+MIN_FRAGMENT_TOKENS = 50
+
+
+class PromptBudget:
+    """Presupuesto de tokens de una consulta para un modelo concreto"""
+
+    def __init__(self, model_name: str):
+        model_config = AVAILABLE_MODELS.get(model_name, {})
+        self.model_name = model_name
+        self.context_window = model_config.get("context_window", DEFAULT_CONTEXT_WINDOW)
+        self.chars_per_token = model_config.get("chars_per_token", 4.0)
+        self.available = max(0, self.context_window - PROMPT_RESPONSE_RESERVE)
+        self.history_budget = int(self.available * PROMPT_HISTORY_SHARE)
+
+    def count(self, text: str) -> int:
+        return estimate_tokens(text, self.chars_per_token)
+
+    def fit_history(self, history: str) -> str:
+        """Conserva los mensajes más recientes que caben en el presupuesto del historial"""
+        if not history or self.count(history) <= self.history_budget:
+            return history
+
+        lines = history.splitlines()
+        kept: List[str] = []
+        used = 0
+        for line in reversed(lines):
+            tokens = self.count(line)
+            if used + tokens > self.history_budget:
+                break
+            kept.append(line)
+            used += tokens
+
+        omitted = len(lines) - len(kept)
+        logger.info(f"✂️ Historial recortado: {omitted} mensajes antiguos omitidos ({used} tokens)")
+        kept.append(f"[Se omitieron {omitted} mensajes anteriores de la conversación]")
+        return "\n".join(reversed(kept)) + "\n"
+
+    def documents_budget(self, base_prompt: str) -> int:
+        """Tokens disponibles para documentos dado el prompt sin documentos"""
+        return max(0, self.available - self.count(base_prompt))
+
+    def fit_documents(self, contents: List[str], max_tokens: int) -> str:
+        """Une los fragmentos en orden de relevancia sin exceder ``max_tokens``"""
+        kept: List[str] = []
+        used = 0
+        for content in contents:
+            tokens = self.count(content)
+            if used + tokens <= max_tokens:
+                kept.append(content)
+                used += tokens
+                continue
+            remaining = max_tokens - used
+            if remaining >= MIN_FRAGMENT_TOKENS:
+                kept.append(content[:int(remaining * self.chars_per_token)])
+            break
+
+        if len(kept) < len(contents):
+            logger.info(f"✂️ Documentos recortados a {len(kept)}/{len(contents)} fragmentos ({max_tokens} tokens)")
+        return "\n".join(kept)
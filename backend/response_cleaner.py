@@ -0,0 +1,180 @@
+"""
+Limpieza de Respuestas del LLM en una Sola Pasada
+=================================================
+
+Versiones precompiladas de ``clean_llm_response`` y de la limpieza de
+artefactos de AISystem. Cada una recorre la respuesta con una única
+expresión regular en vez de encadenar varios ``re.sub`` que copian el
+texto completo en cada paso, y produce exactamente el mismo resultado:
+- ``clean_llm_response``: solo se detiene en cadenas de palabras
+  separadas por saltos de línea y en tramos de espacios en blanco que
+  no sean un espacio simple; cada tramo se transforma de forma local
+  (con memoización, los tramos distintos son pocos)
+- ``clean_response_artifacts``: las frases introductorias genéricas se
+  reconocen con una sola expresión anclada al inicio y los saltos de
+  línea excesivos se normalizan en una única pasada
+
+``ArtifactStreamCleaner`` aplica ``clean_response_artifacts`` de forma
+incremental sobre el stream de tokens de ``_invoke_llm``: solo retiene la
+cola que un token posterior todavía podría modificar, de modo que la
+concatenación de lo emitido es idéntica a limpiar la respuesta completa.
+"""
+
+import re
+from abc import ABC, abstractmethod
+from functools import lru_cache
+
+_LETTER = "[a-zA-ZáéíóúñÁÉÍÓÚÑ]"
+
+# --- clean_llm_response ---
+
+# Pasos originales, aplicados sobre tramos aislados del texto
+_JOIN_LETTERS_RE = re.compile(rf"({_LETTER})\n({_LETTER})")
+_JOIN_WORDS_RE = re.compile(rf"({_LETTER}{{2,}})\n({_LETTER}{{1,}})")
+_MULTIPLE_SPACES_RE = re.compile(r" {2,}")
+_SENTENCE_BREAK_RE = re.compile(r"([.!?:;])\s*\n")
+_EXCESS_NEWLINES_RE = re.compile(r"\n{3,}")
+_TRAILING_SPACES_RE = re.compile(r" +\n")
+
+# Cadenas de palabras unidas por saltos de línea simples ("pala\nbra") o
+# tramos de espacios en blanco distintos de un espacio simple (con el signo
+# de puntuación que los precede); el resto del texto no cambia nunca
+_LLM_RESPONSE_RE = re.compile(
+    rf"(?P<chain>(?<!{_LETTER}){_LETTER}++(?:\n{_LETTER}++)+)"
+    r"|(?P<space>[.!?:;]?(?: (?=\s)|[^\S ])\s*)"
+)
+
+
+def _join_broken_words(chain: str) -> str:
+    """Pasos 1-2: palabras cortadas por saltos de línea"""
+    return _JOIN_WORDS_RE.sub(r"\1\2", _JOIN_LETTERS_RE.sub(r"\1\2", chain))
+
+
+@lru_cache(maxsize=1024)
+def _normalize_whitespace(span: str) -> str:
+    """Pasos 3-6: espacios múltiples, saltos tras puntuación y saltos excesivos"""
+    span = _MULTIPLE_SPACES_RE.sub(" ", span)
+    span = _SENTENCE_BREAK_RE.sub("\\1\n\n", span)
+    span = _EXCESS_NEWLINES_RE.sub("\n\n", span)
+    return _TRAILING_SPACES_RE.sub("\n", span)
+
+
+def _replace_llm_span(match) -> str:
+    if match.lastgroup == "chain":
+        return _join_broken_words(match.group())
+    return _normalize_whitespace(match.group())
+
+
+def _clean_llm_segment(text: str) -> str:
+    return _LLM_RESPONSE_RE.sub(_replace_llm_span, text)
+
+
+def clean_llm_response(response_text):
+    """Limpia la respuesta del LLM eliminando saltos de línea que cortan palabras."""
+    if not response_text:
+        return response_text
+    return _clean_llm_segment(response_text).strip()
+
+
+# --- clean_response_artifacts ---
+
+_INTRO_PHRASES = (
+    r"Como (?:un )?asistente educativo(?: conversacional)?,?\s*",
+    r"Basado en (?:el syllabus|los documentos|la información)(?: del curso)?,?\s*",
+    r"¡Claro! Aquí tienes un resumen:\s*",
+)
+_ASSISTANT, _BASED_ON, _SUMMARY = _INTRO_PHRASES
+
+# Las frases se eliminaban en secuencia, cada una al inicio del texto restante
+_INTRO_RE = re.compile(
+    rf"(?:{_ASSISTANT}(?:{_BASED_ON})?(?:{_SUMMARY})?|{_BASED_ON}(?:{_SUMMARY})?|{_SUMMARY})",
+    re.IGNORECASE
+)
+
+# Comienzos posibles de una frase introductoria (en casefold)
+_INTRO_STARTS = (
+    "como asistente", "como un asistente", "basado en el syllabus",
+    "basado en los documentos", "basado en la información", "¡claro! aquí tienes un resumen:",
+)
+# Caracteres tras la frase introductoria que bastan para decidir si continúa
+INTRO_LOOKAHEAD = 64
+
+
+def clean_response_artifacts(response: str) -> str:
+    """Limpia artefactos comunes en las respuestas del LLM."""
+    intro = _INTRO_RE.match(response)
+    if intro:
+        response = response[intro.end():]
+    return _EXCESS_NEWLINES_RE.sub("\n\n", response)
+
+
+# --- Limpieza incremental sobre un stream de tokens ---
+
+class StreamCleaner(ABC):
+    """Base de los limpiadores incrementales.
+
+    ``feed`` recibe cada token y devuelve el texto limpio que ya es
+    definitivo (posiblemente vacío); ``finish`` devuelve el resto al
+    terminar el stream.
+    """
+
+    def __init__(self):
+        self.pending = ""
+
+    @abstractmethod
+    def _stable_length(self) -> int:
+        """Largo del prefijo de ``pending`` que ningún token futuro puede modificar"""
+
+    @abstractmethod
+    def _clean(self, text: str, final: bool) -> str:
+        """Limpia un tramo ya definitivo (``final``: es el último)"""
+
+    def feed(self, chunk: str) -> str:
+        self.pending += chunk
+        stable = self._stable_length()
+        if stable <= 0:
+            return ""
+        text, self.pending = self.pending[:stable], self.pending[stable:]
+        return self._clean(text, final=False)
+
+    def finish(self) -> str:
+        text, self.pending = self.pending, ""
+        return self._clean(text, final=True)
+
+
+class ArtifactStreamCleaner(StreamCleaner):
+    """``clean_response_artifacts`` incremental"""
+
+    def __init__(self):
+        super().__init__()
+        self.intro_done = False
+
+    def _intro_decided(self, end: int) -> bool:
+        text = self.pending
+        if end == 0:
+            head = text[:len(_INTRO_STARTS[-1])].casefold()
+            if not any(start.startswith(head[:len(start)]) for start in _INTRO_STARTS):
+                return True
+        return end < len(text) and not text[end].isspace() and len(text) - end >= INTRO_LOOKAHEAD
+
+    def _strip_intro(self, final: bool) -> bool:
+        match = _INTRO_RE.match(self.pending)
+        end = match.end() if match else 0
+        if not final and not self._intro_decided(end):
+            return False
+        self.pending = self.pending[end:]
+        self.intro_done = True
+        return True
+
+    def _stable_length(self) -> int:
+        if not self.intro_done and not self._strip_intro(final=False):
+            return 0
+        # Un tramo final de saltos de línea todavía puede crecer
+        return len(self.pending.rstrip("\n"))
+
+    def _clean(self, text: str, final: bool) -> str:
+        if final and not self.intro_done:
+            self.pending = text
+            self._strip_intro(final=True)
+            text, self.pending = self.pending, ""
+        return _EXCESS_NEWLINES_RE.sub("\n\n", text)
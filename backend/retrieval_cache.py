@@ -0,0 +1,237 @@
+"""
+Cache de Resultados de Recuperación
+===================================
+
+La consulta de búsqueda que produce generate_search_query se repite
+con frecuencia aunque las respuestas difieran por el historial. Este
+cache guarda, por consulta normalizada y versión del corpus, los IDs de
+los fragmentos recuperados (en orden) para saltarse por completo el
+embedding y la búsqueda en la base vectorial:
+- Nivel en memoria LRU acotado, por proceso
+- Nivel compartido en Redis entre la API y los workers de Celery, con
+  TTL y un índice (sorted set) que limita la cantidad de entradas
+- La versión del corpus forma parte de la clave: al re-ingestar PDFs
+  las entradas anteriores dejan de usarse y expiran solas
+- Si Redis no responde se sigue solo con el nivel en memoria durante
+  un tiempo de espera, sin penalizar cada consulta
+"""
+
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+from embedding_cache import normalize_query_text
+from fragment_cache import get_fragment_id
+from vector_sync import corpus_fragment_ids
+
+logger = logging.getLogger("retrieval_cache")
+
+# Segundos sin intentar Redis tras un error de conexión
+REDIS_RETRY_INTERVAL = 30.0
+REDIS_SOCKET_TIMEOUT = 0.2
+
+
+class FragmentLookup:
+    """Resuelve IDs de fragmento a fragmentos de una lista concreta del corpus"""
+
+    def __init__(self, fragments: Sequence):
+        self.fragments = fragments
+        self.positions: Dict[str, int] = {}
+        for index, fragment_id in enumerate(corpus_fragment_ids(fragments)):
+            self.positions.setdefault(fragment_id, index)
+
+    def resolve(self, fragment_ids: List[str]) -> Optional[List[Any]]:
+        """Fragmentos en el orden dado, o None si alguno no existe en este corpus"""
+        positions = [self.positions.get(fragment_id) for fragment_id in fragment_ids]
+        if any(position is None for position in positions):
+            return None
+        return [self.fragments[position] for position in positions]
+
+
+class RetrievalCache:
+    """Cache consulta normalizada + versión del corpus → IDs de fragmentos"""
+
+    def __init__(self, redis_host: str, redis_port: int, max_entries: int = 2048,
+                 ttl_seconds: int = 3600, key_prefix: str = "retrieval:"):
+        self.redis_host = redis_host
+        self.redis_port = redis_port
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.key_prefix = key_prefix
+        self.index_key = f"{key_prefix}index"
+
+        self.memory: "OrderedDict[str, List[str]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self._redis = None
+        self._async_redis = None
+        self._redis_down_until = 0.0
+
+        # Contadores
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.redis_errors = 0
+
+    def make_key(self, query: str, corpus_version: str, signature: str) -> str:
+        """``signature`` distingue configuraciones de recuperación (k, backend, híbrida)"""
+        digest = hashlib.sha256(f"{signature}|{normalize_query_text(query)}".encode("utf-8")).hexdigest()[:32]
+        return f"{self.key_prefix}{corpus_version}:{digest}"
+
+    # --- Nivel en memoria ---
+
+    def _memory_get(self, key: str) -> Optional[List[str]]:
+        with self.lock:
+            ids = self.memory.get(key)
+            if ids is not None:
+                self.memory.move_to_end(key)
+            return ids
+
+    def _remember(self, key: str, ids: List[str]):
+        with self.lock:
+            self.memory[key] = ids
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    # --- Nivel Redis ---
+
+    def _redis_available(self) -> bool:
+        return time.time() >= self._redis_down_until
+
+    def _redis_failed(self, error: Exception):
+        self.redis_errors += 1
+        self._redis_down_until = time.time() + REDIS_RETRY_INTERVAL
+        logger.warning(f"⚠️ Redis no disponible para el cache de recuperación ({error}); "
+                       f"solo memoria por {REDIS_RETRY_INTERVAL:.0f}s")
+
+    def _get_redis(self):
+        if self._redis is None:
+            from redis import Redis
+            self._redis = Redis(host=self.redis_host, port=self.redis_port, db=0,
+                                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                                socket_connect_timeout=REDIS_SOCKET_TIMEOUT)
+        return self._redis
+
+    def _get_async_redis(self):
+        # Perezoso para quedar ligado al event loop del servidor
+        if self._async_redis is None:
+            import redis.asyncio as aioredis
+            self._async_redis = aioredis.Redis(host=self.redis_host, port=self.redis_port, db=0,
+                                               socket_timeout=REDIS_SOCKET_TIMEOUT,
+                                               socket_connect_timeout=REDIS_SOCKET_TIMEOUT)
+        return self._async_redis
+
+    def _store_commands(self, pipe, key: str, payload: str):
+        pipe.set(key, payload, ex=self.ttl_seconds)
+        pipe.zadd(self.index_key, {key: time.time()})
+        pipe.zcard(self.index_key)
+
+    def _overflow(self, results) -> int:
+        return max(0, int(results[-1]) - self.max_entries)
+
+    # --- API pública ---
+
+    def _on_hit(self, key: str, ids: List[str], from_redis: bool) -> List[str]:
+        if from_redis:
+            self._remember(key, ids)
+        with self.lock:
+            if from_redis:
+                self.redis_hits += 1
+            else:
+                self.hits += 1
+        return ids
+
+    def _on_miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def get(self, key: str) -> Optional[List[str]]:
+        ids = self._memory_get(key)
+        if ids is not None:
+            return self._on_hit(key, ids, from_redis=False)
+
+        if self._redis_available():
+            try:
+                payload = self._get_redis().get(key)
+                if payload is not None:
+                    return self._on_hit(key, json.loads(payload), from_redis=True)
+            except Exception as e:
+                self._redis_failed(e)
+
+        self._on_miss()
+        return None
+
+    async def aget(self, key: str) -> Optional[List[str]]:
+        ids = self._memory_get(key)
+        if ids is not None:
+            return self._on_hit(key, ids, from_redis=False)
+
+        if self._redis_available():
+            try:
+                payload = await self._get_async_redis().get(key)
+                if payload is not None:
+                    return self._on_hit(key, json.loads(payload), from_redis=True)
+            except Exception as e:
+                self._redis_failed(e)
+
+        self._on_miss()
+        return None
+
+    def put(self, key: str, documents: Sequence):
+        ids = [get_fragment_id(doc) for doc in documents]
+        self._remember(key, ids)
+        with self.lock:
+            self.stores += 1
+
+        if self._redis_available():
+            try:
+                client = self._get_redis()
+                pipe = client.pipeline(transaction=False)
+                self._store_commands(pipe, key, json.dumps(ids))
+                overflow = self._overflow(pipe.execute())
+                if overflow:
+                    expired = [member for member, _ in client.zpopmin(self.index_key, overflow)]
+                    if expired:
+                        client.delete(*expired)
+            except Exception as e:
+                self._redis_failed(e)
+
+    async def aput(self, key: str, documents: Sequence):
+        ids = [get_fragment_id(doc) for doc in documents]
+        self._remember(key, ids)
+        with self.lock:
+            self.stores += 1
+
+        if self._redis_available():
+            try:
+                client = self._get_async_redis()
+                pipe = client.pipeline(transaction=False)
+                self._store_commands(pipe, key, json.dumps(ids))
+                overflow = self._overflow(await pipe.execute())
+                if overflow:
+                    expired = [member for member, _ in await client.zpopmin(self.index_key, overflow)]
+                    if expired:
+                        await client.delete(*expired)
+            except Exception as e:
+                self._redis_failed(e)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estadísticas del cache para el endpoint de métricas"""
+        with self.lock:
+            lookups = self.hits + self.redis_hits + self.misses
+            return {
+                "memory_entries": len(self.memory),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "hit_rate": round((self.hits + self.redis_hits) / lookups * 100, 2) if lookups else 0,
+                "redis_errors": self.redis_errors,
+                "redis_available": self._redis_available()
+            }
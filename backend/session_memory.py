@@ -0,0 +1,154 @@
+"""
+Memoria de Conversación por Sesión
+==================================
+
+Reemplaza la ConversationBufferMemory global del AISystem, que crecía
+sin límite y mezclaba a todos los estudiantes:
+- Una memoria independiente por sesión (chatToken)
+- Ventana de turnos recientes acotada por presupuesto de tokens
+- Resumen acumulado opcional con los turnos que salen de la ventana
+- Expiración por inactividad (TTL) y número máximo de sesiones (LRU)
+"""
+
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Optional, Any
+
+from utils import estimate_tokens
+
+logger = logging.getLogger("session_memory")
+
+_FIRST_SENTENCE_RE = re.compile(r"^(.+?[.!?])(\s|$)", re.DOTALL)
+
+
+def _first_sentence(text: str, max_chars: int = 160) -> str:
+    """Primera oración del texto, recortada, para el resumen acumulado"""
+    text = " ".join(text.split())
+    match = _FIRST_SENTENCE_RE.match(text)
+    sentence = match.group(1) if match else text
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars].rstrip() + "..."
+
+
+class _SessionState:
+    """Turnos recientes y resumen de una sesión"""
+
+    def __init__(self):
+        self.turns: deque = deque()  # (rol, texto, tokens)
+        self.tokens = 0
+        self.summary = ""
+        self.last_access = time.time()
+
+
+class SessionMemoryStore:
+    """Memoria de conversación acotada, indexada por chatToken"""
+
+    def __init__(self, max_tokens: int = 1500, summary_max_tokens: int = 300,
+                 max_sessions: int = 1000, ttl_seconds: int = 7200):
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.sessions: "OrderedDict[str, _SessionState]" = OrderedDict()
+        self.lock = threading.Lock()
+
+        # Contadores
+        self.expired = 0
+        self.evicted = 0
+
+    def add_turn(self, session_id: Optional[str], question: str, answer: str):
+        """Agrega una interacción pregunta/respuesta a la sesión"""
+        if not session_id:
+            return
+        with self.lock:
+            self._expire()
+            state = self.sessions.get(session_id)
+            if state is None:
+                state = _SessionState()
+                self.sessions[session_id] = state
+            self.sessions.move_to_end(session_id)
+            state.last_access = time.time()
+
+            for role, text in (("user", question), ("bot", answer)):
+                tokens = estimate_tokens(text)
+                state.turns.append((role, text, tokens))
+                state.tokens += tokens
+
+            self._trim_window(state)
+
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evicted += 1
+
+    def get_history(self, session_id: Optional[str]) -> str:
+        """Historial de la sesión en el mismo formato que el historial del cliente"""
+        if not session_id:
+            return ""
+        with self.lock:
+            state = self.sessions.get(session_id)
+            if state is None:
+                return ""
+            if time.time() - state.last_access > self.ttl_seconds:
+                del self.sessions[session_id]
+                self.expired += 1
+                return ""
+            self.sessions.move_to_end(session_id)
+            state.last_access = time.time()
+
+            lines = []
+            if state.summary:
+                lines.append(f"Resumen de la conversación anterior: {state.summary}")
+            for role, text, _ in state.turns:
+                prefix = "Usuario" if role == "user" else "Bot"
+                lines.append(f"{prefix}: {text}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def clear(self, session_id: str):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def _trim_window(self, state: _SessionState):
+        """Saca de la ventana los turnos más antiguos que exceden el presupuesto (llamar con el lock tomado)"""
+        # Siempre se conserva al menos el último par pregunta/respuesta
+        while state.tokens > self.max_tokens and len(state.turns) > 2:
+            role, text, tokens = state.turns.popleft()
+            state.tokens -= tokens
+            if self.summary_max_tokens > 0:
+                self._fold_into_summary(state, role, text)
+
+    def _fold_into_summary(self, state: _SessionState, role: str, text: str):
+        """Agrega un turno desalojado al resumen acumulado, conservando lo más reciente"""
+        prefix = "el estudiante preguntó" if role == "user" else "se respondió"
+        entry = f"{prefix}: {_first_sentence(text)}"
+        summary = f"{state.summary} | {entry}" if state.summary else entry
+        max_chars = self.summary_max_tokens * 4
+        if len(summary) > max_chars:
+            summary = "..." + summary[-max_chars:]
+        state.summary = summary
+
+    def _expire(self):
+        """Elimina las sesiones inactivas por más del TTL (llamar con el lock tomado)"""
+        cutoff = time.time() - self.ttl_seconds
+        # Orden LRU: las menos usadas primero
+        while self.sessions:
+            session_id, state = next(iter(self.sessions.items()))
+            if state.last_access >= cutoff:
+                break
+            del self.sessions[session_id]
+            self.expired += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estadísticas para el endpoint de métricas"""
+        with self.lock:
+            self._expire()
+            return {
+                "sessions": len(self.sessions),
+                "max_sessions": self.max_sessions,
+                "window_tokens": sum(state.tokens for state in self.sessions.values()),
+                "max_tokens_per_session": self.max_tokens,
+                "ttl_seconds": self.ttl_seconds,
+                "expired": self.expired,
+                "evicted": self.evicted
+            }
@@ -1,51 +1,28 @@
 import re
 import os
 import json
-import pickle
 import hashlib
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from glob import glob
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from config import CHUNK_SIZE, CHUNK_OVERLAP
+from config import CHUNK_SIZE, CHUNK_OVERLAP, PDF_INGEST_WORKERS
+from fragment_cache import FragmentStore, LazyFragmentList, fragment_id
+from question_classifier import classify_question
+from response_cleaner import clean_llm_response
 
 logger = logging.getLogger("chatbot_utils")
 
-def clean_llm_response(response_text):
-    """Limpia la respuesta del LLM eliminando saltos de línea que cortan palabras."""
-    if not response_text:
-        return response_text
-    
-    # Paso 1: Identificar y corregir palabras cortadas por saltos de línea
-    corrected_text = re.sub(r'([a-zA-ZáéíóúñÁÉÍÓÚÑ])\n([a-zA-ZáéíóúñÁÉÍÓÚÑ])', r'\1\2', response_text)
-    
-    # Paso 2: Corregir casos específicos donde las palabras se cortan al final de línea
-    corrected_text = re.sub(r'([a-zA-ZáéíóúñÁÉÍÓÚÑ]{2,})\n([a-zA-ZáéíóúñÁÉÍÓÚÑ]{1,})', r'\1\2', corrected_text)
-    
-    # Paso 3: Normalizar espacios múltiples
-    corrected_text = re.sub(r' {2,}', ' ', corrected_text)
-    
-    # Paso 4: Preservar saltos de línea intencionales
-    corrected_text = re.sub(r'([.!?:;])\s*\n', r'\1\n\n', corrected_text)
-    
-    # Paso 5: Limpiar saltos de línea múltiples excesivos
-    corrected_text = re.sub(r'\n{3,}', '\n\n', corrected_text)
-    
-    # Paso 6: Eliminar espacios al final de las líneas
-    corrected_text = re.sub(r' +\n', '\n', corrected_text)
-    
-    # Paso 7: Eliminar espacios al inicio y final
-    corrected_text = corrected_text.strip()
-    
-    return corrected_text
-
 def get_file_hash(file_path):
     """Calcula el hash SHA-256 de un archivo para detectar cambios."""
     hash_sha256 = hashlib.sha256()
     try:
         with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
+            # Bloques grandes: hashlib libera el GIL y permite hashear en paralelo con hilos
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
                 hash_sha256.update(chunk)
         return hash_sha256.hexdigest()
     except Exception as e:
@@ -67,6 +44,13 @@ def get_file_metadata(file_path):
         logger.error(f"Error obteniendo metadatos de {file_path}: {e}")
         return None
 
+def compute_corpus_version(pdf_metadata):
+    """Calcula la versión del corpus a partir de los hashes de los PDFs."""
+    hashes = sorted(m["hash"] for m in (pdf_metadata or []) if m and m.get("hash"))
+    if not hashes:
+        return "empty"
+    return hashlib.sha256("|".join(hashes).encode("utf-8")).hexdigest()[:16]
+
 def save_cache_metadata(cache_dir, pdf_metadata, fragments_count):
     """Guarda metadatos del cache para verificación posterior."""
     metadata_file = os.path.join(cache_dir, "cache_metadata.json")
@@ -74,7 +58,7 @@ def save_cache_metadata(cache_dir, pdf_metadata, fragments_count):
         "created_at": datetime.now().isoformat(),
         "pdf_files": pdf_metadata,
         "total_fragments": fragments_count,
-        "cache_version": "1.0"
+        "cache_version": "2.0"
     }
     
     try:
@@ -99,64 +83,38 @@ def load_cache_metadata(cache_dir):
         logger.error(f"Error cargando metadatos del cache: {e}")
         return None
 
-def save_fragments_cache(cache_dir, fragments):
-    """Guarda los fragmentos procesados en cache."""
-    fragments_file = os.path.join(cache_dir, "fragments.pkl")
+def load_and_split_pdf(file_path):
+    """Carga un PDF y lo divide en fragmentos (se ejecuta en un proceso del pool).
     
+    Devuelve (páginas, fragmentos, error); en caso de error las listas vienen vacías.
+    """
     try:
-        with open(fragments_file, 'wb') as f:
-            pickle.dump(fragments, f)
-        return True
+        docs = PyPDFLoader(file_path).load()
+        splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+        fragments = splitter.split_documents(docs)
+        for fragment in fragments:
+            fragment.metadata["fragment_id"] = fragment_id(fragment.page_content)
+        return docs, fragments, None
     except Exception as e:
-        logger.error(f"Error guardando fragmentos en cache: {e}")
-        return False
+        return [], [], str(e)
 
-def load_fragments_cache(cache_dir):
-    """Carga los fragmentos desde cache."""
-    fragments_file = os.path.join(cache_dir, "fragments.pkl")
-    
-    if not os.path.exists(fragments_file):
+def create_ingest_pool(task_count):
+    """Crea el pool de procesos para la ingesta, o None si conviene procesar en serie."""
+    workers = min(PDF_INGEST_WORKERS, task_count)
+    if workers <= 1:
         return None
-    
     try:
-        with open(fragments_file, 'rb') as f:
-            return pickle.load(f)
+        # spawn evita heredar locks de los hilos del servidor o del worker de Celery
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
     except Exception as e:
-        logger.error(f"Error cargando fragmentos desde cache: {e}")
+        logger.warning(f"⚠️ No se pudo crear el pool de procesos, procesando en serie: {e}")
         return None
 
-def check_cache_validity(cache_metadata, current_pdf_files):
-    """Verifica si el cache sigue siendo válido comparando archivos PDF."""
-    if not cache_metadata:
-        logger.info("No hay metadatos de cache previos")
-        return False, []
-    
-    cached_files = {f["path"]: f for f in cache_metadata.get("pdf_files", [])}
-    current_files = {f["path"]: f for f in current_pdf_files}
-    
-    # Verificar archivos eliminados
-    removed_files = set(cached_files.keys()) - set(current_files.keys())
-    if removed_files:
-        logger.info(f"Archivos eliminados detectados: {removed_files}")
-        return False, []
-    
-    # Verificar archivos nuevos o modificados
-    new_or_modified = []
-    for path, current_meta in current_files.items():
-        if path not in cached_files:
-            logger.info(f"Archivo nuevo detectado: {path}")
-            new_or_modified.append(current_meta)
-        elif cached_files[path]["hash"] != current_meta["hash"]:
-            logger.info(f"Archivo modificado detectado: {path}")
-            new_or_modified.append(current_meta)
-        elif cached_files[path]["mtime"] != current_meta["mtime"]:
-            logger.info(f"Fecha de modificación cambiada: {path}")
-            new_or_modified.append(current_meta)
-    
-    cache_valid = len(new_or_modified) == 0
-    
-    logger.info(f"Cache {'válido' if cache_valid else 'inválido'}. Archivos a procesar: {len(new_or_modified)}")
-    return cache_valid, new_or_modified
+def map_in_pool(pool, func, items):
+    """Aplica func a items en el pool conservando el orden de entrada."""
+    if pool is None:
+        return [func(item) for item in items]
+    return list(pool.map(func, items))
 
 def process_pdf_files_optimized(pdfs_dir, cache_dir):
     """Procesa archivos PDF de manera optimizada usando cache."""
@@ -164,118 +122,119 @@ def process_pdf_files_optimized(pdfs_dir, cache_dir):
     
     os.makedirs(cache_dir, exist_ok=True)
     
-    pdf_files = glob(os.path.join(pdfs_dir, "*.pdf"))
+    # Orden estable para que la fusión de resultados sea determinista
+    pdf_files = sorted(glob(os.path.join(pdfs_dir, "*.pdf")))
     if not pdf_files:
         logger.warning("No se encontraron archivos PDF")
+        save_cache_metadata(cache_dir, [], 0)
         return [], []
     
     logger.info(f"📁 Encontrados {len(pdf_files)} archivos PDF")
     
-    current_pdf_metadata = []
-    for pdf_path in pdf_files:
-        metadata = get_file_metadata(pdf_path)
-        if metadata:
-            current_pdf_metadata.append(metadata)
-    
-    cache_metadata = load_cache_metadata(cache_dir)
-    cache_valid, files_to_process = check_cache_validity(cache_metadata, current_pdf_metadata)
-    
-    if cache_valid:
-        logger.info("✅ Cache válido, cargando fragmentos desde cache...")
-        cached_fragments = load_fragments_cache(cache_dir)
-        if cached_fragments:
-            logger.info(f"📄 Cargados {len(cached_fragments)} fragmentos desde cache")
-            return [], cached_fragments
-        else:
-            logger.warning("⚠️ Metadatos válidos pero no se pudieron cargar fragmentos, reprocesando...")
-            files_to_process = current_pdf_metadata
-    
-    if not files_to_process:
-        files_to_process = current_pdf_metadata
-    
-    logger.info(f"🔄 Procesando {len(files_to_process)} archivos...")
+    # Hash SHA-256 de cada archivo en paralelo (hilos: no hace falta arrancar procesos en un arranque en caliente)
+    hash_start = datetime.now()
+    with ThreadPoolExecutor(max_workers=max(1, min(PDF_INGEST_WORKERS, len(pdf_files)))) as hash_pool:
+        current_pdf_metadata = [m for m in hash_pool.map(get_file_metadata, pdf_files) if m and m["hash"]]
+    logger.info(f"🔑 Hashes calculados en {(datetime.now() - hash_start).total_seconds():.2f}s")
+    
+    # Cache direccionado por contenido: una entrada por hash de PDF
+    store = FragmentStore(cache_dir)
+    cached_metadata = load_cache_metadata(cache_dir) or {}
+    cached_counts = {
+        m["hash"]: m.get("fragments")
+        for m in cached_metadata.get("pdf_files", [])
+        if m.get("hash") and m.get("fragments") is not None
+    }
     
-    existing_fragments = []
-    if cache_valid and cache_metadata:
-        existing_fragments = load_fragments_cache(cache_dir) or []
-        logger.info(f"📄 Manteniendo {len(existing_fragments)} fragmentos existentes")
+    files_to_process = [
+        m for m in current_pdf_metadata
+        if m["hash"] not in cached_counts or not store.has(m["hash"])
+    ]
+    logger.info(
+        f"📄 {len(current_pdf_metadata) - len(files_to_process)} PDFs desde cache, "
+        f"{len(files_to_process)} nuevos o modificados"
+    )
     
     new_documents = []
-    processed_files = set()
-    
-    for file_metadata in files_to_process:
-        file_path = file_metadata["path"]
-        
-        if file_path in processed_files:
-            continue
-        
+    new_fragments_by_hash = {}
+    
+    if files_to_process:
+        # Parseo y división en un pool de procesos; los resultados se fusionan en el orden de entrada
+        parse_targets = list({m["hash"]: m for m in files_to_process}.values())
+        paths = [m["path"] for m in parse_targets]
+        parse_start = datetime.now()
+        pool = create_ingest_pool(len(paths))
         try:
-            logger.info(f"📖 Procesando: {file_metadata['name']} ({file_metadata['size']/1024/1024:.1f} MB)")
-            
-            loader = PyPDFLoader(file_path)
-            docs = loader.load()
+            results = map_in_pool(pool, load_and_split_pdf, paths)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        
+        for file_metadata, (docs, fragments, error) in zip(parse_targets, results):
+            if error:
+                logger.error(f"❌ Error procesando {file_metadata['path']}: {error}")
+                continue
             new_documents.extend(docs)
-            processed_files.add(file_path)
-            
-            logger.info(f"✅ Procesado: {file_metadata['name']} - {len(docs)} páginas")
-            
-        except Exception as e:
-            logger.error(f"❌ Error procesando {file_path}: {e}")
-            continue
+            new_fragments_by_hash[file_metadata["hash"]] = fragments
+            try:
+                store.save(file_metadata["hash"], fragments)
+            except Exception as e:
+                logger.error(f"Error guardando fragmentos de {file_metadata['name']} en cache: {e}")
+            logger.info(f"✅ Procesado: {file_metadata['name']} - {len(docs)} páginas, {len(fragments)} fragmentos")
+        
+        logger.info(f"⏱️ {len(paths)} PDFs procesados en {(datetime.now() - parse_start).total_seconds():.2f}s")
+    
+    # Armar el corpus en el orden estable de los archivos
+    entries = []
+    indexed_metadata = []
+    for file_metadata in current_pdf_metadata:
+        file_hash = file_metadata["hash"]
+        if file_hash in new_fragments_by_hash:
+            count = len(new_fragments_by_hash[file_hash])
+        elif file_hash in cached_counts and store.has(file_hash):
+            count = cached_counts[file_hash]
+        else:
+            continue  # Falló el procesamiento de este PDF
+        entries.append((file_hash, count))
+        indexed_metadata.append({**file_metadata, "fragments": count})
     
-    all_fragments = existing_fragments.copy()
+    all_fragments = LazyFragmentList(store, entries, preloaded=new_fragments_by_hash)
     
-    if new_documents:
-        logger.info(f"🔧 Dividiendo {len(new_documents)} documentos en fragmentos...")
-        splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-        new_fragments = splitter.split_documents(new_documents)
-        all_fragments.extend(new_fragments)
-        logger.info(f"📄 Creados {len(new_fragments)} nuevos fragmentos (Total: {len(all_fragments)})")
+    # Las entradas de PDFs eliminados o reemplazados no se borran aquí: el corpus
+    # vigente puede seguir cargándolas hasta el intercambio (AISystem.prune_fragment_cache)
     
-    if all_fragments:
-        logger.info("💾 Guardando cache actualizado...")
-        
-        if save_fragments_cache(cache_dir, all_fragments):
-            logger.info("✅ Fragmentos guardados en cache")
-        
-        if save_cache_metadata(cache_dir, current_pdf_metadata, len(all_fragments)):
-            logger.info("✅ Metadatos guardados en cache")
+    if save_cache_metadata(cache_dir, indexed_metadata, len(all_fragments)):
+        logger.info("✅ Metadatos guardados en cache")
     
     logger.info(f"🎉 Procesamiento completado: {len(all_fragments)} fragmentos totales")
     return new_documents, all_fragments
 
 def analyze_question_complexity(question):
     """Analiza la complejidad de la pregunta para determinar el tipo de respuesta necesaria."""
-    detailed_patterns = [
-        r"explica|explicar|detalla|detallar|describe|describir|expón|exponer|desarrolla|desarrollar",
-        r"(¿cómo|como)(\s+se)?(\s+hace|\s+funciona|\s+realiza|\s+desarrolla|\s+implementa|\s+ejecuta|\s+lleva a cabo|\s+logra|\s+consigue)",
-        r"cuál es la (diferencia|distinción|discrepancia|divergencia)|diferencias entre|distingue entre|contrasta",
-        r"qué (significa|implica|conlleva|supone|involucra|representa|denota|comprende|abarca)",
-        r"profundiza|ahonda|elabora|amplía|ampliar|extiende|extender|expande|expandir",
-        r"analiza|analizar|análisis|examina|examinar|estudia|estudiar|investiga|investigar",
-        r"comparación|comparar|compara|coteja|cotejar|contrasta|contrastar|equipara|equiparar"
-    ]
-    
-    concise_patterns = [
-        r"^(¿)?(cuándo|cuando|donde|dónde|quién|quien|qué|que|cuál|cual)(\s+es|\s+son|\s+será|\s+fue|\s+fueron|\s+ha sido|\s+han sido)?\??$",
-        r"menciona|lista|enumera|nombra|cita|indica|señala|especifica",
-        r"(¿cuáles|cuales) son (los|las) (tipos|clases|categorías|variedades|modalidades|formas|ejemplos)"
-    ]
-    
-    word_count = len(question.split())
-    
-    for pattern in detailed_patterns:
-        if re.search(pattern, question.lower()):
-            return "detailed"
-    
-    for pattern in concise_patterns:
-        if re.search(pattern, question.lower()):
-            return "concise"
-    
-    if word_count <= 10:
-        return "concise"
-    else:
-        return "mixed"
+    return classify_question(question)[1]
+
+# Marcadores de referencia a turnos previos (anáforas, elipsis y continuaciones)
+_CONTEXT_REFERENCE_RE = re.compile(
+    r"\b(eso|esto|ese|esa|esos|esas|este|estos|estas|aquel|aquella|aquello|ello|dicho|dicha|"
+    r"anterior|anteriormente|previo|previa|mismo|misma|mencionaste|mencionado|mencionada|"
+    r"dijiste|explicaste|comentaste|hablaste|otro ejemplo|otra vez|de nuevo)\b"
+    r"|^[¿¡\s]*(y|pero|entonces|también|tambien|además|ademas)\b"
+    # Imperativos e infinitivos con pronombre enclítico ("explícalo", "dámelo",
+    # "compararlos"); no sustantivos con tilde como "cálculo" o "fórmula"
+    r"|\b(expl[ií]ca|mu[eé]stra|rep[ií]te|res[uú]me|ampl[ií]a|descr[ií]be|det[aá]lla|"
+    r"comp[aá]ra|acl[aá]ra|il[uú]stra|desarr[oó]lla|simplif[ií]ca|d[aá]|p[oó]n|h[aá]z)"
+    r"(me|nos)?(lo|la|los|las)\b"
+    r"|\b\w{3,}(ar|er|ir)(me|te|se|nos)?(lo|la|los|las)\b",
+    re.IGNORECASE
+)
+
+def question_needs_context(question):
+    """Indica si la pregunta depende de turnos anteriores para entenderse."""
+    if not question:
+        return False
+    if len(question.split()) <= 2:
+        return True
+    return _CONTEXT_REFERENCE_RE.search(question) is not None
 
 def extract_keywords(text):
     """Extrae palabras clave relevantes del texto de la pregunta."""
@@ -299,3 +258,9 @@ def extract_keywords(text):
             keywords.append(word)
     
     return keywords[:10] if len(keywords) > 10 else keywords
+
+def estimate_tokens(text, chars_per_token=4.0):
+    """Estimación rápida de tokens (~4 caracteres por token en español/inglés)."""
+    if not text:
+        return 0
+    return max(1, int(len(text) / chars_per_token))
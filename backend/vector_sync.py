@@ -0,0 +1,101 @@
+"""
+Sincronización Incremental del Vector Store
+===========================================
+
+Compara los IDs de fragmentos del corpus (hash del contenido) con los
+IDs guardados en la colección de ChromaDB y aplica solo la diferencia:
+- Los fragmentos nuevos se embeben con EmbeddingIndexBuilder (lotes
+  concurrentes con checkpoint) y se agregan (upsert) por lote
+- Los fragmentos que ya no existen se eliminan en lotes al final: si la
+  sincronización se interrumpe, la colección conserva el corpus anterior
+  completo (más parte del nuevo)
+- Los fragmentos sin cambios no se vuelven a embeber
+"""
+
+import time
+import logging
+from collections.abc import Sequence
+from typing import Dict, List, Set, Any
+
+from fragment_cache import get_fragment_id
+
+logger = logging.getLogger("vector_sync")
+
+
+def corpus_fragment_ids(fragments: Sequence) -> List[str]:
+    """IDs de los fragmentos del corpus, sin cargar contenido si la lista lo permite"""
+    if hasattr(fragments, "fragment_ids"):
+        return fragments.fragment_ids()
+    return [get_fragment_id(fragment) for fragment in fragments]
+
+
+def stored_fragment_ids(vector_store, page_size: int = 5000) -> Set[str]:
+    """IDs presentes en la colección, leídos por páginas"""
+    ids: Set[str] = set()
+    offset = 0
+    while True:
+        page = vector_store.get(include=[], limit=page_size, offset=offset)
+        page_ids = page.get("ids", [])
+        ids.update(page_ids)
+        if len(page_ids) < page_size:
+            return ids
+        offset += page_size
+
+
+def chroma_metadata(fragment) -> Dict[str, Any]:
+    """Metadatos aceptados por ChromaDB (solo valores escalares)"""
+    metadata = {
+        key: value for key, value in fragment.metadata.items()
+        if isinstance(value, (str, int, float, bool))
+    }
+    metadata["fragment_id"] = get_fragment_id(fragment)
+    return metadata
+
+
+def sync_vector_store(vector_store, fragments: Sequence, builder, collection,
+                      batch_size: int = 256) -> Dict[str, Any]:
+    """Lleva la colección al estado exacto del corpus actual.
+
+    ``collection`` es la colección de chromadb subyacente, donde se
+    escriben directamente los vectores que calcula ``builder``.
+    """
+    start = time.time()
+    ids = corpus_fragment_ids(fragments)
+
+    # Primer índice de cada ID: el contenido repetido se indexa una sola vez
+    desired: Dict[str, int] = {}
+    for index, fragment_id in enumerate(ids):
+        desired.setdefault(fragment_id, index)
+
+    existing = stored_fragment_ids(vector_store)
+    to_delete = [fragment_id for fragment_id in existing if fragment_id not in desired]
+    to_add = [fragment_id for fragment_id in desired if fragment_id not in existing]
+
+    if to_add:
+        docs = {fragment_id: fragments[desired[fragment_id]] for fragment_id in to_add}
+
+        def upsert(batch_ids, vectors):
+            collection.upsert(
+                ids=batch_ids,
+                embeddings=vectors,
+                documents=[docs[fragment_id].page_content for fragment_id in batch_ids],
+                metadatas=[chroma_metadata(docs[fragment_id]) for fragment_id in batch_ids]
+            )
+
+        builder.build(to_add, [docs[fragment_id].page_content for fragment_id in to_add], upsert)
+
+    for i in range(0, len(to_delete), batch_size):
+        vector_store.delete(ids=to_delete[i:i + batch_size])
+
+    stats = {
+        "fragments": len(desired),
+        "unchanged": len(desired) - len(to_add),
+        "added": len(to_add),
+        "deleted": len(to_delete),
+        "seconds": round(time.time() - start, 2)
+    }
+    logger.info(
+        f"🔄 Vector store sincronizado: +{stats['added']} / -{stats['deleted']} "
+        f"({stats['unchanged']} sin cambios) en {stats['seconds']}s"
+    )
+    return stats
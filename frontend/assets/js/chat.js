@@ -98,6 +98,13 @@ document.addEventListener('DOMContentLoaded', async () => {
     // Variables para el chat
     let currentSessionId = localStorage.getItem('currentSessionId') || generateSessionId();
     let history = [];
+    // Historiales ya cargados en esta página: al volver a una sesión solo se piden los mensajes nuevos
+    const sessionHistories = { [currentSessionId]: history };
+    const HISTORY_PAGE_SIZE = 50;
+    // Sesiones con mensajes anteriores a la primera página cargada (se piden al subir el scroll)
+    const sessionHasOlder = {};
+    let loadingOlderMessages = false;
+    let historySaveQueue = Promise.resolve();
     let lastQuestion = '';
     let lastAnswer = '';
     let messageRatings = {}; // Objeto para almacenar ratings: {respuesta: rating}
@@ -989,7 +996,20 @@ Prueba preguntandome sobre matematicas, programacion o cualquier tema academico!
     }
 
     // Función para guardar el historial de la sesión actual
-    async function saveSessionHistory() {
+    function saveSessionHistory() {
+        // Los guardados se encadenan: cada uno envía solo lo que el servidor aún no tiene
+        const sessionId = currentSessionId;
+        const sessionHistory = history;
+        historySaveQueue = historySaveQueue.then(() => persistPendingMessages(sessionId, sessionHistory));
+        return historySaveQueue;
+    }
+
+    // Envía los mensajes sin seq (nuevos) y los modificados; el servidor devuelve el seq de cada uno
+    async function persistPendingMessages(sessionId, sessionHistory) {
+        const pending = sessionHistory.filter(msg => msg.seq === undefined || msg.dirty);
+        if (pending.length === 0) return;
+        const sent = pending.map(({ seq, sender, text, timestamp }) => ({ seq, sender, text, timestamp }));
+
         try {
             const response = await fetch('/chat/history', {
                 method: 'POST',
@@ -998,24 +1018,107 @@ Prueba preguntandome sobre matematicas, programacion o cualquier tema academico!
                 },
                 body: JSON.stringify({
                     user_id: userId,
-                    session_id: currentSessionId,
-                    history: history
+                    session_id: sessionId,
+                    messages: sent
                 })
             });
+            const data = await response.json();
 
-            if (!response.ok) {
-                console.error('Error al guardar historial:', await response.json());
+            if (!response.ok || !Array.isArray(data.seqs)) {
+                console.error('Error al guardar historial:', data);
+                return;
             }
+            data.seqs.forEach((seq, i) => {
+                pending[i].seq = seq;
+                // Si el texto cambió mientras se guardaba, queda pendiente para el próximo envío
+                pending[i].dirty = pending[i].text !== sent[i].text;
+            });
         } catch (error) {
             console.error('Error al guardar historial:', error);
         }
     }
 
+    // Pide al servidor los mensajes posteriores a sinceSeq, página por página
+    async function fetchMessagesSince(sessionId, sinceSeq) {
+        const messages = [];
+        while (true) {
+            const response = await fetch(`/chat/history?user_id=${userId}&session_id=${sessionId}&since_seq=${sinceSeq}&limit=${HISTORY_PAGE_SIZE}`);
+            const page = await response.json();
+            if (!Array.isArray(page) || page.length === 0) break;
+            messages.push(...page);
+            sinceSeq = page[page.length - 1].seq;
+            if (page.length < HISTORY_PAGE_SIZE) break;
+        }
+        return messages;
+    }
+
+    // Muestra un mensaje guardado sin volver a guardarlo
+    function renderHistoryMessage(msg) {
+        // Determinar si es mensaje de bienvenida
+        const isWelcome = msg.sender === 'bot' && (
+            msg.text.includes('Hola') || 
+            msg.text.includes('Bienvenido') ||
+            msg.text.includes('capacidades')
+        );
+        addMessage(msg.text, msg.sender, false, isWelcome);
+    }
+
+    // Carga la página anterior del historial (before_seq) y la antepone sin mover la vista
+    async function loadOlderMessages() {
+        const sessionId = currentSessionId;
+        if (loadingOlderMessages || !sessionHasOlder[sessionId] || history.length === 0) return;
+        loadingOlderMessages = true;
+        try {
+            const firstSeq = history[0].seq;
+            const response = await fetch(`/chat/history?user_id=${userId}&session_id=${sessionId}&before_seq=${firstSeq}&limit=${HISTORY_PAGE_SIZE}`);
+            const page = await response.json();
+            // El usuario pudo cambiar de sesión mientras tanto
+            if (sessionId !== currentSessionId || !Array.isArray(page)) return;
+            
+            sessionHasOlder[sessionId] = page.length === HISTORY_PAGE_SIZE && page[0].seq > 1;
+            if (page.length === 0) return;
+            
+            const previousHeight = chatMessages.scrollHeight;
+            const previousTop = chatMessages.scrollTop;
+            const firstNode = chatMessages.firstChild;
+            const renderedBefore = chatMessages.children.length;
+            page.forEach(renderHistoryMessage);
+            // addMessage agrega al final: mover los mensajes nuevos al principio
+            Array.from(chatMessages.children).slice(renderedBefore).forEach(node => {
+                chatMessages.insertBefore(node, firstNode);
+            });
+            history.unshift(...page);
+            chatMessages.scrollTop = chatMessages.scrollHeight - previousHeight + previousTop;
+            console.log(`Mensajes anteriores cargados: ${page.length}`);
+        } catch (error) {
+            console.error('Error al cargar mensajes anteriores:', error);
+        } finally {
+            loadingOlderMessages = false;
+        }
+    }
+
+    chatMessages.addEventListener('scroll', () => {
+        if (chatMessages.scrollTop < 40) {
+            loadOlderMessages();
+        }
+    });
+
     // Función para cargar el historial de una sesión
     async function loadSessionHistory(sessionId) {
         try {
-            const response = await fetch(`/chat/history?user_id=${userId}&session_id=${sessionId}`);
-            const data = await response.json();
+            let data;
+            const cached = sessionHistories[sessionId];
+            if (cached) {
+                // Sesión ya cargada: solo se transfiere lo que falta (tras terminar los guardados en curso)
+                await historySaveQueue;
+                const lastSeq = cached.reduce((max, msg) => (msg.seq > max ? msg.seq : max), 0);
+                data = cached.concat(await fetchMessagesSince(sessionId, lastSeq));
+            } else {
+                // Primera carga: la página más reciente; las anteriores se piden al subir el scroll
+                const response = await fetch(`/chat/history?user_id=${userId}&session_id=${sessionId}&limit=${HISTORY_PAGE_SIZE}`);
+                data = await response.json();
+                sessionHasOlder[sessionId] = Array.isArray(data) && data.length > 0 && data[0].seq > 1;
+            }
             
             if (Array.isArray(data) && data.length > 0) {
                 // Actualizar el ID de sesión actual
@@ -1024,30 +1127,27 @@ Prueba preguntandome sobre matematicas, programacion o cualquier tema academico!
                 
                 // Actualizar el historial
                 history = data;
+                sessionHistories[sessionId] = history;
                 
                 // Limpiar el chat actual
                 chatMessages.innerHTML = '';
                 
-                // Mostrar mensajes del historial
-                history.forEach(msg => {
-                    // Determinar si es mensaje de bienvenida
-                    const isWelcome = msg.sender === 'bot' && (
-                        msg.text.includes('Hola') || 
-                        msg.text.includes('Bienvenido') ||
-                        msg.text.includes('capacidades')
-                    );
-                    
-                    // Agregar mensaje sin guardar (ya está en el historial)
-                    addMessage(msg.text, msg.sender, false, isWelcome);
-                });
+                // Mostrar mensajes del historial (sin guardar: ya están en el historial)
+                history.forEach(renderHistoryMessage);
                 
                 console.log(`Historial cargado: ${data.length} mensajes`);
+                
+                // Si la primera página no llena la vista no hay scroll posible: seguir cargando
+                if (sessionHasOlder[sessionId] && chatMessages.scrollHeight <= chatMessages.clientHeight) {
+                    loadOlderMessages();
+                }
             } else {
                 console.log('No hay mensajes en esta sesión');
                 // Actualizar el ID de sesión actual de todos modos
                 currentSessionId = sessionId;
                 localStorage.setItem('currentSessionId', sessionId);
                 history = [];
+                sessionHistories[sessionId] = history;
                 chatMessages.innerHTML = '';
             }
         } catch (error) {
@@ -1279,14 +1379,17 @@ Prueba preguntandome sobre matematicas, programacion o cualquier tema academico!
             let accumulatedResponse = '';
             let isStreaming = false;
             let hasStarted = false;
+            let sseBuffer = '';
 
             while (true) {
                 const { done, value } = await reader.read();
                 
                 if (done) break;
 
-                const chunk = decoder.decode(value);
-                const lines = chunk.split('\n');
+                // Acumular en buffer: un evento SSE puede llegar partido entre lecturas
+                sseBuffer += decoder.decode(value, { stream: true });
+                const lines = sseBuffer.split('\n');
+                sseBuffer = lines.pop();
 
                 for (const line of lines) {
                     if (line.startsWith('data: ')) {
@@ -1312,9 +1415,18 @@ Prueba preguntandome sobre matematicas, programacion o cualquier tema academico!
                             
                             // Manejar diferentes tipos de eventos SSE
                             if (jsonData.status === 'completed' && jsonData.result && jsonData.result.response) {
-                                // La respuesta está completa, ahora simular streaming palabra por palabra
                                 const fullResponse = jsonData.result.response;
                                 
+                                // Si los tokens ya se mostraron en tiempo real, solo reemplazar por la versión final
+                                if (botMessageElements && accumulatedResponse) {
+                                    await convertStreamingToCompleteMessage(botMessageElements, fullResponse);
+                                    finalizeBotMessage(fullResponse);
+                                    await getSuggestions();
+                                    return true;
+                                }
+                                
+                                // La respuesta está completa, ahora simular streaming palabra por palabra
+                                
                                 // Crear elemento del mensaje si no existe
                                 if (!botMessageElements) {
                                     botMessageElements = createBotMessage(true); // Mostrar loader inicialmente
@@ -1535,6 +1647,7 @@ Prueba preguntandome sobre matematicas, programacion o cualquier tema academico!
         } else {
             // Actualizar el último mensaje del bot si ya existe
             history[history.length - 1].text = text;  // Texto completo con etiqueta
+            history[history.length - 1].dirty = true;
         }
         
         // Guardar historial actualizado
@@ -1561,6 +1674,7 @@ Prueba preguntandome sobre matematicas, programacion o cualquier tema academico!
         currentSessionId = generateSessionId();
         localStorage.setItem('currentSessionId', currentSessionId);
         history = [];
+        sessionHistories[currentSessionId] = history;
         messageRatings = {};
         chatMessages.innerHTML = '';
         suggestionContainer.innerHTML = '';
@@ -183,4 +183,27 @@ CREATE TABLE `stress_tests` (
         ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
-
+-- -----------------------------------------------------
+-- Tabla: chat_messages
+-- Un mensaje por fila; seq es correlativo dentro de cada sesión.
+-- La clave primaria (user_id, session_id, seq) sirve la paginación
+-- por clave de /chat/history (since_seq / before_seq).
+-- -----------------------------------------------------
+DROP TABLE IF EXISTS `chat_messages`;
+CREATE TABLE `chat_messages` (
+    `user_id` INT NOT NULL,
+    `session_id` VARCHAR(255) NOT NULL,
+    `seq` INT NOT NULL,
+    `sender` VARCHAR(20) NOT NULL,
+    `text` MEDIUMTEXT NOT NULL,
+    `timestamp` VARCHAR(40) NULL,  -- ISO 8601 tal como lo envía el frontend
+    `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    
+    PRIMARY KEY (`user_id`, `session_id`, `seq`),
+    
+    CONSTRAINT `fk_messages_session`
+        FOREIGN KEY (`user_id`, `session_id`)
+        REFERENCES `chat_sessions` (`user_id`, `session_id`)
+        ON DELETE CASCADE
+        ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;